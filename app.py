@@ -11,6 +11,10 @@ Modules:
 - database.db: Handles database connections and initialization.
 - utils.config: Application configuration settings.
 - utils.email_service: Handles email functionalities.
+- utils.email_outbox: Transactional email outbox and its delivery worker (`flask email` commands).
+- utils.backfill: Resumable batched data backfills (`flask backfill` commands).
+- utils.metrics: Request latency histograms and other in-process metrics.
+- utils.profiler: On-demand cProfile reports of admin requests (`?profile=1`).
 - controller (auth, registration, match, admin): Defines routes and logic for user authentication, 
 registration, matching, and admin functionalities.
 
@@ -24,7 +28,7 @@ load_dotenv()
 import os
 from flask import Flask, redirect, url_for, render_template
 from database.db import db, init_db  # Import the SQLAlchemy instance and initialization function
-from utils import config
+from utils import config, metrics
 from utils.utils import add_test_esner_and_admin_role  # Import configuration settings
 
 """
@@ -86,6 +90,7 @@ def page_not_found(e):
     return render_template('utils/errors.html', code=404), 200
 
 init_db(app)
+metrics.init_app(app)
 migrate = Migrate(app, db)
 
 # Auto-run migrations in production environment
@@ -110,3 +115,15 @@ app.register_blueprint(controller.buddy_program.bp)
 app.register_blueprint(controller.esner.bp)
 app.register_blueprint(controller.buddy.bp)
 app.register_blueprint(controller.admin.bp)
+
+# Profile the requests of admins asking for it; registered after the blueprints, which load g.esner
+from utils import profiler
+profiler.init_app(app)
+
+# Register the data backfill commands (flask backfill ...)
+from utils.backfill import backfill_cli
+app.cli.add_command(backfill_cli)
+
+# Register the email outbox worker commands (flask email ...)
+from utils.email_outbox import email_cli
+app.cli.add_command(email_cli)
@@ -1,16 +1,19 @@
 from flask import (
-    Blueprint, flash, g, jsonify, redirect, render_template, request, send_file, session, url_for
+    Blueprint, Response, flash, g, jsonify, redirect, render_template, request, send_file, session, url_for
 )
 from sqlalchemy import case, func, or_
 from sqlalchemy.orm import joinedload
 import json
+import os
 from werkzeug.security import check_password_hash, generate_password_hash
-from controller.buddy_program.match import create_exel
+from controller.buddy_program.match import backpressure_response, create_exel
 
 from database.tables import Buddy, Esner, EsnerRole, Role
 from database.db import db
 from controller.auth import admin_required, buddy_program_admin_required, login_required
 from utils.email_service import email_service
+from utils.email_dispatcher import EmailBackpressure
+from utils import buddy_counts, match_proposals, metrics, profile_attributes, profiler, score_store
 
 # Create a blueprint for admin-related routes with URL prefix '/admin'
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -31,6 +34,59 @@ def index():
     esners = Esner.query.outerjoin(Esner.roles).outerjoin(Role).options(joinedload(Esner.roles)).all()    
     return render_template("admin/index.html", esners=esners)
 
+@bp.route('/metrics', methods=['GET'])
+@login_required
+@admin_required
+def metrics_endpoint():
+    """
+    Expose the in-process metrics in the Prometheus text format.
+
+    GET request:
+      - Renders the request latency, matching phase and email histograms and counters
+        recorded by this process (see utils.metrics).
+
+    :return: Plain text response in the Prometheus exposition format (version 0.0.4).
+    """
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@bp.route('/profiles', methods=['GET'])
+@bp.route('/profiles/<report_id>', methods=['GET'])
+@login_required
+@admin_required
+def profiles(report_id=None):
+    """
+    List the stored request profiles and show one of them.
+
+    GET request:
+      - Lists the recent profiles (see utils.profiler), newest first.
+      - With a report id, also shows its top functions and SQL time.
+
+    :param report_id: Optional id of the profile to show.
+    :return: Rendered HTML template, or a 404 error page for an unknown profile.
+    """
+    report = None
+    if report_id is not None:
+        report = profiler.load_report(report_id)
+        if report is None:
+            return render_template("utils/errors.html", code=404), 404
+    return render_template("admin/profiles.html", reports=profiler.list_reports(), report=report)
+
+@bp.route('/profiles/<report_id>/download', methods=['GET'])
+@login_required
+@admin_required
+def download_profile(report_id):
+    """
+    Download the raw cProfile data of a profile, readable with pstats or snakeviz.
+
+    :param report_id: Id of the profile.
+    :return: The .prof file, or a 404 error page for an unknown profile.
+    """
+    path = profiler.report_path(report_id, 'prof')
+    if path is None or not os.path.exists(path):
+        return render_template("utils/errors.html", code=404), 404
+    return send_file(path, as_attachment=True, download_name=f"{report_id}.prof",
+                     mimetype="application/octet-stream")
+
 @bp.route('/esner/<int:esner_id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
 @admin_required
@@ -75,6 +131,7 @@ def esner_info(esner_id):
             if request.method == "DELETE":
                 if esner.id != g.esner.id:
                     if len(esner.buddies) == 0:
+                        score_store.forget_esner(esner.id)
                         db.session.delete(esner)
                         email_service.send_data_elimination_notification(esner.name, esner.email)
                         db.session.commit()
@@ -86,6 +143,9 @@ def esner_info(esner_id):
                 return jsonify({"message": "Admin removed successfully!"}), 200
         
         return render_template("utils/errors.html", code=404)
+    except EmailBackpressure as e:
+        db.session.rollback()
+        return backpressure_response(e)
     except Exception as e: 
         return jsonify({"error": "Internal Server Error"}), 403
 
@@ -102,6 +162,8 @@ def manage_esner_role(esner_id):
     DELETE request:
       - Removes a role from the ESNer, ensuring at least one admin remains.
 
+    Both increment the ESNer's `roles_version`, invalidating the role claim cached in their session.
+
     :param esner_id: ID of the ESNer to manage roles for.
     :return: JSON response indicating success or error.
     """
@@ -116,6 +178,7 @@ def manage_esner_role(esner_id):
                     if not EsnerRole.query.filter_by(esner_id=esner_id, role_id=role_id).first():
                         esner_role = EsnerRole(esner_id=esner_id, role_id=role_id)
                         db.session.add(esner_role)
+                        esner.roles_version = Esner.roles_version + 1
                         db.session.commit()
                         return jsonify({"message": "Role added successfully!"}), 200
                 else:
@@ -132,6 +195,7 @@ def manage_esner_role(esner_id):
                         return jsonify({"error": "Cannot delete the only admin"}), 400
 
                     db.session.delete(esner_role)
+                    esner.roles_version = Esner.roles_version + 1
                     db.session.commit()
                     return jsonify({"message": "Role removed successfully!"}), 200
     except Exception as e:
@@ -162,8 +226,12 @@ def remove_all():
         buddies = Buddy.query.all()
         esners = Esner.query.all()
 
+        score_store.clear()
+        match_proposals.clear()
         Buddy.query.delete()
         Esner.query.filter(~Esner.roles.any()).delete()
+        buddy_counts.clear()
+        profile_attributes.prune()
         db.session.commit()
     
         # Generate the Excel file and return it as an attachment.
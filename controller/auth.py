@@ -7,7 +7,8 @@ Blueprint:
     - auth: Handles authentication-related routes with the URL prefix `/auth`.
 
 Functions:
-    - load_logged_in_user(): Loads the logged-in admin user before each request.
+    - load_logged_in_user(): Loads the logged-in admin user and their roles before each request.
+    - load_role_names(esner_id): Loads the role names of an Esner with a single query.
     - login_required(view): Decorator that restricts access to logged-in users.
     - admin_required(view): Decorator that restricts access to admin users.
     - buddy_program_admin_required(view): Decorator that restricts access to Buddy Program Admin users.
@@ -22,9 +23,8 @@ from operator import or_
 import random
 import string
 from flask import (
-    Blueprint, flash, g, jsonify, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, jsonify, redirect, render_template, request, session, url_for
 )
-from sqlalchemy import and_
 from werkzeug.security import check_password_hash, generate_password_hash
 from database.tables import Esner, EsnerRole, PasswordResetToken, Role, db
 from utils.email_service import email_service
@@ -34,6 +34,52 @@ import secrets
 # Create a blueprint for authentication with the URL prefix '/auth'
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Role name -> flags set on g.esner
+ROLE_FLAGS = {
+    "Admin": ("admin",),
+    "Buddy Program Admin": ("buddy_program_admin", "buddy_program_manager"),
+    "Buddy Program Manager": ("buddy_program_manager",),
+}
+
+# Format of the role claim stored in the session; bump it when the claim changes shape
+ROLE_CLAIM_FORMAT = 1
+
+# Role id -> role name, loaded once per process (roles are only created at setup)
+_role_names = {}
+
+
+def get_role_names(role_ids):
+    """
+    Returns the names of the given roles, from the per-process cache.
+
+    The cache is reloaded when an unknown role id is requested.
+
+    Args:
+        role_ids (list): Role ids.
+
+    Returns:
+        list: Names of the known roles.
+    """
+    if any(role_id not in _role_names for role_id in role_ids):
+        _role_names.clear()
+        _role_names.update(db.session.query(Role.id, Role.name).all())
+    return [_role_names[role_id] for role_id in role_ids if role_id in _role_names]
+
+
+def load_role_names(esner_id):
+    """
+    Loads the role names of an Esner with a single query on the EsnerRole table.
+
+    Args:
+        esner_id (int): Id of the Esner.
+
+    Returns:
+        list: Sorted role names.
+    """
+    role_ids = [role_id for role_id, in db.session.query(EsnerRole.role_id).filter(EsnerRole.esner_id == esner_id)]
+    return sorted(get_role_names(role_ids))
+
+
 @bp.before_app_request
 def load_logged_in_user():
     """
@@ -43,63 +89,40 @@ def load_logged_in_user():
     Esner object into the global `g` object for easy access throughout the request lifecycle.
     It also determines the user's roles and sets appropriate flags for admin, buddy program admin,
     and buddy program manager roles.
+
+    With AUTH_ROLE_CLAIM, the role names are kept in the session (signed with SECRET_KEY like
+    the rest of the session cookie) together with the Esner's `roles_version`. While the
+    version is unchanged no role query runs; `manage_esner_role` increments it, so the next
+    request of that Esner reloads its roles with a single query.
     """
     esner_id = session.get('esner_id')
-    g.esner = Esner.query.get(esner_id) if esner_id else None
+    g.esner = db.session.get(Esner, esner_id) if esner_id else None
     if g.esner:
+        use_claim = current_app.config.get("AUTH_ROLE_CLAIM", False)
+        claim = session.get('roles') if use_claim else None
+        if (
+            isinstance(claim, dict)
+            and claim.get('format') == ROLE_CLAIM_FORMAT
+            and claim.get('esner_id') == g.esner.id
+            and claim.get('version') == g.esner.roles_version
+        ):
+            role_names = claim['names']
+        else:
+            role_names = load_role_names(g.esner.id)
+            if use_claim:
+                session['roles'] = {
+                    'format': ROLE_CLAIM_FORMAT,
+                    'esner_id': g.esner.id,
+                    'version': g.esner.roles_version,
+                    'names': role_names,
+                }
+
         g.esner.admin = False
         g.esner.buddy_program_admin = False
         g.esner.buddy_program_manager = False
-
-        admin_role = Role.query.filter_by(name="Admin").first()
-        esner = (
-            Esner.query
-            .join(Esner.roles)
-            .join(Role)
-            .filter(
-                and_(
-                    EsnerRole.role_id == admin_role.id,
-                    EsnerRole.esner_id == g.esner.id
-                )
-            )
-            .first()
-        )
-        if esner:
-            g.esner.admin = True
-
-        admin_buddy_program_role = Role.query.filter_by(name="Buddy Program Admin").first()
-        esner = (
-            Esner.query
-            .join(Esner.roles)
-            .join(Role)
-            .filter(
-                and_(
-                    EsnerRole.role_id == admin_buddy_program_role.id,
-                    EsnerRole.esner_id == g.esner.id
-                )
-            )
-            .first()
-        )
-
-        if esner:
-            g.esner.buddy_program_admin = True
-            g.esner.buddy_program_manager = True
-        else:
-            manager_buddy_program_role = Role.query.filter_by(name="Buddy Program Manager").first()
-            esner = (
-                Esner.query
-                .join(Esner.roles)
-                .join(Role)
-                .filter(
-                    and_(
-                        EsnerRole.role_id == manager_buddy_program_role.id,
-                        EsnerRole.esner_id == g.esner.id
-                    )
-                )
-                .first()
-            )
-            if esner:
-                g.esner.buddy_program_manager = True  
+        for name in role_names:
+            for flag in ROLE_FLAGS.get(name, ()):
+                setattr(g.esner, flag, True)
 
 def login_required(view):
     """
@@ -275,6 +298,8 @@ def forgot_password():
                     db.session.commit()
                 reset_link = url_for('auth.reset_password', token=token, _external=True)
                 email_service.send_reset_password_email(esner.email, reset_link)
+                # Commits the email queued in the outbox
+                db.session.commit()
             return jsonify({"message": "A password reset link has been sent to your email if it exists in our system."}), 200
 
     except Exception as e:
@@ -1,11 +1,12 @@
 from flask import (
-    Blueprint, g, jsonify, render_template, request
+    Blueprint, current_app, g, jsonify, render_template, request
 )
 import json
 from sqlalchemy import or_
 from database.tables import Buddy, Esner
 from database.db import db
 from utils.email_service import email_service
+from utils import score_store
 from utils.utils import load_options
 
 # Create a blueprint for registration-related routes, with URL prefix '/buddy'
@@ -76,6 +77,9 @@ def registration():
             
             # Add the new Buddy to the database and commit the transaction.
             db.session.add(new_buddy)
+            if current_app.config.get("MATCH_SCORE_STORE", False):
+                db.session.flush()
+                score_store.store_buddy(new_buddy)
             email_service.send_registration_confirmation(new_buddy)
             db.session.commit()
             
@@ -10,25 +10,36 @@ Blueprint:
 Functions:
     - automatic_match(): Automatically assigns Buddies to ESNers based on available slots.
     - manual_match(): Displays ESNers and Buddies for manual matching.
+    - list_buddies(), list_esners(): Keyset-paginated JSON lists loaded by the manual match page.
     - confirm_match(): Confirms a match between a Buddy and an ESNer.
     - remove_match(): Removes an existing match.
     - remove_buddy(): Deletes a Buddy from the database.
     - remove_esner(): Deletes an ESNer from the database (only if they have no assigned Buddies).
+    - automatic_match_background(): Page running the automatic matching as a background job.
+    - start_match_job(), match_job_status(), match_job_result(): Start, poll and show a background job.
+    - run_match_jobs(): CLI worker (`flask match run-jobs`) processing queued jobs.
+    - check_buddy_counts(): CLI check (`flask match check-buddy-counts`) of the Esner buddy counters.
+    - fill_score_store(): CLI (`flask match fill-score-store`) storing the missing or stale match scores.
+    - backpressure_response(error): 503 response of a change whose emails hit the sending limits.
 """
 
 from io import BytesIO
+import math
 import smtplib
-from flask import Blueprint, g, jsonify, render_template, request, send_file
+import time
+import click
+from flask import Blueprint, current_app, g, jsonify, render_template, request, send_file, url_for
 import openpyxl
-from sqlalchemy import asc, case, func
 from utils.email_service import email_service
-from utils.match import match_making
-from database.tables import Buddy, Esner
+from utils import buddy_counts, match_jobs, match_proposals, metrics, profile_pages, score_store
+from utils.email_dispatcher import EmailBackpressure
+from utils.profile_encoding import get_vocabulary
+from database.tables import Buddy, Esner, MatchJob
 from database.db import db
 from controller.auth import buddy_program_admin_required, buddy_program_manager_required, login_required
 
 # Create a Blueprint for the match module with the URL prefix '/match'
-bp = Blueprint('match', __name__, url_prefix='/match')
+bp = Blueprint('match', __name__, url_prefix='/match', cli_group='match')
 
 
 @bp.route('/automatic_match', methods=['GET'])
@@ -38,37 +49,200 @@ def automatic_match():
     """
     Automatically assigns Buddies to ESNers based on availability.
 
-    - Retrieves ESNers with open buddy slots.
-    - Retrieves unmatched Buddies.
-    - Uses match_making utility to create matches.
-    - Returns the match results in an HTML template.
+    - With MATCH_PROPOSALS, reuses the stored proposals of the latest run when the Buddy and
+      ESNer data hasn't changed since it was computed.
+    - Otherwise retrieves ESNers with open buddy slots and unmatched Buddies.
+    - Uses match_making utility to create matches, or assignment_match_making when
+      the `mode` query parameter (default: AUTOMATIC_MATCH_MODE) is "assignment".
+    - With MATCH_SCORE_STORE, reads the score matrix from the persisted score store and
+      only computes the entries of new or edited profiles.
+    - Otherwise, with MATCH_CANDIDATE_PRUNING, scores only the pairs found through the
+      inverted attribute index and reports how many pairs were pruned.
+    - Otherwise, with MATCH_PARALLEL_WORKERS > 1, scores blocks of Buddies in a process pool.
+    - Stores the new run's proposals (MATCH_PROPOSALS) and returns the match results in an HTML template.
+    - Times the load, score, select and render phases in the match_phase_duration_seconds metric.
 
     Returns:
         - On success: Rendered template with match data (HTTP 200).
         - On failure: Error message template (HTTP 400 or 500).
     """
     # try:
-    esners = (
-        Esner.query
-        .outerjoin(Buddy, Esner.id == Buddy.esn_member_id)
-        .group_by(Esner.id)
-        .having(func.count(Buddy.id) < Esner.max_number_of_buddy)
-        .all()
-    )      
-    buddies = Buddy.query.filter_by(esn_member_id=None).all()
+    mode = request.args.get("mode", current_app.config.get("AUTOMATIC_MATCH_MODE", "greedy"))
+    if mode != "assignment":
+        mode = "greedy"
+
+    use_proposals = current_app.config.get("MATCH_PROPOSALS", False)
+    if use_proposals:
+        fingerprint = match_proposals.cohort_fingerprint()
+        run = match_proposals.load_run(fingerprint, mode)
+        if run is not None:
+            _, created_at, data = run
+            with metrics.MATCH_PHASE_DURATION.time('render'):
+                page = render_template("match/automatic_match.html", data=data, mode=mode, stats=None,
+                                       run_created_at=created_at)
+            return page, 200
+
+    buddies, esners = match_proposals.load_cohort()
 
     if not esners or not buddies:
         return render_template("utils/errors.html", code=400, message="Not enough data for auto-matching"), 400
     
+    match_matrix, stats = match_proposals.score_cohort(buddies, esners)
 
-    data = match_making(buddies, esners)
-    
-    return render_template("match/automatic_match.html", data=data), 200
+    proposals = match_proposals.select_proposals(buddies, esners, mode, match_matrix)
+    data = match_proposals.proposal_profiles(proposals)
+
+    # Rendered before the commit, which would expire the loaded profiles and reload them one by one
+    with metrics.MATCH_PHASE_DURATION.time('render'):
+        page = render_template("match/automatic_match.html", data=data, mode=mode, stats=stats)
+
+    if use_proposals:
+        match_proposals.save_run(proposals, fingerprint, mode)
+        db.session.commit()
+    return page, 200
     # except Exception as e:
     #     print(e)
     #     return render_template("utils/errors.html", code=500), 500
 
 
+@bp.route('/automatic_match/background', methods=['GET'])
+@login_required
+@buddy_program_manager_required
+def automatic_match_background():
+    """
+    Page running the automatic matching as a background job.
+
+    - Starts a job for the selected `mode`, polls its status and shows the progress.
+    - Loads the results page when the job finishes.
+
+    Returns:
+        - Rendered template with the progress page (HTTP 200).
+    """
+    mode = request.args.get("mode", current_app.config.get("AUTOMATIC_MATCH_MODE", "greedy"))
+    if mode != "assignment":
+        mode = "greedy"
+    return render_template("match/automatic_match_job.html", mode=mode), 200
+
+
+@bp.route('/jobs', methods=['POST'])
+@login_required
+@buddy_program_manager_required
+def start_match_job():
+    """
+    Starts an automatic matching job.
+
+    - Reads the matching `mode` from the JSON body ("greedy" or "assignment").
+    - Stores a queued job, started according to MATCH_JOB_RUNNER.
+
+    Returns:
+        - The job id and its status URL (HTTP 202).
+    """
+    data = request.get_json(silent=True) or {}
+    mode = data.get("mode", current_app.config.get("AUTOMATIC_MATCH_MODE", "greedy"))
+    if mode != "assignment":
+        mode = "greedy"
+
+    job = match_jobs.create_job(mode)
+    return jsonify({
+        "job_id": job.id,
+        "status_url": url_for('buddyprogram.match.match_job_status', job_id=job.id),
+    }), 202
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+@buddy_program_manager_required
+def match_job_status(job_id):
+    """
+    Reports the progress of an automatic matching job.
+
+    - With the "poll" runner, advances the job for at most MATCH_JOB_POLL_SECONDS first.
+    - Adds the results URL once the job has finished.
+
+    Returns:
+        - Job status, Buddies scored, total Buddies and elapsed seconds (HTTP 200).
+        - Error message (HTTP 404).
+    """
+    job = db.session.get(MatchJob, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    if current_app.config.get("MATCH_JOB_RUNNER", "poll") == "poll" and job.status in ('queued', 'running'):
+        match_jobs.advance_job(job.id, current_app.config.get("MATCH_JOB_POLL_SECONDS", 5))
+        job = db.session.get(MatchJob, job_id)
+
+    status = match_jobs.job_status(job)
+    if job.status == 'finished':
+        status["result_url"] = url_for('buddyprogram.match.match_job_result', job_id=job.id)
+    return jsonify(status), 200
+
+
+@bp.route('/jobs/<job_id>/result', methods=['GET'])
+@login_required
+@buddy_program_manager_required
+def match_job_result(job_id):
+    """
+    Shows the proposals computed by a finished automatic matching job.
+
+    Returns:
+        - Rendered template with match data (HTTP 200).
+        - Error message template (HTTP 400 or 404).
+    """
+    job = db.session.get(MatchJob, job_id)
+    if not job:
+        return render_template("utils/errors.html", code=404), 404
+    if job.status != 'finished':
+        return render_template("utils/errors.html", code=400, message="The matching job has not finished"), 400
+
+    data = match_proposals.load_run_proposals(job.run_id)
+    with metrics.MATCH_PHASE_DURATION.time('render'):
+        page = render_template("match/automatic_match.html", data=data, mode=job.mode, stats=None,
+                               run_created_at=job.finished_at)
+    return page, 200
+
+
+@bp.cli.command('run-jobs')
+@click.option('--watch', is_flag=True, help="Keep polling for new jobs instead of exiting.")
+@click.option('--interval', default=2.0, help="Seconds between two polls with --watch.")
+def run_match_jobs(watch, interval):
+    """Process the queued automatic matching jobs (MATCH_JOB_RUNNER = "queue")."""
+    while True:
+        processed = match_jobs.run_queued_jobs()
+        if processed:
+            print(f"Processed {processed} matching job(s)")
+        if not watch:
+            break
+        time.sleep(interval)
+
+
+@bp.cli.command('check-buddy-counts')
+@click.option('--repair', is_flag=True, help="Recompute the counters that don't match.")
+def check_buddy_counts(repair):
+    """Compare the ESNer buddy counters with the assigned Buddies, optionally repairing them."""
+    drift = buddy_counts.find_drift()
+    for esner_id, stored, actual in drift:
+        print(f"ESNer {esner_id}: buddy_count is {stored}, {actual} Buddies assigned")
+    if not drift:
+        print("All buddy counters are consistent")
+    elif repair:
+        repaired = buddy_counts.repair()
+        db.session.commit()
+        print(f"Repaired {repaired} buddy counter(s)")
+
+
+@bp.cli.command('fill-score-store')
+@click.option('--batch-size', default=500, help="Buddies scored and committed per batch.")
+def fill_score_store(batch_size):
+    """Store the missing or stale match scores of the matching cohort (MATCH_SCORE_STORE), so page views only read them."""
+    buddies, esners = match_proposals.load_cohort()
+    computed = 0
+    for start in range(0, len(buddies), batch_size):
+        _, stats = score_store.load_match_matrix(buddies[start:start + batch_size], esners, write_back=True)
+        db.session.commit()
+        computed += stats['computed']
+    print(f"Stored {computed} match scores for {len(buddies)} Buddies and {len(esners)} ESNers")
+
+
 @bp.route('/manual_match', methods=['GET'])
 @login_required
 @buddy_program_manager_required
@@ -76,27 +250,108 @@ def manual_match():
     """
     Displays ESNers and Buddies for manual matching.
 
-    - Orders ESNers by the number of Buddies they have.
-    - Orders Buddies by whether they are matched and by their registration date.
+    - Renders the page with its filters only; the rows are loaded page by page from
+      `list_buddies` and `list_esners` while the tables are scrolled.
 
     Returns:
-        - Rendered template with ESNers and Buddies for matching.
+        - Rendered template with the filter options and the page size.
     """
-    # try:
-    esners = Esner.query.outerjoin(Buddy).group_by(Esner.id).order_by(func.count(Buddy.id)).all()
-    
-    buddies = Buddy.query.order_by(
-        case(
-            (Buddy.esn_member_id.isnot(None), 1),
-            else_=0
-        ),
-        asc(Buddy.date_of_insert)
-    ).all()    
-
-    return render_template("match/manual_match.html", esners=esners, buddies=buddies)
-    # except Exception as e:
-    #     print(e)
-    #     return render_template("utils/errors.html", code=500), 500
+    return render_template(
+        "match/manual_match.html",
+        languages=get_vocabulary()['languages'],
+        page_size=current_app.config.get("MANUAL_MATCH_PAGE_SIZE", 50),
+    )
+
+
+def _flag(name):
+    """Reads a "true"/"false" query parameter, returning None when it is missing or empty."""
+    value = request.args.get(name, "").lower()
+    if value in ("true", "1"):
+        return True
+    if value in ("false", "0"):
+        return False
+    return None
+
+
+def _page_arguments():
+    """Reads the `after` cursor and the `limit` query parameters (ValueError if malformed)."""
+    after = request.args.get("after")
+    limit = request.args.get("limit", type=int) or current_app.config.get("MANUAL_MATCH_PAGE_SIZE", 50)
+    return (profile_pages.decode_cursor(after) if after else None), limit
+
+
+@bp.route('/api/buddies', methods=['GET'])
+@login_required
+@buddy_program_manager_required
+def list_buddies():
+    """
+    Lists Buddies in keyset-paginated pages, unmatched first.
+
+    - Query parameters: `after` (cursor of the previous page), `limit`, `matched`
+      ("true"/"false"), `semester`, `gender`, `language` and `q` (search text).
+
+    Returns:
+        - The page items, the next page cursor and, on the first page, the total (HTTP 200).
+        - Error message for an invalid cursor (HTTP 400).
+    """
+    try:
+        after, limit = _page_arguments()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filters = {
+        'matched': _flag("matched"),
+        'semester': request.args.get("semester"),
+        'gender': request.args.get("gender"),
+        'language': request.args.get("language"),
+        'q': request.args.get("q", "").strip(),
+    }
+    return jsonify(profile_pages.buddy_page(filters, after, limit)), 200
+
+
+@bp.route('/api/esners', methods=['GET'])
+@login_required
+@buddy_program_manager_required
+def list_esners():
+    """
+    Lists ESNers in keyset-paginated pages, the ones with the fewest Buddies first.
+
+    - Query parameters: `after` (cursor of the previous page), `limit`, `available`
+      ("true" for ESNers with free slots, "false" for full ones), `gender`, `language`
+      and `q` (search text).
+
+    Returns:
+        - The page items, the next page cursor and, on the first page, the total (HTTP 200).
+        - Error message for an invalid cursor (HTTP 400).
+    """
+    try:
+        after, limit = _page_arguments()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filters = {
+        'available': _flag("available"),
+        'gender': request.args.get("gender"),
+        'language': request.args.get("language"),
+        'q': request.args.get("q", "").strip(),
+    }
+    return jsonify(profile_pages.esner_page(filters, after, limit)), 200
+
+
+def backpressure_response(error):
+    """
+    Response of a change refused because its emails can't be sent now (sending limits reached).
+
+    Args:
+        error (EmailBackpressure): The refusal, with the estimated seconds before a retry.
+
+    Returns:
+        - Error message with a Retry-After header (HTTP 503).
+    """
+    retry_after = max(math.ceil(error.retry_after), 1)
+    return jsonify({
+        "error": f"Emails can't be sent right now ({error}), please retry in {retry_after} seconds"
+    }), 503, {"Retry-After": str(retry_after)}
 
 
 @bp.route('/confirm_match', methods=['POST'])
@@ -106,7 +361,9 @@ def confirm_match():
     """
     Confirms a match between a Buddy and an ESNer.
 
-    - Updates the Buddy's `esn_member_id`.
+    - Updates the Buddy's `esn_member_id` and the buddy counters of the ESNers.
+    - With MATCH_PROPOSALS, marks the stored proposal as confirmed and invalidates the
+      other proposals of the Buddy and of the ESNer.
     - Sends match confirmation emails.
     - Handles various SMTP errors for email notifications.
 
@@ -124,13 +381,24 @@ def confirm_match():
         if not buddy or not esner:
             return jsonify({"error": "Buddy or ESNer not found"}), 404
 
-        buddy.esn_member_id = esner.id
+        use_proposals = current_app.config.get("MATCH_PROPOSALS", False)
+        if use_proposals:
+            fingerprint = match_proposals.cohort_fingerprint()
+
+        buddy_counts.assign(buddy, esner)
 
-        email_service.send_match_notification_buddy(buddy, esner)
-        email_service.send_match_notification_esner(buddy, esner)
+        if use_proposals:
+            match_proposals.confirm_proposal(buddy, esner, fingerprint)
+
+        # Both emails share one SMTP connection when they are sent right away
+        with email_service.batch():
+            email_service.send_match_notification_buddy(buddy, esner)
+            email_service.send_match_notification_esner(buddy, esner)
         
         db.session.commit()
         return jsonify({"message": "Match confirmed successfully!"}), 200
+    except EmailBackpressure as e:
+        return backpressure_response(e)
     except smtplib.SMTPException as e:
         return jsonify({"error": f"SMTP error occurred: {e}"}), 500
     except Exception as e:
@@ -147,7 +415,7 @@ def remove_match():
     """
     Removes an existing match.
 
-    - Sets the Buddy's `esn_member_id` to None.
+    - Sets the Buddy's `esn_member_id` to None and decrements the ESNer's buddy counter.
     - Sends unmatch notification emails.
 
     Returns:
@@ -164,13 +432,17 @@ def remove_match():
 
         esner = Esner.query.get(buddy.esn_member_id)
 
-        buddy.esn_member_id = None
+        buddy_counts.unassign(buddy)
 
-        email_service.send_unmatch_notification_buddy(buddy)
-        email_service.send_unmatch_notification_esner(buddy, esner)
+        # Both emails share one SMTP connection when they are sent right away
+        with email_service.batch():
+            email_service.send_unmatch_notification_buddy(buddy)
+            email_service.send_unmatch_notification_esner(buddy, esner)
         
         db.session.commit()
         return jsonify({"message": "Unmatch confirmed successfully!"}), 200
+    except EmailBackpressure as e:
+        return backpressure_response(e)
     except smtplib.SMTPException as e:
         return jsonify({"error": f"SMTP error occurred: {e}"}), 500
     except Exception as e:
@@ -187,6 +459,7 @@ def remove_buddy(buddy_id):
     """
     Deletes a Buddy from the database.
 
+    - Decrements the buddy counter of the Buddy's ESNer.
     - Sends an email notification of data elimination.
 
     Returns:
@@ -199,11 +472,16 @@ def remove_buddy(buddy_id):
         return jsonify({"error": "Buddy not found"}), 404
     
     try:
+        score_store.forget_buddy(buddy.id)
+        buddy_counts.unassign(buddy)
         db.session.delete(buddy)
         email_service.send_data_elimination_notification(buddy.name, buddy.email)
         db.session.commit()
 
         return jsonify({"message": "Buddy successfully removed and notified"}), 200
+    except EmailBackpressure as e:
+        db.session.rollback()
+        return backpressure_response(e)
     except Exception as e:
         db.session.rollback()
         print(e)
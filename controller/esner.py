@@ -1,5 +1,5 @@
 from flask import (
-    Blueprint, g, jsonify, render_template, request
+    Blueprint, current_app, g, jsonify, render_template, request
 )
 import json
 from sqlalchemy import or_
@@ -7,6 +7,7 @@ from controller.auth import login_required
 from database.tables import Buddy, Esner
 from database.db import db
 from utils.utils import load_options
+from utils import score_store
 
 # Create a blueprint for ESNer-related routes, with URL prefix '/esner'
 bp = Blueprint('esner', __name__, url_prefix='/esner')
@@ -70,6 +71,9 @@ def registration():
             new_esner.set_password(data.get('password'))
             
             db.session.add(new_esner)
+            if current_app.config.get("MATCH_SCORE_STORE", False):
+                db.session.flush()
+                score_store.refresh_esner(new_esner)
             db.session.commit()
             
             return jsonify({"message": "Form submitted successfully!"}), 200
@@ -145,6 +149,8 @@ def update_profile():
                     esner.max_number_of_buddy = data.get("max_number_of_buddy")
                 if "password" in data and data.get("password"):
                     esner.set_password(data.get("password"))
+                if current_app.config.get("MATCH_SCORE_STORE", False):
+                    score_store.refresh_esner(esner)
                 
                 db.session.commit()
                 return jsonify({"message": "Profile updated successfully!"}), 200
@@ -3,6 +3,13 @@ Database Configuration Module
 
 This module initializes and configures the SQLAlchemy database instance for the Flask application.
 
+It also instruments the SQL statements (when SQL_INSTRUMENTATION is enabled): every request
+counts its statements and their cumulative time, reported in a `Server-Timing` response header
+(`db;dur=<ms>;desc="<n> queries"`, next to `app;dur=<ms>` for the whole request) and, with
+SQL_LOG_REQUESTS, printed. Statements slower than SQL_SLOW_QUERY_SECONDS are printed with the
+endpoint that ran them. The hooks only read a clock and add two numbers per statement, so they
+can stay enabled in production.
+
 Modules:
     - flask_sqlalchemy: Provides SQLAlchemy ORM integration for Flask.
 
@@ -11,19 +18,108 @@ Attributes:
 
 Functions:
     - init_db(app): Initializes the database with the given Flask application instance.
+    - get_query_stats(): Returns the SQL statistics of the current request.
 """
 
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # Initialize the SQLAlchemy database instance
 db = SQLAlchemy()
 
+
+class QueryStats:
+    """
+    SQL statistics of one request.
+
+    Attributes:
+        count (int): Number of statements executed.
+        seconds (float): Cumulative execution time of the statements.
+        started (float): `time.perf_counter()` value when the request started.
+    """
+
+    __slots__ = ('count', 'seconds', 'started')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+
+
+def get_query_stats():
+    """
+    Returns the SQL statistics of the current request.
+
+    Returns:
+        QueryStats: The statistics, or None outside of an instrumented request.
+    """
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if not has_app_context():
+        return
+    stats = get_query_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+    config = current_app.config
+    threshold = config.get("SQL_SLOW_QUERY_SECONDS")
+    if threshold is not None and elapsed >= threshold and config.get("SQL_INSTRUMENTATION", True):
+        endpoint = request.endpoint if has_request_context() else None
+        print(f"Slow query ({elapsed * 1000:.0f} ms, endpoint {endpoint or '-'}): {' '.join(statement.split())[:2000]}")
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get('query_start_time'):
+        context.connection.info['query_start_time'].pop()
+
+
+# Engines are created lazily by Flask-SQLAlchemy, so the hooks are registered on the Engine class once
+event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+event.listen(Engine, 'handle_error', _handle_error)
+
+
+def _start_request_stats():
+    g.query_stats = QueryStats()
+
+
+def _report_request_stats(response):
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.started
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", app;dur={total * 1000:.1f}',
+    )
+    if current_app.config.get("SQL_LOG_REQUESTS", False):
+        print(f"{request.method} {request.path} ({request.endpoint}): {response.status_code}, "
+              f"{stats.count} queries in {stats.seconds * 1000:.1f} ms, {total * 1000:.1f} ms total")
+    return response
+
+
 def init_db(app):
     """
     Initializes the database with the given Flask application instance.
 
     This function binds the SQLAlchemy database instance to the Flask application,
-    enabling database operations.
+    enabling database operations, and registers the per-request SQL statistics when
+    SQL_INSTRUMENTATION is enabled.
 
     Args:
         app (Flask): The Flask application instance to associate with the database.
@@ -32,3 +128,6 @@ def init_db(app):
         None
     """
     db.init_app(app)
+    if app.config.get("SQL_INSTRUMENTATION", True):
+        app.before_request(_start_request_stats)
+        app.after_request(_report_request_stats)
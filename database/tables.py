@@ -1,14 +1,75 @@
 from enum import Enum
+import itertools
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, relationship, validates
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, timezone
 import json
 from .db import db  # Import the SQLAlchemy database instance
+from utils.profile_encoding import ENCODED_COLUMNS, decode_ids, encode_values, get_vocabulary_version
+
+
+class EncodedProfileMixin:
+    """
+    Keeps a bitmask encoding of the JSON attribute columns shared by Buddy and Esner.
+
+    Every time `languages_spoken`, `nationality`, `faculty` or `interests` is assigned (through the
+    constructor, the `set_*` methods or directly), the matching `*_bits` column is re-encoded
+    against the options.json vocabulary (see utils.profile_encoding), and the rows of the
+    normalized attribute tables are rewritten on the next flush. Decoded JSON values are
+    cached on the instance so repeated `get_*` calls, e.g. from templates, parse each column once.
+
+    Attributes:
+        languages_spoken_bits (bytes): Packed bitmask of languages_spoken, None if not encodable.
+        nationality_bits (bytes): Packed bitmask of nationality, None if not encodable.
+        faculty_bits (bytes): Packed bitmask of faculty, None if not encodable.
+        interests_bits (bytes): Packed bitmask of interests, None if not encodable.
+        encoding_version (str): Vocabulary version the bitmasks were encoded with.
+    """
+
+    languages_spoken_bits = db.Column(db.LargeBinary, nullable=True)
+    nationality_bits = db.Column(db.LargeBinary, nullable=True)
+    faculty_bits = db.Column(db.LargeBinary, nullable=True)
+    interests_bits = db.Column(db.LargeBinary, nullable=True)
+    encoding_version = db.Column(db.String(16), nullable=True)
+
+    @staticmethod
+    def _encode_column(column, raw):
+        """Encodes a raw JSON column value, None when it can't be encoded."""
+        try:
+            values = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+        return encode_values(ENCODED_COLUMNS[column], values)
+
+    @validates(*ENCODED_COLUMNS)
+    def _sync_encoded_column(self, key, value):
+        """Re-encodes the bitmask of a JSON column whenever the column is assigned."""
+        version = get_vocabulary_version()
+        if self.encoding_version != version:
+            # Bring the other columns to the current vocabulary as well
+            self.encoding_version = version
+            for column in ENCODED_COLUMNS:
+                if column != key:
+                    setattr(self, column + '_bits', self._encode_column(column, getattr(self, column)))
+        setattr(self, key + '_bits', self._encode_column(key, value))
+        return value
+
+    def _load_json(self, column):
+        """Decodes a JSON column, reusing the previous result while the column is unchanged."""
+        raw = getattr(self, column)
+        cache = self.__dict__.setdefault('_json_cache', {})
+        cached = cache.get(column)
+        if cached is None or cached[0] is not raw:
+            cached = (raw, json.loads(raw))
+            cache[column] = cached
+        value = cached[1]
+        return list(value) if isinstance(value, list) else value
 
 # Define the Buddy model representing Erasmus students.
-class Buddy(db.Model):
+class Buddy(EncodedProfileMixin, db.Model):
     """
     Represents an Erasmus student (Buddy) in the ESN Buddy Program.
 
@@ -57,7 +118,7 @@ class Buddy(db.Model):
     
     def get_languages_spoken(self):
         """Retrieves the list of languages from a JSON string."""
-        return json.loads(self.languages_spoken)
+        return self._load_json('languages_spoken')
     
     def set_nationality(self, nationalities):
         """Stores nationality information as a JSON string."""
@@ -65,7 +126,7 @@ class Buddy(db.Model):
     
     def get_nationality(self):
         """Retrieves nationality information from a JSON string."""
-        return json.loads(self.nationality)
+        return self._load_json('nationality')
     
     def set_faculty(self, faculties):
         """Stores faculty information as a JSON string."""
@@ -73,7 +134,7 @@ class Buddy(db.Model):
     
     def get_faculty(self):
         """Retrieves faculty information from a JSON string."""
-        return json.loads(self.faculty)
+        return self._load_json('faculty')
     
     def set_interests(self, interests):
         """Stores interests as a JSON string."""
@@ -81,7 +142,7 @@ class Buddy(db.Model):
     
     def get_interests(self):
         """Retrieves interests from a JSON string."""
-        return json.loads(self.interests)
+        return self._load_json('interests')
 
 # Define an Enum for ESN member types
 class EsnerType(str, Enum):
@@ -90,7 +151,7 @@ class EsnerType(str, Enum):
     ALUMNUS = 'Alumnus'
 
 # Define the Esners model representing ESN members.
-class Esner(db.Model):
+class Esner(EncodedProfileMixin, db.Model):
     """
     Represents an ESN member who assists Erasmus students.
 
@@ -107,6 +168,8 @@ class Esner(db.Model):
         faculty (str): JSON-encoded list of faculties.
         interests (str): JSON-encoded list of interests.
         max_number_of_buddy (int): Maximum number of Buddies they can manage.
+        buddy_count (int): Number of Buddies assigned, maintained by utils/buddy_counts.py.
+        roles_version (int): Incremented whenever the roles change, invalidating role claims cached in sessions.
         description (str): Additional information.
         password_hash (str): Hashed password for authentication.
         buddies (relationship): One-to-many relationship with Buddy model.
@@ -125,6 +188,8 @@ class Esner(db.Model):
     faculty = db.Column(db.Text, nullable=True)  # Stored as JSON
     interests = db.Column(db.Text, nullable=True)  # Stored as JSON
     max_number_of_buddy = db.Column(db.Integer, nullable=False, default=3)
+    buddy_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    roles_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     description = db.Column(db.Text)
     password_hash = db.Column(db.String(255), nullable=False)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
@@ -138,7 +203,7 @@ class Esner(db.Model):
     
     def get_languages_spoken(self):
         """Retrieves the list of languages from a JSON string."""
-        return json.loads(self.languages_spoken)
+        return self._load_json('languages_spoken')
     
     def set_nationality(self, nationalities):
         """Stores nationality information as a JSON string."""
@@ -146,7 +211,7 @@ class Esner(db.Model):
     
     def get_nationality(self):
         """Retrieves nationality information from a JSON string."""
-        return json.loads(self.nationality)
+        return self._load_json('nationality')
     
     def set_faculty(self, faculties):
         """Stores faculty information as a JSON string."""
@@ -154,7 +219,7 @@ class Esner(db.Model):
     
     def get_faculty(self):
         """Retrieves faculty information from a JSON string."""
-        return json.loads(self.faculty)
+        return self._load_json('faculty')
     
     def set_interests(self, interests):
         """Stores interests as a JSON string."""
@@ -162,7 +227,7 @@ class Esner(db.Model):
     
     def get_interests(self):
         """Retrieves interests from a JSON string."""
-        return json.loads(self.interests)
+        return self._load_json('interests')
     
     # Methods for password hashing and verification
     def set_password(self, password):
@@ -173,6 +238,127 @@ class Esner(db.Model):
         """Checks if the given password matches the stored hash."""
         return check_password_hash(self.password_hash, password)
 
+# Normalized attribute tables
+class ProfileAttributeMixin:
+    """
+    One selected value of a Buddy or Esner attribute, in a normalized attribute table.
+
+    The rows mirror the `*_bits` encoding of the JSON columns and are rewritten by
+    `_sync_attribute_rows` whenever a profile is flushed. Values outside the options.json
+    vocabulary have no row (the bitmask is None), and the rows of a profile are only valid
+    while its encoding_version is the current vocabulary version.
+
+    Attributes:
+        profile_type (str): "buddy" or "esner" (table name of the profile).
+        profile_id (int): Id of the Buddy or Esner.
+        value_id (int): Position of the value in the options.json vocabulary of the attribute.
+    """
+
+    profile_type = db.Column(db.String(10), primary_key=True)
+    profile_id = db.Column(db.Integer, primary_key=True)
+    value_id = db.Column(db.Integer, primary_key=True)
+
+
+class ProfileLanguage(ProfileAttributeMixin, db.Model):
+    """Languages spoken by a profile."""
+
+    __tablename__ = 'profile_language'
+    __table_args__ = (db.Index('ix_profile_language_value', 'value_id', 'profile_type', 'profile_id'),)
+
+
+class ProfileNationality(ProfileAttributeMixin, db.Model):
+    """Nationalities of a profile."""
+
+    __tablename__ = 'profile_nationality'
+    __table_args__ = (db.Index('ix_profile_nationality_value', 'value_id', 'profile_type', 'profile_id'),)
+
+
+class ProfileFaculty(ProfileAttributeMixin, db.Model):
+    """Faculties of a profile."""
+
+    __tablename__ = 'profile_faculty'
+    __table_args__ = (db.Index('ix_profile_faculty_value', 'value_id', 'profile_type', 'profile_id'),)
+
+
+class ProfileInterest(ProfileAttributeMixin, db.Model):
+    """Interests of a profile."""
+
+    __tablename__ = 'profile_interest'
+    __table_args__ = (db.Index('ix_profile_interest_value', 'value_id', 'profile_type', 'profile_id'),)
+
+
+# JSON column of the Buddy/Esner models -> normalized attribute table
+ATTRIBUTE_TABLES = {
+    'languages_spoken': ProfileLanguage,
+    'nationality': ProfileNationality,
+    'faculty': ProfileFaculty,
+    'interests': ProfileInterest,
+}
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_attribute_rows(session, flush_context):
+    """Rewrites the normalized attribute rows of the Buddies and Esners written by a flush."""
+    stale = {column: [] for column in ATTRIBUTE_TABLES}
+    rows = {column: [] for column in ATTRIBUTE_TABLES}
+    for profile in session.deleted:
+        if isinstance(profile, EncodedProfileMixin):
+            for column in ATTRIBUTE_TABLES:
+                stale[column].append((profile.__tablename__, profile.id))
+
+    new = set(session.new)
+    for profile in itertools.chain(new, session.dirty):
+        if not isinstance(profile, EncodedProfileMixin) or profile in session.deleted:
+            continue
+        state = inspect(profile)
+        reencoded = profile in new or state.attrs.encoding_version.history.has_changes()
+        for column in ATTRIBUTE_TABLES:
+            if not reencoded and not state.attrs[column + '_bits'].history.has_changes():
+                continue
+            if profile not in new:
+                stale[column].append((profile.__tablename__, profile.id))
+            rows[column].extend(_attribute_rows(profile, column))
+    _write_attribute_rows(session, stale, rows)
+
+
+def rewrite_attribute_rows(session, profiles):
+    """
+    Rewrites every normalized attribute row of the given profiles from their bitmasks.
+
+    Used by the encoding backfills for profiles encoded before the attribute tables existed,
+    whose bitmasks are current but have no rows.
+    """
+    stale = {column: [(profile.__tablename__, profile.id) for profile in profiles] for column in ATTRIBUTE_TABLES}
+    rows = {
+        column: [row for profile in profiles for row in _attribute_rows(profile, column)]
+        for column in ATTRIBUTE_TABLES
+    }
+    _write_attribute_rows(session, stale, rows)
+
+
+def _attribute_rows(profile, column):
+    """Normalized rows of one attribute of a profile, none when its bitmask is None."""
+    bits = getattr(profile, column + '_bits')
+    if bits is None:
+        return []
+    return [
+        {'profile_type': profile.__tablename__, 'profile_id': profile.id, 'value_id': value_id}
+        for value_id in decode_ids(bits)
+    ]
+
+
+def _write_attribute_rows(session, stale, rows):
+    """Deletes the rows of the stale (profile_type, profile_id) pairs, then inserts the new rows, per attribute."""
+    for column, model in ATTRIBUTE_TABLES.items():
+        table = model.__table__
+        for profile_type in ('buddy', 'esner'):
+            ids = [profile_id for kind, profile_id in stale[column] if kind == profile_type]
+            if ids:
+                session.execute(table.delete().where(table.c.profile_type == profile_type, table.c.profile_id.in_(ids)))
+        if rows[column]:
+            session.execute(table.insert(), rows[column])
+
+
 # Role Table
 class Role(db.Model):
     """
@@ -294,4 +480,239 @@ class PasswordResetToken(db.Model):
         expires_at = self.expires_at
         if expires_at.tzinfo is None:
             expires_at = expires_at.replace(tzinfo=timezone.utc)
-        return expires_at > datetime.now(timezone.utc)
\ No newline at end of file
+        return expires_at > datetime.now(timezone.utc)
+
+class MatchScoreColumn(db.Model):
+    """
+    Represents an Esner column of the persisted match score store.
+
+    Attributes:
+        esner_id (int): Foreign key referencing the Esner (primary key).
+        position (int): Index of the Esner's entries in every MatchScoreRow array.
+        generation (int): Stamp of the Esner's scoring attributes, drawn from the
+            'match_score_generation' Counter whenever the column is created or the attributes
+            change. Stamps are never reused, so stored entries with another stamp are stale
+            even when the position belonged to a deleted Esner.
+        attributes_hash (str): Fingerprint of the profile and weights of the current generation.
+    """
+
+    esner_id = db.Column(db.Integer, db.ForeignKey('esner.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, unique=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0)
+    attributes_hash = db.Column(db.String(40), nullable=False)
+
+
+class MatchScoreRow(db.Model):
+    """
+    Represents a Buddy row of the persisted match score store.
+
+    The row holds the static (availability excluded) score of the Buddy against every
+    Esner column, so a new Buddy adds exactly one row.
+
+    Attributes:
+        buddy_id (int): Foreign key referencing the Buddy (primary key).
+        attributes_hash (str): Fingerprint of the Buddy profile and weights the row was computed with.
+        scores (bytes): Little-endian float64 array indexed by MatchScoreColumn.position, NaN if not computed.
+        generations (bytes): Little-endian int64 array with the column generation of each entry, -1 if empty.
+        updated_at (datetime): Timestamp of the last write.
+    """
+
+    buddy_id = db.Column(db.Integer, db.ForeignKey('buddy.id', ondelete='CASCADE'), primary_key=True)
+    attributes_hash = db.Column(db.String(40), nullable=False)
+    scores = db.Column(db.LargeBinary, nullable=False)
+    generations = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Counter(db.Model):
+    """
+    Represents a named counter shared by every process (see utils/counters.py).
+
+    Attributes:
+        name (str): Name of the counter (primary key).
+        value (int): Last value handed out.
+    """
+
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+# Counter incremented by every change to the data an automatic matching run depends on
+COHORT_VERSION_COUNTER = 'match_cohort_version'
+
+# Columns an automatic matching run depends on, by model
+COHORT_COLUMNS = {
+    Buddy: ('esn_member_id', 'gender', 'languages_spoken', 'nationality', 'faculty', 'interests'),
+    Esner: ('max_number_of_buddy', 'buddy_count', 'gender', 'languages_spoken', 'nationality', 'faculty', 'interests'),
+}
+
+
+def _bump_cohort_version(session):
+    """Increments the cohort version counter, creating it on first use."""
+    counter = Counter.__table__
+    bumped = session.execute(
+        counter.update().where(counter.c.name == COHORT_VERSION_COUNTER).values(value=counter.c.value + 1)
+    )
+    if not bumped.rowcount:
+        session.execute(counter.insert().values(name=COHORT_VERSION_COUNTER, value=1))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_cohort_changes(session, flush_context):
+    """Bumps the cohort version when a flush adds, deletes or edits a Buddy or Esner of a matching run."""
+    for profile in itertools.chain(session.new, session.deleted, session.dirty):
+        columns = COHORT_COLUMNS.get(type(profile))
+        if columns is None:
+            continue
+        if profile in session.dirty and profile not in session.deleted:
+            state = inspect(profile)
+            if not any(state.attrs[column].history.has_changes() for column in columns):
+                continue
+        _bump_cohort_version(session)
+        return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_cohort_changes(orm_execute_state):
+    """Bumps the cohort version before a bulk UPDATE or DELETE of Buddies or Esners (e.g. `Buddy.query.delete()`)."""
+    mapper = orm_execute_state.bind_mapper
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and mapper is not None \
+            and mapper.class_ in COHORT_COLUMNS:
+        _bump_cohort_version(orm_execute_state.session)
+
+
+class MatchProposal(db.Model):
+    """
+    Represents a Buddy -> Esner proposal of an automatic matching run.
+
+    A run is computed once for a cohort fingerprint and reused by the automatic match page
+    until the Buddy or Esner data changes.
+
+    Attributes:
+        id (int): Primary key.
+        run_id (str): Identifier shared by the proposals of the same run.
+        cohort_fingerprint (str): Fingerprint of the Buddy/Esner data the run was computed from.
+        mode (str): Matching mode of the run ("greedy" or "assignment").
+        rank (int): Position of the proposal in the run's output.
+        buddy_id (int): Foreign key referencing the proposed Buddy.
+        esner_id (int): Foreign key referencing the proposed Esner.
+        score (float): Matching score in [0, 1].
+        adjusted_score (float): Score after the selection penalty of the greedy matching.
+        status (str): "open", "confirmed" or "invalidated".
+        created_at (datetime): Timestamp of the run.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.String(32), nullable=False, index=True)
+    cohort_fingerprint = db.Column(db.String(40), nullable=False, index=True)
+    mode = db.Column(db.String(20), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    buddy_id = db.Column(db.Integer, db.ForeignKey('buddy.id', ondelete='CASCADE'), nullable=False, index=True)
+    esner_id = db.Column(db.Integer, db.ForeignKey('esner.id', ondelete='CASCADE'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+    adjusted_score = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='open')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class MatchJob(db.Model):
+    """
+    Represents an automatic matching run executed in the background.
+
+    Attributes:
+        id (str): Job identifier returned to the client (primary key).
+        mode (str): Matching mode ("greedy" or "assignment").
+        status (str): "queued", "running", "finished" or "failed".
+        total_buddies (int): Number of Buddies to score.
+        scored_buddies (int): Number of Buddies scored so far.
+        run_id (str): MatchProposal run holding the results, once finished.
+        error (str): Error message of a failed job.
+        lease_until (datetime): The job is being processed by a runner until this time.
+        buddy_ids (list): Ids of the Buddies to match, fixed by the first processing step.
+        esner_ids (list): Ids of the Esners to match, fixed by the first processing step.
+        cohort_fingerprint (str): Cohort fingerprint when the job started; the run is stored under it.
+        created_at (datetime): Timestamp of the request.
+        started_at (datetime): Timestamp of the first processing step.
+        finished_at (datetime): Timestamp of the end of the job.
+    """
+
+    id = db.Column(db.String(32), primary_key=True)
+    mode = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    total_buddies = db.Column(db.Integer, nullable=False, default=0)
+    scored_buddies = db.Column(db.Integer, nullable=False, default=0)
+    run_id = db.Column(db.String(32))
+    error = db.Column(db.Text)
+    lease_until = db.Column(db.DateTime)
+    buddy_ids = db.Column(db.JSON)
+    esner_ids = db.Column(db.JSON)
+    cohort_fingerprint = db.Column(db.String(40))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class BackfillCheckpoint(db.Model):
+    """
+    Progress of a batched data backfill (see utils/backfill.py).
+
+    Attributes:
+        name (str): Name of the backfill (primary key).
+        last_id (int): Highest primary key processed; the next batch starts after it.
+        rows_done (int): Number of rows processed since the backfill started.
+        status (str): "running" or "finished".
+        started_at (datetime): Timestamp of the first batch.
+        updated_at (datetime): Timestamp of the last committed batch.
+        finished_at (datetime): Timestamp of the end of the backfill.
+    """
+
+    name = db.Column(db.String(64), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='running')
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class EmailOutbox(db.Model):
+    """
+    An email waiting to be delivered (see utils/email_outbox.py).
+
+    Emails are added in the transaction of the change they notify, so they are only sent if it
+    commits, and a failed delivery doesn't undo it.
+
+    Attributes:
+        id (int): Primary key, also the delivery order.
+        recipient (str): Email address of the recipient.
+        subject (str): Subject of the email.
+        html (str): HTML body of the email.
+        status (str): "pending", "sent", "failed" (no attempts left) or "coalesced" (sent in a digest).
+        priority (int): Priority class, lower first (see utils.email_dispatcher.PRIORITIES).
+        attempts (int): Number of delivery attempts so far.
+        next_attempt_at (datetime): The email is not sent before this time (retry backoff).
+        lease_until (datetime): The email is being sent by a worker until this time.
+        last_error (str): Error of the last failed attempt.
+        digest_key (str): Emails of the same key are merged into one digest (e.g. "match_esner:12").
+        digest_data (dict): Variables of the email in the digest template.
+        created_at (datetime): Timestamp of the request that queued the email.
+        sent_at (datetime): Timestamp of the delivery.
+    """
+
+    __tablename__ = 'email_outbox'
+    __table_args__ = (db.Index('ix_email_outbox_due', 'status', 'next_attempt_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    priority = db.Column(db.Integer, nullable=False, default=1)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    lease_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    digest_key = db.Column(db.String(64), index=True)
+    digest_data = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, index=True)
@@ -0,0 +1,38 @@
+"""Add profile bit encoding columns
+
+Revision ID: 3b9d2f6a1c47
+Revises: 17fdf70c40d1
+Create Date: 2026-10-18 13:05:42.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2f6a1c47'
+down_revision = '17fdf70c40d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows keep NULL encodings and are decoded from their JSON columns
+    # until the next time they are written.
+    for table in ('buddy', 'esner'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('languages_spoken_bits', sa.LargeBinary(), nullable=True))
+            batch_op.add_column(sa.Column('nationality_bits', sa.LargeBinary(), nullable=True))
+            batch_op.add_column(sa.Column('faculty_bits', sa.LargeBinary(), nullable=True))
+            batch_op.add_column(sa.Column('interests_bits', sa.LargeBinary(), nullable=True))
+            batch_op.add_column(sa.Column('encoding_version', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    for table in ('buddy', 'esner'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('encoding_version')
+            batch_op.drop_column('interests_bits')
+            batch_op.drop_column('faculty_bits')
+            batch_op.drop_column('nationality_bits')
+            batch_op.drop_column('languages_spoken_bits')
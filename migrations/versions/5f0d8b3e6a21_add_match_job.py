@@ -0,0 +1,42 @@
+"""Add match job table
+
+Revision ID: 5f0d8b3e6a21
+Revises: c2a75e913f08
+Create Date: 2026-10-18 18:02:51.224606
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0d8b3e6a21'
+down_revision = 'c2a75e913f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('match_job',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('mode', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total_buddies', sa.Integer(), nullable=False),
+    sa.Column('scored_buddies', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.String(length=32), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('lease_until', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('match_job', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_match_job_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('match_job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_match_job_status'))
+
+    op.drop_table('match_job')
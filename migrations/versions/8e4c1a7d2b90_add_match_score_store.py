@@ -0,0 +1,43 @@
+"""Add match score store tables
+
+Revision ID: 8e4c1a7d2b90
+Revises: 3b9d2f6a1c47
+Create Date: 2026-10-18 15:21:07.402113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4c1a7d2b90'
+down_revision = '3b9d2f6a1c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The store starts empty and is filled by the match jobs or `flask match fill-score-store`.
+    op.create_table('match_score_column',
+    sa.Column('esner_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.Column('attributes_hash', sa.String(length=40), nullable=False),
+    sa.ForeignKeyConstraint(['esner_id'], ['esner.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('esner_id'),
+    sa.UniqueConstraint('position')
+    )
+    op.create_table('match_score_row',
+    sa.Column('buddy_id', sa.Integer(), nullable=False),
+    sa.Column('attributes_hash', sa.String(length=40), nullable=False),
+    sa.Column('scores', sa.LargeBinary(), nullable=False),
+    sa.Column('generations', sa.LargeBinary(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['buddy_id'], ['buddy.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('buddy_id')
+    )
+
+
+def downgrade():
+    op.drop_table('match_score_row')
+    op.drop_table('match_score_column')
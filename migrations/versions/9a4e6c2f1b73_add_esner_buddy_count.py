@@ -0,0 +1,34 @@
+"""Add esner buddy count
+
+Revision ID: 9a4e6c2f1b73
+Revises: 5f0d8b3e6a21
+Create Date: 2026-10-18 19:12:37.540318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e6c2f1b73'
+down_revision = '5f0d8b3e6a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('esner', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('buddy_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index(batch_op.f('ix_esner_buddy_count'), ['buddy_count'], unique=False)
+
+    # Backfill the counters of the existing matches
+    op.execute(
+        "UPDATE esner SET buddy_count = "
+        "(SELECT COUNT(*) FROM buddy WHERE buddy.esn_member_id = esner.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('esner', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_esner_buddy_count'))
+        batch_op.drop_column('buddy_count')
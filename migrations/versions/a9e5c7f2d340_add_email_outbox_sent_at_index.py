@@ -0,0 +1,27 @@
+"""Index the send time of the email outbox
+
+Revision ID: a9e5c7f2d340
+Revises: f6b1d3a8c529
+Create Date: 2026-10-18 20:41:27.815402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9e5c7f2d340'
+down_revision = 'f6b1d3a8c529'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The rate limits count the emails sent in the last minute and day before every send
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_email_outbox_sent_at'), ['sent_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_outbox_sent_at'))
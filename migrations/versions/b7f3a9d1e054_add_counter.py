@@ -0,0 +1,33 @@
+"""Add shared counters and restamp the match score store
+
+Revision ID: b7f3a9d1e054
+Revises: e2d8b4c6a1f3
+Create Date: 2026-10-18 19:05:31.274118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f3a9d1e054'
+down_revision = 'e2d8b4c6a1f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # The column generations used to restart at 0 on reused positions: the stored scores are
+    # a cache, drop them so every stamp comes from the counter (refill with
+    # `flask match fill-score-store`)
+    op.execute('DELETE FROM match_score_row')
+    op.execute('DELETE FROM match_score_column')
+
+
+def downgrade():
+    op.drop_table('counter')
@@ -0,0 +1,50 @@
+"""Add match proposal table
+
+Revision ID: c2a75e913f08
+Revises: 8e4c1a7d2b90
+Create Date: 2026-10-18 16:48:33.517920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a75e913f08'
+down_revision = '8e4c1a7d2b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('match_proposal',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.String(length=32), nullable=False),
+    sa.Column('cohort_fingerprint', sa.String(length=40), nullable=False),
+    sa.Column('mode', sa.String(length=20), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('buddy_id', sa.Integer(), nullable=False),
+    sa.Column('esner_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('adjusted_score', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['buddy_id'], ['buddy.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['esner_id'], ['esner.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('match_proposal', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_match_proposal_buddy_id'), ['buddy_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_match_proposal_cohort_fingerprint'), ['cohort_fingerprint'], unique=False)
+        batch_op.create_index(batch_op.f('ix_match_proposal_esner_id'), ['esner_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_match_proposal_run_id'), ['run_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('match_proposal', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_match_proposal_run_id'))
+        batch_op.drop_index(batch_op.f('ix_match_proposal_esner_id'))
+        batch_op.drop_index(batch_op.f('ix_match_proposal_cohort_fingerprint'))
+        batch_op.drop_index(batch_op.f('ix_match_proposal_buddy_id'))
+
+    op.drop_table('match_proposal')
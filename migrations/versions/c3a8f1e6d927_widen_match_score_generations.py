@@ -0,0 +1,36 @@
+"""Widen the match score generations to 64 bits
+
+Revision ID: c3a8f1e6d927
+Revises: a9e5c7f2d340
+Create Date: 2026-10-18 21:36:02.518340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a8f1e6d927'
+down_revision = 'a9e5c7f2d340'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('match_score_column', schema=None) as batch_op:
+        batch_op.alter_column('generation',
+               existing_type=sa.Integer(),
+               type_=sa.BigInteger(),
+               existing_nullable=False)
+    # The stored rows hold int32 generations: drop them, the match jobs or
+    # `flask match fill-score-store` store them again as int64
+    op.execute('DELETE FROM match_score_row')
+
+
+def downgrade():
+    op.execute('DELETE FROM match_score_row')
+    with op.batch_alter_table('match_score_column', schema=None) as batch_op:
+        batch_op.alter_column('generation',
+               existing_type=sa.BigInteger(),
+               type_=sa.Integer(),
+               existing_nullable=False)
@@ -0,0 +1,26 @@
+"""Add priority to the email outbox
+
+Revision ID: c5e1f7a3b920
+Revises: a6d40e8b7c25
+Create Date: 2026-10-18 16:05:12.204318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1f7a3b920'
+down_revision = 'a6d40e8b7c25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('priority', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_column('priority')
@@ -0,0 +1,27 @@
+"""Seed the cohort version counter
+
+Revision ID: d4c9e2b7a813
+Revises: b7f3a9d1e054
+Create Date: 2026-10-18 19:48:12.530267
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4c9e2b7a813'
+down_revision = 'b7f3a9d1e054'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Stored runs carry fingerprints of the former full-table hash and are never reused again;
+    # drop them along with seeding the counter the new fingerprints are built from.
+    op.execute("DELETE FROM match_proposal")
+    op.execute("INSERT INTO counter (name, value) VALUES ('match_cohort_version', 0)")
+
+
+def downgrade():
+    op.execute("DELETE FROM counter WHERE name = 'match_cohort_version'")
@@ -0,0 +1,40 @@
+"""Add normalized profile attribute tables
+
+Revision ID: d7b31f5c8e42
+Revises: 9a4e6c2f1b73
+Create Date: 2026-10-18 20:04:18.913552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7b31f5c8e42'
+down_revision = '9a4e6c2f1b73'
+branch_labels = None
+depends_on = None
+
+ATTRIBUTE_TABLES = ('profile_language', 'profile_nationality', 'profile_faculty', 'profile_interest')
+
+
+def upgrade():
+    # The tables start empty: `flask backfill run buddy-encoding` and `esner-encoding` fill
+    # them in resumable batches after the upgrade
+    for name in ATTRIBUTE_TABLES:
+        op.create_table(name,
+        sa.Column('profile_type', sa.String(length=10), nullable=False),
+        sa.Column('profile_id', sa.Integer(), nullable=False),
+        sa.Column('value_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('profile_type', 'profile_id', 'value_id')
+        )
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{name}_value', ['value_id', 'profile_type', 'profile_id'], unique=False)
+
+
+def downgrade():
+    for name in reversed(ATTRIBUTE_TABLES):
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{name}_value')
+
+        op.drop_table(name)
@@ -0,0 +1,30 @@
+"""Add digest columns to the email outbox
+
+Revision ID: e2d8b4c6a1f3
+Revises: c5e1f7a3b920
+Create Date: 2026-10-18 17:42:08.613905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2d8b4c6a1f3'
+down_revision = 'c5e1f7a3b920'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('digest_key', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('digest_data', sa.JSON(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_email_outbox_digest_key'), ['digest_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_outbox_digest_key'))
+        batch_op.drop_column('digest_data')
+        batch_op.drop_column('digest_key')
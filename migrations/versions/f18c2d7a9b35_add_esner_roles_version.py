@@ -0,0 +1,26 @@
+"""Add esner roles version
+
+Revision ID: f18c2d7a9b35
+Revises: e3f96a0b4c18
+Create Date: 2026-10-18 21:22:40.615927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f18c2d7a9b35'
+down_revision = 'e3f96a0b4c18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('esner', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('roles_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('esner', schema=None) as batch_op:
+        batch_op.drop_column('roles_version')
@@ -0,0 +1,30 @@
+"""Add the cohort of a match job
+
+Revision ID: f6b1d3a8c529
+Revises: d4c9e2b7a813
+Create Date: 2026-10-18 20:16:44.091735
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b1d3a8c529'
+down_revision = 'd4c9e2b7a813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('match_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('buddy_ids', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('esner_ids', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('cohort_fingerprint', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('match_job', schema=None) as batch_op:
+        batch_op.drop_column('cohort_fingerprint')
+        batch_op.drop_column('esner_ids')
+        batch_op.drop_column('buddy_ids')
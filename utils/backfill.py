@@ -0,0 +1,224 @@
+"""
+Batched Data Backfills for ESN Matchmaking System
+
+Restructuring stored data (encodings, counters, normalized tables) means rewriting every
+Buddy or Esner row. Doing it inside one migration transaction locks the tables for the whole
+run, so these rewrites are registered here as backfills and run from the command line.
+
+A backfill walks a table in primary key order with keyset pagination (`id > last_id ORDER
+BY id LIMIT n`), applies its function to each batch and commits the batch together with its
+checkpoint in the BackfillCheckpoint table. An interrupted backfill resumes after the last
+committed batch. Between batches the runner sleeps (BACKFILL_SLEEP_SECONDS, or long enough to
+stay under --max-rate rows per second) and prints its progress in rows per second.
+
+Registered backfills:
+- buddy-encoding / esner-encoding: re-encodes the bitmasks of the profiles not encoded with
+  the current options.json vocabulary, and rewrites the normalized attribute rows of every
+  profile. Run both after upgrading to the normalized attribute tables, which start empty.
+- esner-buddy-count: recomputes the buddy_count counter of every Esner.
+
+Usage:
+    flask backfill list
+    flask backfill run buddy-encoding [--batch-size 500] [--sleep 0.1] [--max-rate 2000] [--restart]
+
+Functions:
+- register_backfill(name, model, description): Decorator registering a batch function.
+- run_backfill(name, ...): Runs (or resumes) a backfill.
+"""
+
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from database.db import db
+from database.tables import BackfillCheckpoint, Buddy, Esner, rewrite_attribute_rows
+from utils import buddy_counts
+from utils.profile_encoding import ENCODED_COLUMNS, get_vocabulary_version
+
+
+class Backfill:
+    """
+    A registered backfill.
+
+    Attributes:
+        name (str): Name used on the command line and as checkpoint key.
+        model (db.Model): Model whose rows are processed, by increasing id.
+        process (callable): Function receiving each batch (a list of instances).
+        description (str): One line description shown by `flask backfill list`.
+    """
+
+    def __init__(self, name, model, process, description):
+        self.name = name
+        self.model = model
+        self.process = process
+        self.description = description
+
+
+BACKFILLS = {}
+
+
+def register_backfill(name, model, description):
+    """
+    Register the decorated function as the batch function of a backfill.
+
+    The function receives the instances of a batch and updates them (or the rows depending on
+    them) in the current session; the runner commits.
+
+    :param name: Name of the backfill
+    :param model: Model whose rows are processed
+    :param description: One line description
+    """
+    def decorator(process):
+        BACKFILLS[name] = Backfill(name, model, process, description)
+        return process
+    return decorator
+
+
+def run_backfill(name, batch_size=None, sleep=None, max_rate=None, max_batches=None, restart=False):
+    """
+    Run a backfill from its checkpoint until every row is processed.
+
+    :param name: Name of a registered backfill
+    :param batch_size: Rows per batch (default: BACKFILL_BATCH_SIZE)
+    :param sleep: Seconds to pause between batches (default: BACKFILL_SLEEP_SECONDS)
+    :param max_rate: Optional maximum number of rows per second
+    :param max_batches: Optional number of batches after which the run stops (it can be resumed)
+    :param restart: Start again from the first row, even if the backfill finished
+    :return: Dictionary with the rows processed by this run, the elapsed seconds, the rate
+             and whether the backfill finished
+    """
+    backfill = BACKFILLS[name]
+    if batch_size is None:
+        batch_size = current_app.config.get("BACKFILL_BATCH_SIZE", 500)
+    if sleep is None:
+        sleep = current_app.config.get("BACKFILL_SLEEP_SECONDS", 0.1)
+
+    checkpoint = db.session.get(BackfillCheckpoint, name)
+    if checkpoint is None:
+        checkpoint = BackfillCheckpoint(name=name, last_id=0, rows_done=0)
+        db.session.add(checkpoint)
+    elif restart:
+        checkpoint.last_id = 0
+        checkpoint.rows_done = 0
+        checkpoint.started_at = datetime.utcnow()
+        checkpoint.finished_at = None
+    elif checkpoint.status == 'finished':
+        print(f"{name}: already finished on {checkpoint.finished_at:%Y-%m-%d %H:%M}, use --restart to run it again")
+        return {'rows': 0, 'seconds': 0.0, 'rows_per_second': 0.0, 'finished': True}
+    checkpoint.status = 'running'
+    db.session.commit()
+
+    model = backfill.model
+    start = time.perf_counter()
+    rows = 0
+    batches = 0
+    while True:
+        batch_start = time.perf_counter()
+        batch = (
+            model.query
+            .filter(model.id > checkpoint.last_id)
+            .order_by(model.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            checkpoint.status = 'finished'
+            checkpoint.finished_at = datetime.utcnow()
+            db.session.commit()
+            break
+
+        try:
+            backfill.process(batch)
+            checkpoint.last_id = batch[-1].id
+            checkpoint.rows_done += len(batch)
+            checkpoint.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            print(f"{name}: batch after id {checkpoint.last_id} failed, the next run resumes from it")
+            raise
+
+        rows += len(batch)
+        batches += 1
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {checkpoint.rows_done} rows done, last id {checkpoint.last_id}, "
+              f"{rows / elapsed if elapsed else 0:.0f} rows/s")
+        if max_batches is not None and batches >= max_batches:
+            break
+
+        pause = sleep
+        if max_rate:
+            pause = max(pause, len(batch) / max_rate - (time.perf_counter() - batch_start))
+        if pause > 0:
+            time.sleep(pause)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0,
+        'finished': checkpoint.status == 'finished',
+    }
+
+
+def _reencode_profiles(profiles):
+    """
+    Re-encode the profiles whose bitmasks don't use the current vocabulary, and rewrite the
+    normalized attribute rows of the others (encoded before the attribute tables existed).
+    """
+    version = get_vocabulary_version()
+    current = []
+    for profile in profiles:
+        if profile.encoding_version == version:
+            current.append(profile)
+            continue
+        # Assigning the JSON columns re-encodes them; the flush rewrites the normalized rows
+        profile.encoding_version = None
+        for column in ENCODED_COLUMNS:
+            setattr(profile, column, getattr(profile, column))
+    if current:
+        rewrite_attribute_rows(db.session, current)
+
+
+register_backfill('buddy-encoding', Buddy, "Re-encode Buddy attribute bitmasks and normalized rows")(_reencode_profiles)
+register_backfill('esner-encoding', Esner, "Re-encode Esner attribute bitmasks and normalized rows")(_reencode_profiles)
+
+
+@register_backfill('esner-buddy-count', Esner, "Recompute the buddy_count counter of every Esner")
+def _recount_buddies(esners):
+    """Recompute the counters of a batch of Esners."""
+    buddy_counts.repair([esner.id for esner in esners])
+
+
+backfill_cli = AppGroup('backfill', help="Run resumable batched data backfills.")
+
+
+@backfill_cli.command('list')
+def list_backfills():
+    """List the registered backfills and their progress."""
+    checkpoints = {checkpoint.name: checkpoint for checkpoint in BackfillCheckpoint.query}
+    for name, backfill in BACKFILLS.items():
+        checkpoint = checkpoints.get(name)
+        progress = (
+            f"{checkpoint.status}, {checkpoint.rows_done} rows, last id {checkpoint.last_id}"
+            if checkpoint else "never run"
+        )
+        print(f"{name:<20} {backfill.description} ({progress})")
+
+
+@backfill_cli.command('run')
+@click.argument('name', type=click.Choice(list(BACKFILLS)))
+@click.option('--batch-size', type=int, help="Rows per batch (default: BACKFILL_BATCH_SIZE).")
+@click.option('--sleep', type=float, help="Seconds between two batches (default: BACKFILL_SLEEP_SECONDS).")
+@click.option('--max-rate', type=float, help="Maximum number of rows per second.")
+@click.option('--max-batches', type=int, help="Stop after this many batches; the next run resumes.")
+@click.option('--restart', is_flag=True, help="Start again from the first row.")
+def run_backfill_command(name, batch_size, sleep, max_rate, max_batches, restart):
+    """Run or resume the backfill NAME."""
+    stats = run_backfill(name, batch_size, sleep, max_rate, max_batches, restart)
+    state = "finished" if stats['finished'] else "paused"
+    print(f"{name}: {state}, {stats['rows']} rows in {stats['seconds']:.1f}s "
+          f"({stats['rows_per_second']:.0f} rows/s)")
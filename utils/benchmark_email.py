@@ -0,0 +1,140 @@
+"""
+Email Rendering Benchmark for ESN Matchmaking System
+
+This script compares the render throughput of the Jinja email templates (utils/email_templates.py)
+with the f-strings the notification bodies used to be built with. Profiles are generated with
+Faker using a fixed seed, and the ESNer match notification is rendered for each of them:
+
+- fstring: the former f-string body, without escaping (names were inserted as raw HTML).
+- fstring_escaped: the same f-string with every value passed through `markupsafe.escape`, the
+  fair baseline for autoescaped templates.
+- jinja_render: `email_templates.render`, one call per email.
+- jinja_render_many: `email_templates.render_many`, the mail merge API.
+
+The first Jinja render of the run compiles the template and is timed separately (compile). Each
+approach reports the best and median number of emails rendered per second over the repetitions.
+
+Usage (from the project root):
+    python -m utils.benchmark_email
+    python -m utils.benchmark_email --count 50000 --repeat 5 --output email_render.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import time
+from types import SimpleNamespace
+
+from faker import Faker
+from markupsafe import escape
+
+from utils import email_templates
+
+TEMPLATE = 'match_esner'
+
+
+def generate_profiles(count, seed):
+    """Return `count` (buddy, esner) pairs of fake profiles."""
+    fake = Faker()
+    Faker.seed(seed)
+
+    def profile():
+        return SimpleNamespace(
+            name=fake.first_name(), surname=fake.last_name(), email=fake.email(), phone_number=fake.phone_number(),
+        )
+
+    return [(profile(), profile()) for _ in range(count)]
+
+
+def fstring_body(buddy, esner, sender, quote=str):
+    """The ESNer match notification as it was built before the templates."""
+    return f"""
+        <h2>Hi {quote(esner.name)},</h2>
+        <p>Great news! A Buddy has been assigned to you in the ESN Buddy Program.</p>
+        <p>Enter the web portal to get more information about his interests, nationality, languages he speaks, and faculty: (https://esn-palermo.vercel.app/)</p>
+        <p><b>Your Buddy:</b> {quote(buddy.name)} {quote(buddy.surname)}</p>
+        <p>Contact them at:</p>
+        <ul>
+            <li>Email: {quote(buddy.email)}</li>
+            <li>Phone: {quote(buddy.phone_number)}</li>
+        </ul>
+        <p>Thank you for being part of the ESN community!</p> <br>
+        <p>Best Regards,</p> <br>
+        <strong> {quote(sender.name)} {quote(sender.surname)} </strong>
+        """
+
+
+def approaches(pairs, sender):
+    """Functions rendering every pair, by name."""
+    return {
+        'fstring': lambda: [fstring_body(buddy, esner, sender) for buddy, esner in pairs],
+        'fstring_escaped': lambda: [fstring_body(buddy, esner, sender, escape) for buddy, esner in pairs],
+        'jinja_render': lambda: [
+            email_templates.render(TEMPLATE, buddy=buddy, esner=esner, sender=sender) for buddy, esner in pairs
+        ],
+        'jinja_render_many': lambda: email_templates.render_many(
+            TEMPLATE, ({'buddy': buddy, 'esner': esner} for buddy, esner in pairs), sender=sender,
+        ),
+    }
+
+
+def run(count, seed, repeat):
+    """
+    Time every approach.
+
+    :param count: Number of emails rendered per repetition
+    :param seed: Seed of the profile generator
+    :param repeat: Timed repetitions of each approach
+    :return: Dictionary {approach: {'best', 'median' (emails per second)}} and the compile time
+    """
+    pairs = generate_profiles(count, seed)
+    sender = SimpleNamespace(name='Mario', surname='Rossi')
+
+    start = time.perf_counter()
+    email_templates.get_template(TEMPLATE)
+    compile_seconds = time.perf_counter() - start
+
+    results = {}
+    for name, render in approaches(pairs, sender).items():
+        rates = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            bodies = render()
+            rates.append(len(bodies) / (time.perf_counter() - start))
+        results[name] = {'best': max(rates), 'median': statistics.median(rates)}
+    return results, compile_seconds
+
+
+def main():
+    """Parse the command line, run the benchmark and print (and optionally write) the results."""
+    parser = argparse.ArgumentParser(description="Benchmark the rendering of the notification emails.")
+    parser.add_argument('--count', type=int, default=10000, help="Emails rendered per repetition")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the profile generator")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed repetitions of each approach")
+    parser.add_argument('--output', help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    results, compile_seconds = run(args.count, args.seed, args.repeat)
+    print(f"Rendering {args.count} emails ({TEMPLATE}), template compiled in {compile_seconds * 1000:.1f} ms")
+    baseline = results['fstring_escaped']['best']
+    for name, result in results.items():
+        print(f"  {name:>17}: best {result['best']:,.0f} emails/s, median {result['median']:,.0f} emails/s "
+              f"({result['best'] / baseline:.2f}x fstring_escaped)")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'count': args.count,
+                'seed': args.seed,
+                'repeat': args.repeat,
+                'compile_seconds': compile_seconds,
+                'results': results,
+            }, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""
+Matching Benchmark Suite for ESN Matchmaking System
+
+This script measures how the matching engine scales with the size of the cohorts. Cohorts are
+built with `generate_buddy` and `generate_esner` from utils/populate_database.py using fixed
+seeds, stored in a local SQLite database, and the following phases are timed:
+
+- cohort_load: `load_cohort_snapshot`, the two queries loading the cohorts of a run.
+- score_pair: `compute_match_score` on a sample of pairs (seconds per pair).
+- scoring: `compute_match_matrix` for the whole cohort.
+- selection: `match_making` on the precomputed matrix.
+- assignment: `assignment_match_making` on the precomputed matrix (small cohorts only).
+- end_to_end_cold / end_to_end_warm: a GET of the automatic_match page, before and after the
+  score store has been filled.
+
+The SQL statements run by the pages listed in QUERY_BUDGETS are also counted. These pages
+must run a fixed number of statements whatever the size of the cohorts (no query per row),
+so a page exceeding its budget makes the script exit with an error, like a regression. The
+pages of COLD_PAGES are counted twice against the same budget: on a fresh cohort version,
+when the run is computed and stored, and again once it is stored.
+
+Each phase reports the best and median time of the repetitions and the peak memory traced
+during one extra run. Results are written to a JSON file which can be compared with a
+previous run to catch regressions.
+
+Generating large cohorts is slow (every Esner gets a hashed password), so the generated
+databases are cached per size, seed, vocabulary and schema in the system temporary directory.
+
+Usage (from the project root):
+    python -m utils.benchmark_match
+    python -m utils.benchmark_match --sizes 100x20,1000x100 --output before.json
+    python -m utils.benchmark_match --compare before.json --output after.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+from faker import Faker
+from flask import Flask
+from sqlalchemy import event
+
+from database.db import db, init_db
+from database.tables import COHORT_VERSION_COUNTER, Buddy, Esner
+from utils import buddy_counts, config, counters
+from utils.cohort_snapshot import load_cohort_snapshot
+from utils.match import assignment_match_making, compute_match_matrix, compute_match_score, match_making
+from utils.populate_database import generate_buddy, generate_esner, load_options
+from utils.profile_encoding import get_vocabulary_version
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'esn_match_benchmark')
+
+DEFAULT_SIZES = [(100, 20), (1000, 100), (5000, 500), (20000, 2000)]
+SCORE_PAIR_SAMPLE = 5000  # Pairs timed with compute_match_score
+ASSIGNMENT_MAX_PAIRS = 1_000_000  # Larger cohorts skip the assignment phase
+
+# Maximum number of SQL statements of each page, whatever the cohort size (login included)
+QUERY_BUDGETS = {
+    '/buddyprogram/match/manual_match': 1,
+    '/buddyprogram/match/api/buddies': 3,
+    '/buddyprogram/match/api/buddies?matched=false&language=English': 3,
+    '/buddyprogram/match/api/esners': 4,
+    '/buddyprogram/match/api/esners?available=true&language=English': 4,
+    # A fresh run: fingerprint, stored run, cohorts, score store columns and rows, proposal
+    # profiles, and the replaced run (delete and insert)
+    '/buddyprogram/match/automatic_match': 11,
+}
+# Pages also counted on a fresh cohort version, reported with this suffix
+COLD_PAGES = ('/buddyprogram/match/automatic_match',)
+COLD_SUFFIX = ' (cold)'
+
+
+def parse_sizes(value):
+    """Parse a "100x20,1000x100" list of (buddies, esners) sizes."""
+    sizes = []
+    for item in value.split(','):
+        buddies, esners = item.lower().split('x')
+        sizes.append((int(buddies), int(esners)))
+    return sizes
+
+
+def create_app(database_path):
+    """Create an application with every blueprint, backed by the given SQLite file."""
+    import controller.admin, controller.auth, controller.buddy, controller.buddy_program, controller.esner
+    from utils.email_service import email_service
+
+    app = Flask(__name__, root_path=PROJECT_ROOT)
+    app.config.from_object(config.BaseConfig)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{database_path}",
+        SECRET_KEY="benchmark",
+        MAIL_SUPPRESS_SEND=True,
+    )
+    init_db(app)
+    email_service.mail.init_app(app)
+    for module in (controller.auth, controller.buddy_program, controller.esner, controller.buddy, controller.admin):
+        app.register_blueprint(module.bp)
+    # Endpoints of app.py used by the layout
+    app.add_url_rule('/', 'home', lambda: '')
+    app.add_url_rule('/TermAndCondition', 'term_and_Condition', lambda: '')
+    return app
+
+
+def build_database(path, n_buddies, n_esners, seed):
+    """
+    Populate a new SQLite database with generated cohorts.
+
+    Emails and phone numbers are made unique with the row index, since the generators can
+    repeat them on large cohorts. One Buddy in ten is assigned to a random Esner so that
+    availability scores differ.
+    """
+    from utils.utils import add_test_esner_and_admin_role
+
+    random.seed(seed)
+    Faker.seed(seed)
+    fake = Faker()
+    options = load_options()
+
+    app = create_app(path)
+    with app.app_context():
+        db.create_all()
+        add_test_esner_and_admin_role()
+        esners = []
+        for index in range(n_esners):
+            esner = generate_esner(fake, options)
+            esner.email = f"{index}.{esner.email}"
+            esner.phone_number = f"e{index}"
+            esners.append(esner)
+        db.session.add_all(esners)
+        db.session.flush()
+        buddies = []
+        for index in range(n_buddies):
+            buddy = generate_buddy(fake, options)
+            buddy.phone_number = f"b{index}"
+            if index % 10 == 0:
+                buddy.esn_member_id = random.choice(esners).id
+            buddies.append(buddy)
+        db.session.add_all(buddies)
+        db.session.flush()
+        buddy_counts.repair()
+        db.session.commit()
+    with app.app_context():
+        db.engine.dispose()
+
+
+def get_schema_version():
+    """Short hash of the tables and columns of the models, so cached databases follow model changes."""
+    columns = sorted(f"{table.name}.{column.name}" for table in db.metadata.tables.values() for column in table.columns)
+    return hashlib.sha1(','.join(columns).encode('utf-8')).hexdigest()[:8]
+
+
+def prepare_database(workdir, n_buddies, n_esners, seed, fresh=False):
+    """Copy the cached database of a size and seed into `workdir`, generating it when needed."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    name = f"cohort_{n_buddies}x{n_esners}_seed{seed}_{get_vocabulary_version()}_{get_schema_version()}.db"
+    cached = os.path.join(CACHE_DIR, name)
+    if fresh or not os.path.exists(cached):
+        partial = cached + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        build_database(partial, n_buddies, n_esners, seed)
+        os.replace(partial, cached)
+    path = os.path.join(workdir, name)
+    shutil.copyfile(cached, path)
+    return path
+
+
+def measure(function, repeat, memory=True):
+    """
+    Time `function` `repeat` times, then trace the peak memory of one more run.
+
+    :return: Dictionary with 'best', 'median' (seconds) and 'peak_memory' (bytes, or None)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'best': min(times), 'median': statistics.median(times), 'peak_memory': peak}
+
+
+def count_queries(client, url):
+    """
+    Request a page and count the SQL statements it runs.
+
+    :return: Number of statements
+    :raises RuntimeError: When the page doesn't return HTTP 200
+    """
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} returned {response.status_code}")
+    return len(statements)
+
+
+def benchmark_size(n_buddies, n_esners, seed, repeat, memory, fresh):
+    """
+    Run every phase on one cohort size.
+
+    :return: Tuple (results keyed by phase, SQL statement counts keyed by page)
+    """
+    workdir = tempfile.mkdtemp(prefix='esn_match_benchmark_')
+    try:
+        path = prepare_database(workdir, n_buddies, n_esners, seed, fresh)
+        app = create_app(path)
+        results = {}
+        with app.app_context():
+            results['cohort_load'] = measure(load_cohort_snapshot, repeat, memory)
+            esners = Esner.query.all()
+            buddies = Buddy.query.filter_by(esn_member_id=None).all()
+
+            rng = random.Random(seed)
+            pairs = [
+                (rng.choice(buddies), rng.choice(esners))
+                for _ in range(min(SCORE_PAIR_SAMPLE, len(buddies) * len(esners)))
+            ]
+            result = measure(lambda: [compute_match_score(b, e) for b, e in pairs], 1, memory=False)
+            result['best'] /= len(pairs)
+            result['median'] /= len(pairs)
+            results['score_pair'] = result
+
+            results['scoring'] = measure(lambda: compute_match_matrix(buddies, esners), repeat, memory)
+            matrix = compute_match_matrix(buddies, esners)
+            results['selection'] = measure(lambda: match_making(buddies, esners, matrix), repeat, memory)
+            if len(buddies) * len(esners) <= ASSIGNMENT_MAX_PAIRS:
+                results['assignment'] = measure(lambda: assignment_match_making(buddies, esners, matrix), 1, memory)
+            esner_id = Esner.query.filter_by(email="test@esnpalermo.com").first().id
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['esner_id'] = esner_id
+
+        def request_page():
+            response = client.get('/buddyprogram/match/automatic_match')
+            if response.status_code != 200:
+                raise RuntimeError(f"automatic_match returned {response.status_code}")
+
+        results['end_to_end_cold'] = measure(request_page, 1, memory=False)
+        results['end_to_end_warm'] = measure(request_page, repeat, memory)
+        queries = {}
+        for url in QUERY_BUDGETS:
+            if url in COLD_PAGES:
+                # A new cohort version discards the stored run, like any profile change
+                with app.app_context():
+                    counters.increment(COHORT_VERSION_COUNTER)
+                    db.session.commit()
+                queries[url + COLD_SUFFIX] = count_queries(client, url)
+            queries[url] = count_queries(client, url)
+        with app.app_context():
+            db.engine.dispose()
+        return results, queries
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(previous, current, tolerance):
+    """
+    Print the ratio between the current and a previous run for every common phase.
+
+    :return: List of (size, phase, ratio) whose best time grew by more than `tolerance`
+    """
+    previous_runs = {(run['buddies'], run['esners']): run['phases'] for run in previous['runs']}
+    regressions = []
+    print(f"{'size':>12} {'phase':>16} {'before':>10} {'after':>10} {'ratio':>7}")
+    for run in current['runs']:
+        size = (run['buddies'], run['esners'])
+        before = previous_runs.get(size)
+        if before is None:
+            continue
+        for phase, result in run['phases'].items():
+            if phase not in before or not before[phase]['best']:
+                continue
+            ratio = result['best'] / before[phase]['best']
+            flag = ' REGRESSION' if ratio > 1 + tolerance else ''
+            print(f"{size[0]:>6}x{size[1]:<5} {phase:>16} {before[phase]['best']:>10.4g} "
+                  f"{result['best']:>10.4g} {ratio:>7.2f}{flag}")
+            if flag:
+                regressions.append((size, phase, ratio))
+    return regressions
+
+
+def main():
+    """Parse the command line, run the benchmark and write (and optionally compare) the results."""
+    parser = argparse.ArgumentParser(description="Benchmark the ESN matching engine.")
+    parser.add_argument('--sizes', type=parse_sizes, default=DEFAULT_SIZES,
+                        help="Comma separated BUDDIESxESNERS sizes (default: 100x20,1000x100,5000x500,20000x2000)")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the cohort generators")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed repetitions of each phase")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file receiving the results")
+    parser.add_argument('--compare', help="Previous results file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown before a phase is reported as a regression")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the peak memory runs")
+    parser.add_argument('--fresh', action='store_true', help="Regenerate the cached cohorts")
+    args = parser.parse_args()
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'runs': [],
+    }
+    over_budget = []
+    for n_buddies, n_esners in args.sizes:
+        print(f"Benchmarking {n_buddies} buddies x {n_esners} esners...")
+        phases, queries = benchmark_size(n_buddies, n_esners, args.seed, args.repeat, not args.no_memory, args.fresh)
+        for phase, result in phases.items():
+            memory = f", peak {result['peak_memory'] / 2**20:.1f} MiB" if result['peak_memory'] else ''
+            print(f"  {phase:>16}: best {result['best']:.4g}s, median {result['median']:.4g}s{memory}")
+        for url, count in queries.items():
+            budget = QUERY_BUDGETS[url.removesuffix(COLD_SUFFIX)]
+            flag = ' OVER BUDGET' if count > budget else ''
+            print(f"  {count:>3} SQL statements (budget {budget}) {url}{flag}")
+            if flag:
+                over_budget.append(((n_buddies, n_esners), url, count))
+        report['runs'].append({'buddies': n_buddies, 'esners': n_esners, 'phases': phases, 'queries': queries})
+    # ru_maxrss is in kilobytes on Linux
+    report['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = False
+    if over_budget:
+        print(f"{len(over_budget)} page(s) ran more SQL statements than their budget")
+        failed = True
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            previous = json.load(file)
+        regressions = compare(previous, report, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} phase(s) slower than the tolerance of {args.tolerance:.0%}")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
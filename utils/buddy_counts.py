@@ -0,0 +1,104 @@
+"""
+Esner Buddy Counters for ESN Matchmaking System
+
+The Esner table stores the number of Buddies assigned to each Esner in the indexed
+`buddy_count` column, so capacity filters and "fewest Buddies first" orderings don't have to
+aggregate the Buddy table. The counter is updated in the same transaction as the assignment,
+with an `UPDATE ... SET buddy_count = buddy_count + 1` expression so concurrent requests
+don't overwrite each other's changes.
+
+Every change of `Buddy.esn_member_id` has to go through `assign` and `unassign`. Counters
+drifting for any other reason (manual SQL, scripts) are found and repaired by `find_drift`
+and `repair`, also available as `flask match check-buddy-counts`.
+
+Functions:
+- assign(buddy, esner): Assigns a Buddy to an Esner, moving it from its previous Esner.
+- unassign(buddy): Removes the Esner of a Buddy.
+- clear(): Resets every counter, after all the Buddies have been deleted.
+- find_drift(): Returns the Esners whose counter differs from their number of Buddies.
+- repair(esner_ids=None): Recomputes the drifting counters.
+"""
+
+from sqlalchemy import func
+
+from database.db import db
+from database.tables import Buddy, Esner
+
+
+def _adjust(esner_id, delta):
+    """Add `delta` to the counter of an Esner, also updating the instance loaded in the session."""
+    Esner.query.filter_by(id=esner_id).update(
+        {'buddy_count': Esner.buddy_count + delta}, synchronize_session='evaluate'
+    )
+
+
+def assign(buddy, esner):
+    """
+    Assign `buddy` to `esner` and update the counters. The caller commits the session.
+
+    :param buddy: The Buddy instance
+    :param esner: The Esner instance
+    """
+    if buddy.esn_member_id == esner.id:
+        return
+    if buddy.esn_member_id is not None:
+        _adjust(buddy.esn_member_id, -1)
+    buddy.esn_member_id = esner.id
+    _adjust(esner.id, 1)
+
+
+def unassign(buddy):
+    """
+    Remove the Esner of `buddy` and update its counter. The caller commits the session.
+
+    :param buddy: The Buddy instance
+    """
+    if buddy.esn_member_id is None:
+        return
+    _adjust(buddy.esn_member_id, -1)
+    buddy.esn_member_id = None
+
+
+def clear():
+    """Reset every counter to 0, after all the Buddies have been deleted."""
+    Esner.query.update({'buddy_count': 0}, synchronize_session=False)
+
+
+def _actual_counts():
+    """Correlated subquery counting the Buddies of each Esner."""
+    return (
+        db.session.query(func.count(Buddy.id))
+        .filter(Buddy.esn_member_id == Esner.id)
+        .correlate(Esner)
+        .scalar_subquery()
+    )
+
+
+def find_drift():
+    """
+    Return the Esners whose counter differs from their number of Buddies.
+
+    :return: List of (esner_id, stored_count, actual_count) tuples
+    """
+    actual = _actual_counts()
+    rows = (
+        db.session.query(Esner.id, Esner.buddy_count, actual)
+        .filter(Esner.buddy_count != actual)
+        .order_by(Esner.id)
+        .all()
+    )
+    return [tuple(row) for row in rows]
+
+
+def repair(esner_ids=None):
+    """
+    Recompute the counters that differ from the number of Buddies. The caller commits the session.
+
+    :param esner_ids: Optional ids limiting the repair to some Esners
+    :return: Number of repaired counters
+    """
+    actual = _actual_counts()
+    query = Esner.query.filter(Esner.buddy_count != actual)
+    if esner_ids is not None:
+        query = query.filter(Esner.id.in_(esner_ids))
+    return query.update({'buddy_count': actual}, synchronize_session=False)
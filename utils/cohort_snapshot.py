@@ -0,0 +1,152 @@
+"""
+Cohort Snapshot Loader for ESN Matchmaking System
+
+This module loads the Buddies and Esners of an automatic matching run as lightweight,
+read-only records instead of ORM objects. Only the columns used by the matcher are fetched,
+the number of Buddies of each Esner is read from its `buddy_count` counter, and no ORM
+identity map is built, so matching large cohorts doesn't fire one lazy `esner.buddies` load
+per Esner nor keep every assigned Buddy in memory just to count them.
+
+Records expose the same attributes and `get_*` methods as the models for everything the
+matcher reads, so they can be passed to `compute_match_matrix`, `match_making`, the score
+store, etc. in place of Buddy and Esner instances.
+
+Classes:
+- BuddyRecord: Snapshot of the matching columns of a Buddy.
+- EsnerRecord: Snapshot of the matching columns of an Esner, with its capacity and buddy count.
+
+Functions:
+- load_cohort_snapshot(): Loads the unmatched Buddies and the Esners with free slots in two queries.
+- load_buddy_records(ids), load_esner_records(ids): Load the records of given Buddies or Esners.
+"""
+
+import json
+
+from database.db import db
+from database.tables import Buddy, Esner
+
+# Maximum number of ids per IN (...) query
+QUERY_CHUNK_SIZE = 500
+
+# Columns read by the matcher, shared by Buddy and Esner
+PROFILE_COLUMNS = (
+    'id', 'gender', 'languages_spoken', 'nationality', 'faculty', 'interests',
+    'languages_spoken_bits', 'nationality_bits', 'faculty_bits', 'interests_bits', 'encoding_version',
+)
+
+
+class ProfileRecord:
+    """
+    Read-only snapshot of the matching columns of a Buddy or Esner.
+
+    The `get_*` methods decode the JSON columns like the model methods of the same name.
+    """
+
+    __slots__ = PROFILE_COLUMNS
+    _fields = PROFILE_COLUMNS
+
+    def __init__(self, row):
+        for name in self._fields:
+            object.__setattr__(self, name, getattr(row, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.id}>"
+
+    def get_languages_spoken(self):
+        """Returns the list of languages spoken."""
+        return json.loads(self.languages_spoken)
+
+    def get_nationality(self):
+        """Returns the list of nationalities."""
+        return json.loads(self.nationality)
+
+    def get_faculty(self):
+        """Returns the list of faculties."""
+        return json.loads(self.faculty)
+
+    def get_interests(self):
+        """Returns the list of interests."""
+        return json.loads(self.interests)
+
+
+class BuddyRecord(ProfileRecord):
+    """Read-only snapshot of a Buddy."""
+
+    __slots__ = ()
+
+
+class EsnerRecord(ProfileRecord):
+    """
+    Read-only snapshot of an Esner.
+
+    Attributes:
+        max_number_of_buddy (int): Maximum number of Buddies of the Esner.
+        buddy_count (int): Number of Buddies assigned when the snapshot was taken.
+    """
+
+    __slots__ = ('max_number_of_buddy', 'buddy_count')
+    _fields = PROFILE_COLUMNS + __slots__
+
+
+def load_cohort_snapshot():
+    """
+    Load the cohorts of an automatic matching run as read-only records.
+
+    One query fetches the Esners whose buddy_count is lower than their max_number_of_buddy;
+    a second one fetches the Buddies without an Esner. Both are ordered by id.
+
+    :return: Tuple (buddies, esners) of BuddyRecord and EsnerRecord lists
+    """
+    esner_rows = (
+        db.session.query(
+            *(getattr(Esner, column) for column in PROFILE_COLUMNS),
+            Esner.max_number_of_buddy,
+            Esner.buddy_count,
+        )
+        .filter(Esner.buddy_count < Esner.max_number_of_buddy)
+        .order_by(Esner.id)
+        .all()
+    )
+    buddy_rows = (
+        db.session.query(*(getattr(Buddy, column) for column in PROFILE_COLUMNS))
+        .filter(Buddy.esn_member_id.is_(None))
+        .order_by(Buddy.id)
+        .all()
+    )
+    return [BuddyRecord(row) for row in buddy_rows], [EsnerRecord(row) for row in esner_rows]
+
+
+def _load_by_ids(query, model, ids):
+    """Run `query` for the given ids, in chunks, ordered by id."""
+    ids = sorted(ids)
+    rows = []
+    for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+        rows.extend(query.filter(model.id.in_(ids[start:start + QUERY_CHUNK_SIZE])).order_by(model.id))
+    return rows
+
+
+def load_buddy_records(ids):
+    """
+    Load the records of the given Buddies, whatever their current Esner.
+
+    :param ids: Iterable of Buddy ids
+    :return: List of BuddyRecord ordered by id (deleted Buddies are missing)
+    """
+    query = db.session.query(*(getattr(Buddy, column) for column in PROFILE_COLUMNS))
+    return [BuddyRecord(row) for row in _load_by_ids(query, Buddy, ids)]
+
+
+def load_esner_records(ids):
+    """
+    Load the records of the given Esners, whatever their free slots.
+
+    :param ids: Iterable of Esner ids
+    :return: List of EsnerRecord ordered by id (deleted Esners are missing)
+    """
+    query = db.session.query(
+        *(getattr(Esner, column) for column in PROFILE_COLUMNS), Esner.max_number_of_buddy, Esner.buddy_count,
+    )
+    return [EsnerRecord(row) for row in _load_by_ids(query, Esner, ids)]
@@ -5,12 +5,46 @@ class BaseConfig:
     SECRET_KEY = os.getenv("SECRET_KEY")  # NEVER use default in production
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     TOP_AUTOMATIC_MATCH = 3
+    AUTOMATIC_MATCH_MODE = "greedy"  # "greedy" (top suggestions) or "assignment" (capacity-aware)
+    MATCH_CANDIDATE_PRUNING = False  # Score only pairs sharing a language/nationality/faculty/interest
+    MATCH_CANDIDATE_FALLBACK_SIZE = 10  # Most available Esners scored for Buddies without enough candidates
+    MATCH_SCORE_STORE = True  # Persist static match scores and only recompute new or edited profiles
+    MATCH_PROPOSALS = True  # Store automatic match runs and reuse them until Buddy/Esner data changes
+    MATCH_BACKGROUND_JOBS = True  # Run automatic matching as a background job with progress polling
+    MATCH_JOB_RUNNER = "poll"  # "poll" (status requests do the work), "thread" or "queue" (flask match run-jobs)
+    MATCH_JOB_POLL_SECONDS = 5  # Work done per status request with the "poll" runner
+    MATCH_JOB_BLOCK_SIZE = 500  # Buddies scored between two progress updates
+    MATCH_JOB_LEASE_SECONDS = 600  # A job claimed by a runner is not picked up by another one for this long
+    MATCH_PARALLEL_WORKERS = 0  # Processes scoring the matrix when the score store is off (0 or 1: serial)
+    MATCH_PARALLEL_BLOCK_SIZE = 1024  # Buddies scored per process pool task
+    BACKFILL_BATCH_SIZE = 500  # Rows updated per backfill transaction (flask backfill run)
+    BACKFILL_SLEEP_SECONDS = 0.1  # Pause between two backfill batches, leaving room for web requests
+    AUTH_ROLE_CLAIM = True  # Cache the roles in the (signed) session until they change, skipping the role query
+    MANUAL_MATCH_PAGE_SIZE = 50  # Buddies/ESNers fetched per page by the manual match tables
+    SQL_INSTRUMENTATION = True  # Count the SQL statements and time of each request (Server-Timing header)
+    SQL_SLOW_QUERY_SECONDS = 0.5  # Statements slower than this are printed with their endpoint (None: off)
+    SQL_LOG_REQUESTS = False  # Print the statement count and database time of every request
+    METRICS_ENABLED = True  # Record request latency histograms, served to admins at /admin/metrics
+    PROFILER_DIR = None  # Directory of the admin request profiles (None: "profiles" in the instance folder)
+    PROFILER_MAX_REPORTS = 20  # Profiles kept on disk, the oldest are deleted first
     MAIL_SERVER = 'smtp.gmail.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.getenv("MAIL_USERNAME", "")
     MAIL_PASSWORD = os.getenv("MAIL_PASSWORD", "")
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER", "")
+    MAIL_MAX_MESSAGES_PER_CONNECTION = 50  # Emails sent over one SMTP connection before it is reopened (0: no limit)
+    EMAIL_OUTBOX = False  # Queue emails in the EmailOutbox table in the request transaction (needs a worker, see README)
+    EMAIL_OUTBOX_RUNNER = "thread"  # "thread" (background thread, long-running servers only) or "queue" (flask email send-outbox)
+    EMAIL_MAX_ATTEMPTS = 5  # Delivery attempts before an email is marked "failed"
+    EMAIL_RETRY_SECONDS = 60  # Delay before the first retry, doubled after each failed attempt
+    EMAIL_LEASE_SECONDS = 120  # An email claimed by a worker is not picked up by another one for this long
+    EMAIL_RATE_PER_MINUTE = 20  # Emails sent per minute at most, by all outbox workers together (direct sends: per process; None: no limit)
+    EMAIL_RATE_BURST = 10  # Emails sent back to back before EMAIL_RATE_PER_MINUTE applies
+    EMAIL_DAILY_LIMIT = 500  # Emails sent per rolling 24 hours at most (Gmail account limit; None: no limit)
+    EMAIL_QUEUE_LIMIT = 1000  # Pending emails beyond which non-transactional emails are refused (None: no limit)
+    EMAIL_RATE_MAX_WAIT_SECONDS = 10  # Longest wait for the rate limit of a direct send (EMAIL_OUTBOX off)
+    EMAIL_ESNER_DIGEST_SECONDS = 0  # Window merging the match notices of an ESNer into one digest (0: off, needs EMAIL_OUTBOX)
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
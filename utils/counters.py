@@ -0,0 +1,53 @@
+"""
+Shared Counters for ESN Matchmaking System
+
+Named counters stored in the Counter table, for values that must be unique or ordered across
+every process (several web workers, the CLI, background jobs). A counter is advanced with a
+single `UPDATE ... SET value = value + n`, so the database serializes concurrent increments:
+the row stays locked until the caller's transaction ends, and two transactions never get the
+same value.
+
+Functions:
+- increment(name, amount=1): Advances a counter and returns its new value.
+- get_value(name): Returns the current value of a counter.
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+from database.db import db
+from database.tables import Counter
+
+
+def increment(name, amount=1):
+    """
+    Advance a counter, creating it on first use.
+
+    The counter row stays locked until the caller commits or rolls back, so the values
+    `result - amount + 1` to `result` belong to the caller alone.
+
+    :param name: Name of the counter
+    :param amount: Number of values to take
+    :return: The new value of the counter
+    """
+    updated = Counter.query.filter_by(name=name).update(
+        {Counter.value: Counter.value + amount}, synchronize_session=False
+    )
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Counter(name=name, value=amount))
+            return amount
+        except IntegrityError:
+            # Created by a concurrent transaction in the meantime
+            return increment(name, amount)
+    return get_value(name)
+
+
+def get_value(name):
+    """
+    Return the current value of a counter.
+
+    :param name: Name of the counter
+    :return: Its value, 0 if it was never incremented
+    """
+    return db.session.query(Counter.value).filter_by(name=name).scalar() or 0
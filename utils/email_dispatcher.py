@@ -0,0 +1,301 @@
+"""
+Email Rate Limiting for ESN Matchmaking System
+
+SMTP providers cap the number of emails an account can send (Gmail: about 500 per rolling 24
+hours, and bursts get throttled). Sending past the cap makes every following email fail, so a
+mass operation would stop halfway. This module keeps the sends of EmailService under the
+configured rates, and tells callers when emails can't be accepted.
+
+Rates:
+- EMAIL_RATE_PER_MINUTE / EMAIL_RATE_BURST: token bucket taken by every SMTP send (see
+  `SmtpBatch.send`). Up to EMAIL_RATE_BURST emails go out back to back, then one per
+  60 / EMAIL_RATE_PER_MINUTE seconds. Senders wait for a token: the outbox worker for up to half
+  an email lease, a direct send (EMAIL_OUTBOX off) for up to EMAIL_RATE_MAX_WAIT_SECONDS.
+  The buckets live in the memory of each process. The outbox worker also counts the emails
+  sent in the last minute in the database, shared by every process, and waits while
+  EMAIL_RATE_PER_MINUTE of them are younger than a minute (see `wait_shared_rate`); direct
+  sends are only limited per process.
+- EMAIL_DAILY_LIMIT: a second bucket refilled over 24 hours. The outbox worker also counts the
+  emails sent in the last 24 hours in the database, and stops once the limit is reached; the
+  remaining emails wait in the outbox.
+
+Priorities: the outbox delivers the emails of a lower priority class first, so a password reset
+queued behind a batch of match notices still goes out next.
+
+Backpressure: once EMAIL_QUEUE_LIMIT emails are pending, queuing another one that is not
+"transactional" raises EmailBackpressure, with the estimated seconds before the outbox drains.
+The caller's transaction is rolled back and it can answer 503 with a Retry-After header
+instead of queuing emails the provider won't accept for hours. A direct send that waited too
+long for a token raises it too.
+
+Classes:
+- TokenBucket: Thread-safe token bucket.
+- EmailBackpressure: Raised when an email can't be accepted now.
+
+Functions:
+- acquire(timeout): Takes a token of the rate limits, waiting up to `timeout` seconds.
+- check_capacity(priority): Raises EmailBackpressure when the outbox is full for a priority class.
+- queue_depth(): Returns the number of pending emails of each priority class.
+- wait_shared_rate(timeout): Waits until the per-minute limit of every process allows another outbox email.
+- daily_remaining(): Returns the number of emails the daily limit still allows.
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from database.db import db
+from database.tables import EmailOutbox
+from utils import metrics
+
+# Priority classes, delivered in this order
+PRIORITIES = {
+    'transactional': 0,  # Expected right away by the user (password reset, registration)
+    'notification': 1,  # Match and data notices
+    'bulk': 2,  # Mail merges
+}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+
+class EmailBackpressure(Exception):
+    """
+    An email can't be accepted now.
+
+    Attributes:
+    - retry_after: Estimated seconds before it would be accepted.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket holding up to `capacity` tokens, refilled with `rate` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        """
+        Check whether a token is available, without taking it.
+
+        :return: 0 when a token is available, otherwise the seconds before one is
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def try_acquire(self):
+        """
+        Take a token if one is available.
+
+        :return: 0 when a token was taken, otherwise the seconds before one is available
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """
+        Take a token, waiting for one for up to `timeout` seconds (forever with None).
+
+        :return: True when a token was taken
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_recent_sends = deque()  # time.monotonic() of the tokens taken in the last minute
+
+
+def _get_bucket(name, rate, capacity):
+    """Bucket of a rate limit, recreated when its configuration changes."""
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None or (bucket.rate, bucket.capacity) != (rate, capacity):
+            bucket = _buckets[name] = TokenBucket(rate, capacity)
+        return bucket
+
+
+def _limits():
+    """The buckets of the configured rate limits."""
+    config = current_app.config
+    buckets = []
+    per_minute = config.get("EMAIL_RATE_PER_MINUTE")
+    if per_minute:
+        buckets.append(_get_bucket('minute', per_minute / 60, config.get("EMAIL_RATE_BURST") or 1))
+    per_day = config.get("EMAIL_DAILY_LIMIT")
+    if per_day:
+        buckets.append(_get_bucket('day', per_day / 86400, per_day))
+    return buckets
+
+
+def _try_acquire_all(buckets):
+    """
+    Take a token of every bucket, or none at all.
+
+    The tokens are only taken under `_buckets_lock`, so none can disappear between the check
+    and the take.
+
+    :return: 0 when the tokens were taken, otherwise the seconds before every bucket has one
+    """
+    with _buckets_lock:
+        wait = max((bucket.wait_time() for bucket in buckets), default=0)
+        if not wait:
+            for bucket in buckets:
+                bucket.try_acquire()
+        return wait
+
+
+def acquire(timeout):
+    """
+    Take a token of every rate limit before an SMTP send.
+
+    The tokens are taken together: a send refused by one limit (e.g. the daily one) doesn't
+    use up a token of the others.
+
+    :param timeout: Seconds to wait for the tokens at most (None: as long as needed)
+    :raise EmailBackpressure: When the tokens were not available in time
+    """
+    buckets = _limits()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = _try_acquire_all(buckets)
+        if not wait:
+            break
+        if deadline is not None and time.monotonic() + wait > deadline:
+            metrics.EMAIL_BACKPRESSURE.inc('rate')
+            raise EmailBackpressure("Email sending rate limit reached", retry_after=wait)
+        time.sleep(wait)
+    now = time.monotonic()
+    with _buckets_lock:
+        _recent_sends.append(now)
+        while _recent_sends and _recent_sends[0] < now - 60:
+            _recent_sends.popleft()
+
+
+def queue_depth():
+    """
+    Return the number of pending emails of each priority class.
+
+    :return: Dictionary {priority name: count}
+    """
+    rows = (
+        db.session.query(EmailOutbox.priority, func.count())
+        .filter(EmailOutbox.status == 'pending')
+        .group_by(EmailOutbox.priority)
+    )
+    return {PRIORITY_NAMES.get(priority, str(priority)): count for priority, count in rows}
+
+
+def _drain_seconds(pending):
+    """Estimated seconds before `pending` emails are sent at the configured rate."""
+    per_minute = current_app.config.get("EMAIL_RATE_PER_MINUTE")
+    return pending * 60 / per_minute if per_minute else 0
+
+
+def check_capacity(priority):
+    """
+    Check that the outbox can take another email of a priority class.
+
+    :param priority: Name of the priority class
+    :raise EmailBackpressure: When EMAIL_QUEUE_LIMIT emails are pending and the email is not transactional
+    """
+    limit = current_app.config.get("EMAIL_QUEUE_LIMIT")
+    if not limit or PRIORITIES[priority] == PRIORITIES['transactional']:
+        return
+    pending = EmailOutbox.query.filter(EmailOutbox.status == 'pending').count()
+    if pending >= limit:
+        metrics.EMAIL_BACKPRESSURE.inc('queue')
+        raise EmailBackpressure(
+            f"{pending} emails are waiting to be sent", retry_after=_drain_seconds(pending - limit + 1),
+        )
+
+
+def _sent_since(seconds):
+    """Query of the outbox emails sent in the last `seconds` seconds, by any process."""
+    return EmailOutbox.query.filter(
+        EmailOutbox.status == 'sent', EmailOutbox.sent_at >= datetime.utcnow() - timedelta(seconds=seconds),
+    )
+
+
+def wait_shared_rate(timeout):
+    """
+    Wait until EMAIL_RATE_PER_MINUTE allows another outbox email, counting the emails sent in
+    the last minute by every process.
+
+    :param timeout: Seconds to wait at most
+    :raise EmailBackpressure: When the limit doesn't allow an email within `timeout` seconds
+    """
+    per_minute = current_app.config.get("EMAIL_RATE_PER_MINUTE")
+    if not per_minute:
+        return
+    # Once `per_minute` emails are younger than a minute, the next one waits for the oldest of them
+    oldest = (
+        _sent_since(60).with_entities(EmailOutbox.sent_at)
+        .order_by(EmailOutbox.sent_at.desc())
+        .offset(per_minute - 1)
+        .limit(1)
+        .scalar()
+    )
+    if oldest is None:
+        return
+    wait = (oldest + timedelta(seconds=60) - datetime.utcnow()).total_seconds()
+    if wait > timeout:
+        metrics.EMAIL_BACKPRESSURE.inc('rate')
+        raise EmailBackpressure("Email sending rate limit reached", retry_after=wait)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def daily_remaining():
+    """
+    Return the number of emails EMAIL_DAILY_LIMIT still allows, from the outbox emails sent in
+    the last 24 hours.
+
+    :return: Number of emails, or None without a daily limit
+    """
+    limit = current_app.config.get("EMAIL_DAILY_LIMIT")
+    if not limit:
+        return None
+    return max(limit - _sent_since(86400).count(), 0)
+
+
+def _sends_last_minute():
+    now = time.monotonic()
+    with _buckets_lock:
+        return sum(1 for sent in _recent_sends if sent >= now - 60)
+
+
+metrics.Gauge(
+    'email_outbox_depth', "Pending emails in the outbox by priority class.", ('priority',),
+    callback=lambda: {(name,): queue_depth().get(name, 0) for name in PRIORITIES},
+)
+metrics.Gauge(
+    'email_send_rate_per_minute', "Emails sent by this process in the last minute.",
+    callback=_sends_last_minute,
+)
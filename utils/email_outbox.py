@@ -0,0 +1,337 @@
+"""
+Transactional Email Outbox for ESN Matchmaking System
+
+With EMAIL_OUTBOX enabled, `EmailService.send_email` doesn't talk to the SMTP server: it adds
+the rendered email to the EmailOutbox table, in the same transaction as the change it
+notifies. The request commits without waiting for SMTP, an email is only sent if its change
+committed, and an SMTP failure no longer rolls the change back.
+
+The outbox is off by default, since it needs something running to deliver the emails.
+
+Delivery (EMAIL_OUTBOX_RUNNER):
+- "thread": after every commit that queued emails, a background thread of the web process
+  delivers the due emails, and wakes up again when the next retry or digest is due. Only for
+  long-running servers: serverless hosting (e.g. the Vercel deployment) freezes the process
+  after the response, and the emails would stay pending.
+- "queue": emails wait for `flask email send-outbox`, run by cron every minute or kept
+  running with --watch, on any machine with access to the database.
+
+Emails are delivered by priority class, then in id order, over one SMTP connection per
+delivery run (see `EmailService.batch`), within the sending rate limits of
+utils.email_dispatcher. A failed attempt is retried after EMAIL_RETRY_SECONDS,
+doubled after each failure, until EMAIL_MAX_ATTEMPTS attempts have failed; the email is then
+marked "failed". A worker takes a lease on each email with a conditional UPDATE before
+sending it, so several workers never send the same email.
+
+Digests: an email queued with a digest key (e.g. the match notices of one ESNer, with
+EMAIL_ESNER_DIGEST_SECONDS) waits for the digest window. When the first one is due, every
+pending email of the same key is claimed with it and one digest, rendered from their
+digest_data, is sent instead; the other emails are marked "coalesced".
+
+Functions:
+- enqueue(recipient, subject, html, priority, digest_key, digest_data, delay): Adds an email to the
+  outbox (the caller commits).
+- deliver_pending(limit=None): Delivers the due emails.
+- outbox_counts(): Returns the number of emails of each status.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, func, or_, tuple_
+from sqlalchemy.orm import Session
+
+from database.db import db
+from database.tables import EmailOutbox
+from utils import email_dispatcher, email_templates
+
+# Background thread of the "thread" runner, created on first use, and its wake-up timer
+_executor = None
+_scheduled = None
+_timer = None
+_runner_lock = threading.Lock()
+
+# Digest of each digest key kind: template and subject, with the number of emails merged
+DIGESTS = {
+    'match_esner': ('match_esner_digest', "🎉 {count} Buddies have been assigned to you!"),
+}
+
+
+def enqueue(recipient, subject, html, priority='notification', digest_key=None, digest_data=None, delay=0):
+    """
+    Add an email to the outbox. It is delivered once the caller commits the session.
+
+    :param recipient: Email address of the recipient
+    :param subject: Subject of the email
+    :param html: HTML body of the email, sent when no other email joins its digest
+    :param priority: Priority class (see email_dispatcher.PRIORITIES)
+    :param digest_key: Optional "<kind>:<id>" key merging the pending emails into one digest,
+                       the kind being a key of DIGESTS (e.g. "match_esner:12")
+    :param digest_data: Variables of the email in the digest template
+    :param delay: Seconds before the email is due (the digest window)
+    :return: The EmailOutbox instance
+    :raise EmailBackpressure: When the outbox is full for this priority class
+    """
+    email_dispatcher.check_capacity(priority)
+    email = EmailOutbox(
+        recipient=recipient, subject=subject, html=html, priority=email_dispatcher.PRIORITIES[priority],
+        digest_key=digest_key, digest_data=digest_data,
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(email)
+    db.session.info['email_outbox_queued'] = True
+    return email
+
+
+@event.listens_for(Session, 'after_commit')
+def _start_delivery(session):
+    """Start the "thread" runner after a commit that queued emails."""
+    if not session.info.pop('email_outbox_queued', False):
+        return
+    if current_app.config.get("EMAIL_OUTBOX_RUNNER", "thread") != "thread":
+        return
+    _submit(current_app._get_current_object())
+
+
+def _submit(app):
+    """Run a delivery in the background thread."""
+    global _executor, _scheduled
+    with _runner_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-outbox')
+        # A delivery that hasn't started yet will also pick up the new emails
+        if _scheduled is not None and not _scheduled.running() and not _scheduled.done():
+            return
+        _scheduled = _executor.submit(_deliver_in_app_context, app)
+
+
+def _submit_later(app, delay):
+    """Run a delivery in `delay` seconds, unless one is already planned sooner."""
+    global _timer
+    due = time.monotonic() + delay
+    with _runner_lock:
+        if _timer is not None and _timer.is_alive():
+            if _timer.due <= due:
+                return
+            _timer.cancel()
+        _timer = threading.Timer(delay, _submit, (app,))
+        _timer.due = due
+        _timer.daemon = True
+        _timer.start()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queued(session):
+    session.info.pop('email_outbox_queued', None)
+
+
+def _deliver_in_app_context(app):
+    """Entry point of the background thread."""
+    with app.app_context():
+        try:
+            counts = deliver_pending()
+            # Wake up for the next retry or digest, or a minute later when a rate limit stopped the run
+            delay = 60 if counts['rate_limited'] else _seconds_to_next_due()
+            if delay is not None:
+                _submit_later(app, max(delay, 1))
+        except Exception as e:
+            print(f"Email outbox delivery failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def _seconds_to_next_due():
+    """Seconds before the next pending email is due, or None when none is pending."""
+    due = db.session.query(func.min(EmailOutbox.next_attempt_at)).filter(EmailOutbox.status == 'pending').scalar()
+    return None if due is None else (due - datetime.utcnow()).total_seconds()
+
+
+def _claim(email_id, now):
+    """Take the lease of a due email; return False if another worker holds it."""
+    lease = current_app.config.get("EMAIL_LEASE_SECONDS", 120)
+    claimed = EmailOutbox.query.filter(
+        EmailOutbox.id == email_id,
+        EmailOutbox.status == 'pending',
+        or_(EmailOutbox.lease_until.is_(None), EmailOutbox.lease_until < now),
+    ).update({
+        'lease_until': now + timedelta(seconds=lease),
+        'attempts': EmailOutbox.attempts + 1,
+    }, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def deliver_pending(limit=None):
+    """
+    Deliver the due emails of the outbox, oldest first.
+
+    Every email is claimed, sent and committed on its own, so an interrupted worker only
+    leaves the email it was sending leased until its lease expires. The emails share one SMTP
+    connection. The run waits for the sending rate limits between emails (the per-minute one
+    counted over every process from the emails sent in the last minute), and stops when the
+    daily limit is reached or a rate limit keeps it waiting for more than half a lease.
+
+    :param limit: Optional maximum number of emails to process
+    :return: Dictionary with the number of emails 'sent', 'retried' (failed, will be retried)
+             and 'failed' (failed for the last time), 'coalesced' (merged into a digest), the
+             SMTP 'handshakes', the 'messages_per_second' of the run, and 'rate_limited' when a
+             limit stopped it
+    """
+    from utils.email_service import email_service
+
+    max_attempts = current_app.config.get("EMAIL_MAX_ATTEMPTS", 5)
+    retry_seconds = current_app.config.get("EMAIL_RETRY_SECONDS", 60)
+    counts = {'sent': 0, 'retried': 0, 'failed': 0, 'coalesced': 0}
+    remaining = email_dispatcher.daily_remaining()
+    rate_limited = False
+    with email_service.batch(max_wait=current_app.config.get("EMAIL_LEASE_SECONDS", 120) / 2) as batch:
+        last = (-1, 0)
+        while limit is None or sum(counts.values()) < limit:
+            if remaining is not None and counts['sent'] >= remaining:
+                rate_limited = True
+                break
+            try:
+                last = _deliver_next(batch, last, counts, max_attempts, retry_seconds)
+            except email_dispatcher.EmailBackpressure:
+                rate_limited = True
+                break
+            if last is None:
+                break
+    counts['handshakes'] = batch.handshakes
+    counts['messages_per_second'] = batch.messages_per_second()
+    counts['rate_limited'] = rate_limited
+    return counts
+
+
+def _deliver_next(batch, last, counts, max_attempts, retry_seconds):
+    """
+    Deliver the first due email after `last`, a (priority, id) position, with the emails of its
+    digest; return the position of the email, or None when none is due.
+    """
+    while True:
+        now = datetime.utcnow()
+        email = (
+            EmailOutbox.query
+            .filter(
+                tuple_(EmailOutbox.priority, EmailOutbox.id) > last,
+                EmailOutbox.status == 'pending',
+                EmailOutbox.next_attempt_at <= now,
+                or_(EmailOutbox.lease_until.is_(None), EmailOutbox.lease_until < now),
+            )
+            .order_by(EmailOutbox.priority, EmailOutbox.id)
+            .first()
+        )
+        if email is None:
+            return None
+        last = (email.priority, email.id)
+        if _claim(email.id, now):
+            break
+
+    group = [email] + (_claim_digest(email, now) if email.digest_key else [])
+    try:
+        subject, html = _render_digest(group) if len(group) > 1 else (email.subject, email.html)
+        email_dispatcher.wait_shared_rate(batch.max_wait)
+        batch.send(email.recipient, subject, html)
+    except email_dispatcher.EmailBackpressure:
+        # Not an attempt: release the emails for the next run
+        for item in group:
+            item.attempts -= 1
+            item.lease_until = None
+        db.session.commit()
+        raise
+    except Exception as e:
+        for item in group:
+            item.last_error = f"{type(e).__name__}: {e}"
+            if item.attempts >= max_attempts:
+                item.status = 'failed'
+                counts['failed'] += 1
+                print(f"Email {item.id} to {item.recipient} failed {item.attempts} times: {item.last_error}")
+            else:
+                item.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_seconds * 2 ** (item.attempts - 1))
+                counts['retried'] += 1
+    else:
+        sent_at = datetime.utcnow()
+        # The first email keeps the digest actually sent, the others point to it
+        email.subject, email.html = subject, html
+        email.status = 'sent'
+        email.sent_at = sent_at
+        counts['sent'] += 1
+        for item in group[1:]:
+            item.status = 'coalesced'
+            item.sent_at = sent_at
+            counts['coalesced'] += 1
+    for item in group:
+        item.lease_until = None
+    db.session.commit()
+    return last
+
+
+def _claim_digest(email, now):
+    """Claim the other pending emails of the digest of `email`, due or not."""
+    candidates = (
+        db.session.query(EmailOutbox.id)
+        .filter(
+            EmailOutbox.digest_key == email.digest_key,
+            EmailOutbox.status == 'pending',
+            EmailOutbox.id != email.id,
+            or_(EmailOutbox.lease_until.is_(None), EmailOutbox.lease_until < now),
+        )
+        .order_by(EmailOutbox.id)
+        .all()
+    )
+    claimed = [email_id for email_id, in candidates if _claim(email_id, now)]
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id).all() if claimed else []
+
+
+def _render_digest(group):
+    """Subject and body of the digest merging the emails of `group`."""
+    template, subject = DIGESTS[group[0].digest_key.split(':', 1)[0]]
+    return subject.format(count=len(group)), email_templates.render(template, items=[item.digest_data for item in group])
+
+
+def outbox_counts():
+    """
+    Return the number of emails of each status.
+
+    :return: Dictionary {status: count}
+    """
+    return dict(db.session.query(EmailOutbox.status, func.count()).group_by(EmailOutbox.status).all())
+
+
+email_cli = AppGroup('email', help="Deliver the emails of the outbox.")
+
+
+@email_cli.command('send-outbox')
+@click.option('--watch', is_flag=True, help="Keep polling for new emails instead of exiting.")
+@click.option('--interval', default=5.0, help="Seconds between two polls with --watch.")
+def send_outbox(watch, interval):
+    """Deliver the due emails of the outbox (EMAIL_OUTBOX_RUNNER = "queue")."""
+    while True:
+        counts = deliver_pending()
+        if counts['sent'] or counts['retried'] or counts['failed']:
+            rate = counts['messages_per_second']
+            print(f"Outbox: {counts['sent']} sent ({counts['coalesced']} more merged into digests), "
+                  f"{counts['retried']} to retry, {counts['failed']} failed, "
+                  f"{counts['handshakes']} SMTP handshakes" + (f", {rate:.1f} emails/s" if rate else ""))
+        if counts['rate_limited']:
+            print("Outbox: sending rate limit reached, the remaining emails wait for the next run")
+        if not watch:
+            break
+        time.sleep(interval)
+
+
+@email_cli.command('outbox-status')
+def outbox_status():
+    """Print the number of pending, sent and failed emails, and the pending ones by priority class."""
+    counts = outbox_counts()
+    print(", ".join(f"{status}: {counts.get(status, 0)}" for status in ('pending', 'sent', 'failed', 'coalesced')))
+    depth = email_dispatcher.queue_depth()
+    print("pending by priority: " + ", ".join(f"{name}: {depth.get(name, 0)}" for name in email_dispatcher.PRIORITIES))
+    remaining = email_dispatcher.daily_remaining()
+    if remaining is not None:
+        print(f"daily limit: {remaining} emails left")
@@ -7,11 +7,23 @@ to handle email sending operations, allowing the application to communicate with
 
 Components:
 
-- EmailService Class: Manages the setup and sending of emails using Flask-Mail.
+- SmtpBatch Class: Sends many emails over one SMTP connection instead of a connection (and a
+  connect/STARTTLS/login handshake) per email. The connection is reopened after
+  MAIL_MAX_MESSAGES_PER_CONNECTION emails, and once (with the email resent) when the server
+  dropped it. It counts the handshakes and the emails sent per second.
+- EmailService Class: Manages the setup and sending of emails using Flask-Mail. The bodies are
+  rendered from the autoescaped Jinja templates of `templates/email` (see utils.email_templates).
   - Methods:
-    - `send_email(to_email, subject, template)`: Sends a generic email with the specified recipient, subject, and HTML template.
+    - `send_email(to_email, subject, template, priority)`: Sends a generic email with the specified recipient, subject, and HTML
+      template, through the outbox when EMAIL_OUTBOX is enabled. Every SMTP send respects the rate limits of
+      utils.email_dispatcher; `priority` orders the outbox ("transactional" first, then "notification", then "bulk").
+    - `deliver(to_email, subject, template)`: Sends an email through the SMTP server right away. Its duration and
+      failures are recorded in the email_send_* metrics.
+    - `batch()`: Context manager sending the emails delivered in its block over one reused SMTP connection.
+    - `mail_merge(template_name, subject, recipients, **shared)`: Sends one email per recipient from a single template.
     - `send_match_notification_buddy(buddy, esner)`: Sends a notification email to a Buddy when they are matched with an ESNer.
-    - `send_match_notification_esner(buddy, esner)`: Sends a notification email to an ESNer when a Buddy is assigned to them.
+    - `send_match_notification_esner(buddy, esner)`: Sends a notification email to an ESNer when a Buddy is assigned to them,
+      merged with the other notices of the ESNer into one digest when EMAIL_ESNER_DIGEST_SECONDS is set.
     - `send_unmatch_notification_buddy(buddy)`: Sends a notification email to a Buddy when their match is removed.
     - `send_unmatch_notification_esner(buddy, esner)`: Sends a notification email to an ESNer when a Buddy is removed from their match list.
     - `send_data_elimination_notification(name, email)`: Sends a notification email to a user when their data is removed from the system.
@@ -35,9 +47,125 @@ email_service.send_match_notification_buddy(buddy, esner)
 ```
 Security Note: Ensure that sensitive information such as email credentials is kept secure and not exposed in version control systems.
 """
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
 from flask_mail import Message, Mail
 from flask import current_app, g
 
+from utils import email_dispatcher, email_outbox, email_templates, metrics
+
+# Errors after which the SMTP connection can't be used anymore
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SmtpBatch:
+    """
+    Sends emails over one SMTP connection, opened on the first email.
+
+    Attributes:
+    - sent: Number of emails sent.
+    - failed: Number of emails that couldn't be sent.
+    - handshakes: Number of connections opened (connect, STARTTLS and login).
+    - seconds: Time spent talking to the SMTP server, handshakes included.
+    """
+
+    def __init__(self, mail, max_wait=None):
+        """
+        :param mail: The Flask-Mail instance
+        :param max_wait: Seconds to wait for the sending rate limit before each email
+                         (default: EMAIL_RATE_MAX_WAIT_SECONDS)
+        """
+        self.mail = mail
+        self.max_wait = current_app.config.get("EMAIL_RATE_MAX_WAIT_SECONDS", 10) if max_wait is None else max_wait
+        self.max_messages = current_app.config.get("MAIL_MAX_MESSAGES_PER_CONNECTION", 50)
+        self.sent = 0
+        self.failed = 0
+        self.handshakes = 0
+        self.seconds = 0.0
+        self._connection = None
+        self._messages = 0  # Emails sent over the current connection
+
+    def messages_per_second(self):
+        """
+        :return: Emails sent per second of SMTP time, or None before the first email
+        """
+        return self.sent / self.seconds if self.seconds else None
+
+    def _open(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        if connection.host is not None:
+            # No handshake when MAIL_SUPPRESS_SEND is set
+            self.handshakes += 1
+            metrics.EMAIL_SMTP_HANDSHAKES.inc()
+        self._connection = connection
+        self._messages = 0
+
+    def _drop(self):
+        """Close the current connection, ignoring the errors of a connection already lost."""
+        connection, self._connection = self._connection, None
+        if connection is None or connection.host is None:
+            return
+        try:
+            connection.host.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.host.close()
+
+    def send(self, to_email, subject, template):
+        """
+        Send an email over the connection of the batch.
+
+        :param to_email: The email address of the recipient.
+        :param subject: The subject of the email.
+        :param template: The HTML content of the email.
+        :raise EmailBackpressure: When the rate limit didn't allow the email within `max_wait`.
+        """
+        email_dispatcher.acquire(self.max_wait)
+        msg = Message(
+            subject=subject,
+            recipients=[to_email],
+            html=template,
+            sender=current_app.config["MAIL_USERNAME"]
+        )
+        if self._connection is not None and self.max_messages and self._messages >= self.max_messages:
+            self._drop()
+        reused = self._connection is not None and self._messages > 0
+        start = time.perf_counter()
+        try:
+            try:
+                if self._connection is None:
+                    self._open()
+                self._connection.send(msg)
+            except CONNECTION_ERRORS:
+                self._drop()
+                if not reused:
+                    raise
+                # The server closed an idle connection: reconnect and resend once
+                self._open()
+                self._connection.send(msg)
+        except Exception as e:
+            if isinstance(e, CONNECTION_ERRORS):
+                self._drop()
+            elapsed = time.perf_counter() - start
+            self.seconds += elapsed
+            self.failed += 1
+            metrics.EMAIL_SEND_DURATION.observe(elapsed, 'failed')
+            metrics.EMAIL_SEND_FAILURES.inc(type(e).__name__)
+            raise
+        elapsed = time.perf_counter() - start
+        self.seconds += elapsed
+        self.sent += 1
+        self._messages += 1
+        metrics.EMAIL_SEND_DURATION.observe(elapsed, 'sent')
+
+    def close(self):
+        """Close the connection of the batch."""
+        self._drop()
+
+
 class EmailService:
     """
     A service class for handling email notifications within the ESN system.
@@ -52,22 +180,78 @@ class EmailService:
         Initializes the EmailService class and sets up the Flask Mail instance.
         """
         self.mail = Mail()
+        self._local = threading.local()  # Batch opened by `batch()` in the current thread
 
-    def send_email(self, to_email, subject, template):
+    @contextmanager
+    def batch(self, max_wait=None):
+        """
+        Send the emails delivered in the block over one SMTP connection.
+
+        Nested blocks reuse the batch of the outermost one.
+
+        :param max_wait: Seconds to wait for the sending rate limit before each email
+                         (default: EMAIL_RATE_MAX_WAIT_SECONDS).
+        :return: The SmtpBatch, whose counters report the handshakes and emails per second.
+        """
+        current = getattr(self._local, 'batch', None)
+        if current is not None:
+            yield current
+            return
+        batch = self._local.batch = SmtpBatch(self.mail, max_wait)
+        try:
+            yield batch
+        finally:
+            self._local.batch = None
+            batch.close()
+
+    def send_email(self, to_email, subject, template, priority='notification'):
         """
         Sends an email with the specified subject and HTML template to the given recipient.
+
+        With EMAIL_OUTBOX, the email is added to the outbox in the current transaction and
+        delivered after the caller commits (see utils.email_outbox); otherwise it is sent now.
         
         :param to_email: The email address of the recipient.
         :param subject: The subject of the email.
         :param template: The HTML content of the email.
+        :param priority: The priority class of the email (see utils.email_dispatcher).
+        :raise EmailBackpressure: When the email can't be accepted now because of the sending limits.
         """
-        msg = Message(
-            subject=subject,
-            recipients=[to_email],
-            html=template,
-            sender=current_app.config["MAIL_USERNAME"]
-        )
-        self.mail.send(msg)
+        if current_app.config.get("EMAIL_OUTBOX", False):
+            email_outbox.enqueue(to_email, subject, template, priority)
+        else:
+            self.deliver(to_email, subject, template)
+
+    def deliver(self, to_email, subject, template):
+        """
+        Sends an email through the SMTP server right away.
+
+        Inside a `batch()` block, the email goes over the connection of the batch; otherwise a
+        connection is opened for this email only.
+
+        :param to_email: The email address of the recipient.
+        :param subject: The subject of the email.
+        :param template: The HTML content of the email.
+        """
+        with self.batch() as batch:
+            batch.send(to_email, subject, template)
+
+    def mail_merge(self, template_name, subject, recipients, /, **shared):
+        """
+        Sends one email per recipient, rendered from a single compiled template.
+
+        The bodies are rendered together (see `email_templates.render_many`) and, when they are
+        sent right away, go over one SMTP connection.
+
+        :param template_name: The name of the template in `templates/email` (e.g. 'match_esner').
+        :param subject: The subject of the emails.
+        :param recipients: List of (email address, template variables) pairs.
+        :param shared: Template variables common to every email.
+        """
+        bodies = email_templates.render_many(template_name, (context for _, context in recipients), **shared)
+        with self.batch():
+            for (to_email, _), body in zip(recipients, bodies):
+                self.send_email(to_email, subject, body, 'bulk')
 
     def send_match_notification_buddy(self, buddy, esner):
         """
@@ -77,44 +261,38 @@ class EmailService:
         :param esner: The ESNer instance with whom the Buddy is matched.
         """
         subject = "🎉 You've been matched with an ESNer!"
-        template = f"""
-        <h2>Hi {buddy.name},</h2>
-        <p>We are excited to inform you that you have been matched with an ESNer!</p>
-        <p><b>Your ESNer:</b> {esner.name} {esner.surname}</p>
-        <p>Contact them at:</p>
-        <ul>
-            <li>Email: {esner.email}</li>
-            <li>Phone: {esner.phone_number}</li>
-        </ul>
-        <p>We hope you enjoy this experience and build a great connection!</p> <br>
-        <p>Best Regards,</p> <br>
-        <strong> {g.esner.name} {g.esner.surname} </strong>
-        """
+        template = email_templates.render('match_buddy', buddy=buddy, esner=esner, sender=g.esner)
         self.send_email(buddy.email, subject, template)
 
     def send_match_notification_esner(self, buddy, esner):
         """
         Sends a match notification to an ESNer when they are assigned a Buddy.
+
+        With EMAIL_ESNER_DIGEST_SECONDS (and EMAIL_OUTBOX), the notification waits in the outbox
+        for that many seconds, and the notifications queued for the ESNer meanwhile are sent as
+        one digest listing every new Buddy.
         
         :param buddy: The Buddy instance assigned to the ESNer.
         :param esner: The ESNer instance who is assigned a Buddy.
         """
         subject = "🎉 A Buddy has been assigned to you!"
-        template = f"""
-        <h2>Hi {esner.name},</h2>
-        <p>Great news! A Buddy has been assigned to you in the ESN Buddy Program.</p>
-        <p>Enter the web portal to get more information about his interests, nationality, languages he speaks, and faculty: (https://esn-palermo.vercel.app/)</p>
-        <p><b>Your Buddy:</b> {buddy.name} {buddy.surname}</p>
-        <p>Contact them at:</p>
-        <ul>
-            <li>Email: {buddy.email}</li>
-            <li>Phone: {buddy.phone_number}</li>
-        </ul>
-        <p>Thank you for being part of the ESN community!</p> <br>
-        <p>Best Regards,</p> <br>
-        <strong> {g.esner.name} {g.esner.surname} </strong>
-        """
-        self.send_email(esner.email, subject, template)
+        template = email_templates.render('match_esner', buddy=buddy, esner=esner, sender=g.esner)
+        window = current_app.config.get("EMAIL_ESNER_DIGEST_SECONDS")
+        if not window or not current_app.config.get("EMAIL_OUTBOX", False):
+            self.send_email(esner.email, subject, template)
+            return
+        # Digest mode: the notices queued for this ESNer within the window are sent as one email
+        contact = ('name', 'surname', 'email', 'phone_number')
+        email_outbox.enqueue(
+            esner.email, subject, template,
+            digest_key=f"match_esner:{esner.id}",
+            digest_data={
+                'esner': {'name': esner.name},
+                'buddy': {field: getattr(buddy, field) for field in contact},
+                'sender': {'name': g.esner.name, 'surname': g.esner.surname},
+            },
+            delay=window,
+        )
 
     def send_unmatch_notification_buddy(self, buddy):
         """
@@ -123,13 +301,7 @@ class EmailService:
         :param buddy: The Buddy instance whose match has been removed.
         """
         subject = "⚠️ Your ESN Buddy Match Has Been Removed"
-        template = f"""
-        <h2>Hi {buddy.name},</h2>
-        <p>Unfortunately, your ESNer match has been removed.</p>
-        <p>If you have any concerns, feel free to reach out to the ESN team.</p> <br>
-        <p>Best Regards,</p> <br>
-        <strong> {g.esner.name} {g.esner.surname} </strong>
-        """
+        template = email_templates.render('unmatch_buddy', buddy=buddy, sender=g.esner)
         self.send_email(buddy.email, subject, template)
 
     def send_unmatch_notification_esner(self, buddy, esner):
@@ -140,14 +312,7 @@ class EmailService:
         :param esner: The ESNer instance whose match with the Buddy has been removed.
         """
         subject = "⚠️ Your Buddy has been removed from your match list"
-        template = f"""
-        <h2>Hi {esner.name},</h2>
-        <p>Your Buddy, <b>{buddy.name} {buddy.surname}</b>, is no longer assigned to you.</p>
-        <p>You will be assigned a new Buddy soon!</p>
-        <p>If you need further assistance, feel free to contact the ESN team.</p> <br>
-        <p>Best Regards,</p> <br>
-        <strong> {g.esner.name} {g.esner.surname} </strong>
-        """
+        template = email_templates.render('unmatch_esner', buddy=buddy, esner=esner, sender=g.esner)
         self.send_email(esner.email, subject, template)
 
     def send_data_elimination_notification(self, name, email):
@@ -158,7 +323,7 @@ class EmailService:
         :param email: The email address of the user to send the notification to.
         """
         subject = "⚠️ Your Data Has Been Removed"
-        message = f"Dear {name},\n\nYour personal data has been completely removed from our ESN system.\n\nBest regards,\nYour ESN Team"
+        message = email_templates.render('data_elimination', name=name)
         self.send_email(email, subject, message)
             
     def send_reset_password_email(self, email, reset_link):
@@ -169,32 +334,8 @@ class EmailService:
         :param reset_link: The link for resetting the password.
         """
         subject = "🔐 Reset Your Password"
-        
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <body>
-            <h2>🔑 Password Reset</h2>
-            
-            <p>Hi there! 👋</p>
-            
-            <p>We received a request to reset your password. No worries, it happens to everyone!</p>
-            
-            <p><a href="{reset_link}">➡️ Click here to reset your password</a></p>
-            
-            <p>⏰ This link will expire in 24 hours.</p>
-            
-            <p>If you didn't request this change, you can safely ignore this email. Your account is still secure. 🛡️</p>
-            
-            <p>Need help? Just reply to this email and we'll be happy to assist! 😊</p>
-            
-            <p>Thanks,<br>
-            The Support Team 🚀</p>
-        </body>
-        </html>
-        """
-
-        self.send_email(email, subject, html_body)
+        html_body = email_templates.render('reset_password', reset_link=reset_link)
+        self.send_email(email, subject, html_body, 'transactional')
 
     def send_registration_confirmation(self, buddy):
         """
@@ -203,33 +344,7 @@ class EmailService:
         :param buddy: The Buddy instance who has successfully registered.
         """
         subject = "🎉 Welcome to ESN! Your Registration is Confirmed"
-        
-        body = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <p>Hi {buddy.name}, 👋</p>
-
-                <p>Welcome to the <strong>ESN Buddy Program</strong>! We're excited to have you on board. 🎈</p>
-
-                <p>✅ <strong>Your registration was successful!</strong><br>
-                You're now officially in our system, and soon, you’ll be matched with an ESNer who will help make your exchange experience even more amazing.</p>
-
-                <h3>Next Steps:</h3>
-                <ul>
-                    <li>📌 <strong>Stay tuned!</strong> We’ll contact you soon with more details.</li>
-                    <li>📌 If you have any questions, feel free to reach out to us.</li>
-                    <li>📌 Need to update your info? Just let us know!</li>
-                </ul>
-
-                <p>🔒 <strong>Your data is safe with us</strong> – ESN only uses your details internally and never shares them with third parties. You can request to remove your data at any time.</p>
-
-                <p>We’re looking forward to an exciting journey together! 🌍✨</p>
-
-                <p>Best regards</p> <br>
-            </body>
-        </html>
-        """
-
-        self.send_email(buddy.email, subject, body)
+        body = email_templates.render('registration_confirmation', buddy=buddy)
+        self.send_email(buddy.email, subject, body, 'transactional')
 
 email_service = EmailService()
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Email Templates for ESN Matchmaking System
+
+The bodies of the notification emails are Jinja templates in `templates/email`, extending the
+shared `email/layout.html` (HTML skeleton and signature).
+
+They are rendered by an environment of their own rather than by the Flask one: it works
+without an application or request context (the outbox worker, the CLI, the benchmark), always
+autoescapes the values (names and emails are typed by the users), and never checks the files
+for changes, so each template is read and compiled once per process and then served from the
+environment cache.
+
+Functions:
+- get_template(name): Returns the compiled template of an email.
+- render(name, **context): Renders the body of one email.
+- render_many(name, contexts, **shared): Renders the bodies of many emails from one template (mail merge).
+"""
+
+import os
+
+from jinja2 import Environment, FileSystemLoader
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+_environment = None
+
+
+def _get_environment():
+    """Environment of the email templates, created on first use."""
+    global _environment
+    if _environment is None:
+        _environment = Environment(
+            loader=FileSystemLoader(TEMPLATE_FOLDER),
+            autoescape=True,
+            auto_reload=False,
+            trim_blocks=True,
+            lstrip_blocks=True,
+        )
+    return _environment
+
+
+def get_template(name):
+    """
+    Return the compiled template of an email.
+
+    :param name: Name of the template in `templates/email`, without extension (e.g. 'match_buddy')
+    :return: The jinja2 Template
+    """
+    return _get_environment().get_template(f"email/{name}.html")
+
+
+def render(name, /, **context):
+    """
+    Render the body of one email.
+
+    :param name: Name of the template (e.g. 'match_buddy')
+    :param context: Variables of the template
+    :return: The HTML body
+    """
+    return get_template(name).render(context)
+
+
+def render_many(name, contexts, /, **shared):
+    """
+    Render the bodies of many emails from one template (mail merge).
+
+    The template is looked up once, and the variables common to every email (e.g. the
+    sender) are passed once in `shared` instead of being repeated in each context.
+
+    :param name: Name of the template (e.g. 'match_esner')
+    :param contexts: Iterable of dictionaries, the variables of each email
+    :param shared: Variables common to every email, overridden by the contexts
+    :return: List of HTML bodies, in the order of the contexts
+    """
+    template = get_template(name)
+    return [template.render(shared, **context) for context in contexts]
@@ -14,18 +14,64 @@ Modules and Libraries:
 
 Functions:
 - compute_match_score(buddy, esner, weights=None): Computes a normalized matching score between a Buddy and an Esner.
+- compute_match_matrix(buddies, esners, weights=None): Computes the whole Buddy x Esner score matrix with array operations.
+- compute_match_matrix_parallel(buddies, esners, ...): Computes the same matrix with blocks of Buddies scored in a process pool.
+- compute_candidate_matrix(buddies, esners, ...): Scores only the pairs found through an inverted index of attribute values.
 - match_making(buddies, esner): Performs matchmaking between lists of Buddy and Esner instances.
+- top_k_indices(values, k): Selects the k best entries of a score row without a full sort.
+- solve_assignment(score_matrix, capacities): Computes a capacity-respecting assignment maximizing the total score.
+- assignment_match_making(buddies, esners): Proposes one Esner per Buddy using the global assignment.
+- greedy_proposals / assignment_proposals: Same selections, returning raw and adjusted scores.
+- assigned_buddy_count(esner): Number of Buddies of an Esner instance or snapshot record.
 
 Usage:
 - Use `compute_match_score` to calculate individual match scores between a Buddy and an Esner.
+- Use `compute_match_matrix` to score whole cohorts at once; it returns the same numbers as `compute_match_score`.
 - Use `match_making` to generate a list of top matches for each Buddy based on computed scores.
+- Use `assignment_match_making` to get a single proposal per Buddy that respects every Esner's free slots.
 """
 
 from flask import current_app
 from database.tables import Buddy, Esner
+from utils.profile_encoding import get_stored_bits, get_vocabulary_index, word_count
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import math
 
 
+# Profile attributes used by the scorer, mapped to the getter decoding the JSON column
+# and to the matching vocabulary key in options.json.
+ATTRIBUTE_GETTERS = {
+    'languages': 'get_languages_spoken',
+    'nationalities': 'get_nationality',
+    'faculties': 'get_faculty',
+    'interests': 'get_interests',
+}
+
+NOT_INTERESTED = "Not interested"
+
+# Number of Buddy rows scored together by compute_match_matrix; bounds the size of the
+# temporary (rows x esners) arrays.
+SCORE_BLOCK_SIZE = 2048
+
+# Matrix value of the pairs skipped by compute_candidate_matrix (real scores are in [0, 1])
+UNSCORED = -1.0
+
+
+def assigned_buddy_count(esner):
+    """
+    Number of Buddies assigned to an Esner.
+
+    Reads the `buddy_count` counter; the `buddies` relationship is only loaded for Esners
+    that haven't been flushed yet.
+
+    :param esner: An Esner instance or EsnerRecord
+    :return: Number of assigned Buddies
+    """
+    count = getattr(esner, 'buddy_count', None)
+    return len(esner.buddies) if count is None else count
+
+
 def compute_match_score(buddy: Buddy, esner: Esner, weights=None):
     """
     Compute an enhanced normalized matching score between a Buddy and an Esner.
@@ -128,7 +174,7 @@ def compute_match_score(buddy: Buddy, esner: Esner, weights=None):
     
     # 6. Availability Score (0 to 1) - NEW COMPONENT
     # This ensures Esners with fewer buddies get priority
-    current_buddy_ratio = len(esner.buddies) / esner.max_number_of_buddy if esner.max_number_of_buddy > 0 else 1.0
+    current_buddy_ratio = assigned_buddy_count(esner) / esner.max_number_of_buddy if esner.max_number_of_buddy > 0 else 1.0
     
     # Use exponential decay for smoother distribution
     # Score is high when ratio is low (few buddies) and decreases as ratio approaches 1
@@ -157,67 +203,792 @@ def compute_match_score(buddy: Buddy, esner: Esner, weights=None):
     return normalized_score
 
 
-def match_making(buddies, esners):
+def get_attribute_sets(profile):
     """
-    Enhanced matchmaking with better distribution and guaranteed positive scores.
+    Decode the JSON attribute columns of a Buddy or Esner once.
+
+    Decoding errors and null columns give an empty set, exactly as in `compute_match_score`.
+
+    :param profile: A Buddy or Esner instance
+    :return: Dictionary mapping each attribute of ATTRIBUTE_GETTERS to a set of values
     """
-    # Create match matrix
-    match_matrix = [[0 for _ in range(len(esners))] for _ in range(len(buddies))]
-    
-    # Fill the match matrix
-    for i, buddy in enumerate(buddies):
-        for j, esner in enumerate(esners):
-            match_matrix[i][j] = compute_match_score(buddy, esner)
-    
-    matches = []
-    data = []
-    
-    # Track how many times each Esner has been selected in this matching round
-    esner_selection_count = {esner.id: 0 for esner in esners}
-    
+    sets = {}
+    for attribute, getter in ATTRIBUTE_GETTERS.items():
+        try:
+            items = getattr(profile, getter)()
+            sets[attribute] = set(items) if items is not None else set()
+        except Exception:
+            sets[attribute] = set()
+    return sets
+
+
+def get_profile_attributes(profile):
+    """
+    Get the attributes of a Buddy or Esner in the cheapest available form.
+
+    :param profile: A Buddy or Esner instance
+    :return: Dictionary mapping each attribute to its stored bitmask (bytes) when the profile
+             carries an up to date encoding, otherwise to the decoded set of values
+    """
+    stored = get_stored_bits(profile)
+    return stored if stored is not None else get_attribute_sets(profile)
+
+
+def build_vocabulary(*cohorts):
+    """
+    Build the attribute -> {value: column} index used to encode cohorts.
+
+    The columns follow the order of options.json, which is also the bit order of the stored
+    profile encodings; values found in decoded profiles but missing from options.json are
+    appended so that every value gets a column.
+
+    :param cohorts: Lists of attribute dictionaries (see `get_profile_attributes`)
+    :return: Dictionary mapping each attribute to a {value: column index} dictionary
+    """
+    vocabulary = {}
+    for attribute in ATTRIBUTE_GETTERS:
+        index = dict(get_vocabulary_index()[attribute])
+        for cohort in cohorts:
+            for attributes in cohort:
+                if isinstance(attributes[attribute], bytes):
+                    continue
+                for value in attributes[attribute]:
+                    index.setdefault(value, len(index))
+        vocabulary[attribute] = index
+    return vocabulary
+
+
+class EncodedCohort:
+    """
+    Bitset encoding of a list of Buddies or Esners against a shared vocabulary.
+
+    Attributes:
+        vocabulary (dict): attribute -> {value: bit} index shared with the other cohort.
+        words (dict): attribute -> (n x words) uint64 matrix, bit k set when value k is selected.
+        sizes (dict): attribute -> (n,) float64 vector with the number of values per profile.
+        not_interested (dict): attribute -> (n,) bool vector, True when "Not interested" is selected.
+        gender (np.ndarray): (n,) integer gender codes, equal codes mean equal genders.
+    """
+
+    def __init__(self, profile_attributes, genders, vocabulary, gender_codes):
+        n = len(profile_attributes)
+        self.vocabulary = vocabulary
+        self.words = {}
+        self.sizes = {}
+        self.not_interested = {}
+        for attribute, index in vocabulary.items():
+            n_words = word_count(len(index))
+            width = n_words * 8
+            packed = []
+            for attributes in profile_attributes:
+                value = attributes[attribute]
+                if isinstance(value, bytes):
+                    packed.append(value.ljust(width, b'\0'))
+                else:
+                    mask = 0
+                    for item in value:
+                        mask |= 1 << index[item]
+                    packed.append(mask.to_bytes(width, 'little'))
+            words = np.frombuffer(b''.join(packed), dtype='<u8').reshape(n, n_words)
+            self.words[attribute] = words
+            self.sizes[attribute] = np.bitwise_count(words).sum(axis=1, dtype=np.float64)
+            bit = index.get(NOT_INTERESTED)
+            if bit is None:
+                self.not_interested[attribute] = np.zeros(n, dtype=bool)
+            else:
+                self.not_interested[attribute] = (words[:, bit >> 6] >> np.uint64(bit & 63)) & np.uint64(1) == 1
+        self.gender = np.array(
+            [gender_codes.setdefault(gender, len(gender_codes)) for gender in genders], dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.gender)
+
+
+def availability_scores(esners):
+    """
+    Compute the availability component of `compute_match_score` for each Esner.
+
+    :param esners: List of Esner instances
+    :return: (n,) float64 vector
+    """
+    scores = np.empty(len(esners), dtype=np.float64)
+    for j, esner in enumerate(esners):
+        ratio = assigned_buddy_count(esner) / esner.max_number_of_buddy if esner.max_number_of_buddy > 0 else 1.0
+        scores[j] = math.exp(-2 * ratio)
+    return scores
+
+
+def _intersection_counts(buddy_words, esner_words):
+    """Popcount of the AND of broadcast (buddy, esner) bitsets, as a float64 array."""
+    counts = np.zeros(np.broadcast_shapes(buddy_words.shape, esner_words.shape)[:-1], dtype=np.uint16)
+    for word in range(buddy_words.shape[-1]):
+        counts += np.bitwise_count(buddy_words[..., word] & esner_words[..., word])
+    return counts.astype(np.float64)
+
+
+def static_scores(buddies, buddy_index, esners, esner_index, weights):
+    """
+    Weighted sum of the attribute components of the score, without availability.
+
+    Buddies and Esners are selected by two broadcastable index arrays: with buddy_index of
+    shape (n, 1) and esner_index of shape (1, m) this scores a whole block; with two (p,)
+    arrays it scores p individual pairs. Every component follows `compute_match_score`
+    operation by operation, so `finalize_scores` gives results identical to the per-pair
+    computation. The static part only changes when a Buddy or Esner profile changes, which
+    is what the persisted score store relies on.
+
+    :param buddies: EncodedCohort of the Buddies
+    :param buddy_index: Index array into buddies
+    :param esners: EncodedCohort of the Esners
+    :param esner_index: Index array into esners, broadcastable with buddy_index
+    :param weights: Dictionary of attribute weights
+    :return: float64 array with the broadcast shape of the two index arrays
+    """
+    def overlap(attribute):
+        intersection = _intersection_counts(
+            buddies.words[attribute][buddy_index], esners.words[attribute][esner_index]
+        )
+        buddy_sizes = buddies.sizes[attribute][buddy_index]
+        esner_sizes = esners.sizes[attribute][esner_index]
+        either_empty = (buddy_sizes == 0) | (esner_sizes == 0)
+        return intersection, buddy_sizes, esner_sizes, either_empty
+
+    gender_score = (buddies.gender[buddy_index] == esners.gender[esner_index]).astype(np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersection, buddy_sizes, esner_sizes, either_empty = overlap('languages')
+        union = buddy_sizes + esner_sizes - intersection
+        both_empty = (buddy_sizes == 0) & (esner_sizes == 0)
+        language_score = np.where(
+            either_empty, np.where(both_empty, 0.3, 0.0), np.where(union > 0, intersection / union, 0.0)
+        )
+
+        categorical = {}
+        for attribute in ('nationalities', 'faculties'):
+            intersection, _, _, either_empty = overlap(attribute)
+            categorical[attribute] = np.where(
+                esners.not_interested[attribute][esner_index],
+                0.5,
+                np.where(either_empty, 0.3, (intersection > 0).astype(np.float64))
+            )
+
+        intersection, buddy_sizes, esner_sizes, either_empty = overlap('interests')
+        min_size = np.minimum(buddy_sizes, esner_sizes)
+        union = buddy_sizes + esner_sizes - intersection
+        overlap_coefficient = np.where(min_size > 0, intersection / min_size, 0.0)
+        jaccard = np.where(union > 0, intersection / union, 0.0)
+        interest_score = np.where(either_empty, 0.0, 0.7 * overlap_coefficient + 0.3 * jaccard)
+
+    return (
+        weights.get('gender', 0) * gender_score +
+        weights.get('languages', 0) * language_score +
+        weights.get('nationalities', 0) * categorical['nationalities'] +
+        weights.get('faculties', 0) * categorical['faculties'] +
+        weights.get('interests', 0) * interest_score
+    )
+
+
+def finalize_scores(static, availability, weights):
+    """
+    Add the availability component to static scores and normalize them to [0, 1].
+
+    :param static: Array returned by `static_scores`
+    :param availability: Availability scores broadcastable with static
+    :param weights: Dictionary of attribute weights
+    :return: float64 array of final scores
+    """
+    total_score = static + weights.get('availability', 0) * availability
+    total_weight = sum(weights.values())
+    if total_weight <= 0:
+        return np.zeros_like(total_score)
+    return np.clip(total_score / total_weight, 0.0, 1.0)
+
+
+def _score_pairs(buddies, buddy_index, esners, esner_index, availability, weights):
+    """Final scores of the pairs selected by two broadcastable index arrays."""
+    static = static_scores(buddies, buddy_index, esners, esner_index, weights)
+    return finalize_scores(static, availability[esner_index], weights)
+
+
+def encode_cohorts(buddies, esners):
+    """
+    Encode a Buddy and an Esner cohort against a shared vocabulary.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :return: Tuple (encoded_buddies, encoded_esners, availability)
+    """
+    buddy_attributes = [get_profile_attributes(buddy) for buddy in buddies]
+    esner_attributes = [get_profile_attributes(esner) for esner in esners]
+    vocabulary = build_vocabulary(buddy_attributes, esner_attributes)
+    gender_codes = {}
+    encoded_buddies = EncodedCohort(buddy_attributes, [buddy.gender for buddy in buddies], vocabulary, gender_codes)
+    encoded_esners = EncodedCohort(esner_attributes, [esner.gender for esner in esners], vocabulary, gender_codes)
+    return encoded_buddies, encoded_esners, availability_scores(esners)
+
+
+def compute_match_matrix(buddies, esners, weights=None):
+    """
+    Compute the matching score of every (Buddy, Esner) pair with array operations.
+
+    Both cohorts are encoded once as bitsets over the options.json vocabulary, reusing the
+    stored profile encodings when they are up to date and decoding the JSON columns otherwise.
+    The gender, language, nationality, faculty, interest and availability scores are then
+    computed for whole blocks of Buddies at a time, with popcounts for set intersections. Entry [i][j] equals
+    `compute_match_score(buddies[i], esners[j], weights)`.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param weights: Optional dictionary specifying weights for attributes
+    :return: A (len(buddies) x len(esners)) float64 numpy array
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+
+    encoded_buddies, encoded_esners, availability = encode_cohorts(buddies, esners)
+    esner_index = np.arange(len(esners))[None, :]
+    matrix = np.empty((len(buddies), len(esners)), dtype=np.float64)
+    for start in range(0, len(buddies), SCORE_BLOCK_SIZE):
+        rows = np.arange(start, min(start + SCORE_BLOCK_SIZE, len(buddies)))
+        matrix[rows] = _score_pairs(encoded_buddies, rows[:, None], encoded_esners, esner_index, availability, weights)
+    return matrix
+
+
+# Cohort snapshot of a scoring worker process, set once by `_init_score_worker`
+_worker_state = {}
+
+
+def _init_score_worker(encoded_buddies, encoded_esners, availability, weights):
+    """Receive the encoded cohorts once per worker process instead of once per block."""
+    _worker_state['buddies'] = encoded_buddies
+    _worker_state['esners'] = encoded_esners
+    _worker_state['availability'] = availability
+    _worker_state['weights'] = weights
+
+
+def _score_block(start, stop):
+    """Score the Buddy rows [start, stop) of the worker's cohort snapshot against every Esner."""
+    esner_index = np.arange(len(_worker_state['esners']))[None, :]
+    block = np.empty((stop - start, esner_index.shape[1]), dtype=np.float64)
+    for offset in range(start, stop, SCORE_BLOCK_SIZE):
+        rows = np.arange(offset, min(offset + SCORE_BLOCK_SIZE, stop))
+        block[rows - start] = _score_pairs(
+            _worker_state['buddies'], rows[:, None], _worker_state['esners'], esner_index,
+            _worker_state['availability'], _worker_state['weights']
+        )
+    return start, block
+
+
+def compute_match_matrix_parallel(buddies, esners, weights=None, workers=None, block_size=None):
+    """
+    Compute the same matrix as `compute_match_matrix`, scoring blocks of Buddies in a process pool.
+
+    The ORM objects never leave the calling process: both cohorts are encoded first, and the
+    encoded arrays (plain NumPy data) are sent once to every worker. Each worker scores whole
+    blocks of Buddy rows and the blocks are merged back in order, so the result is identical to
+    the serial one. Small cohorts, `workers` <= 1 and platforms without process support fall
+    back to serial scoring.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param weights: Optional dictionary specifying weights for attributes
+    :param workers: Number of worker processes (default: MATCH_PARALLEL_WORKERS)
+    :param block_size: Number of Buddies per task (default: MATCH_PARALLEL_BLOCK_SIZE)
+    :return: A (len(buddies) x len(esners)) float64 numpy array
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+    if workers is None:
+        workers = current_app.config.get("MATCH_PARALLEL_WORKERS", 0)
+    if block_size is None:
+        block_size = current_app.config.get("MATCH_PARALLEL_BLOCK_SIZE", 1024)
+    block_size = max(1, block_size)
+
+    if workers <= 1 or len(buddies) <= block_size:
+        return compute_match_matrix(buddies, esners, weights)
+
+    encoded_buddies, encoded_esners, availability = encode_cohorts(buddies, esners)
+    matrix = np.empty((len(buddies), len(esners)), dtype=np.float64)
+    blocks = [(start, min(start + block_size, len(buddies))) for start in range(0, len(buddies), block_size)]
+    try:
+        pool = ProcessPoolExecutor(
+            max_workers=min(workers, len(blocks)),
+            initializer=_init_score_worker,
+            initargs=(encoded_buddies, encoded_esners, availability, weights),
+        )
+    except (OSError, NotImplementedError) as e:
+        print(f"Parallel scoring unavailable, scoring serially: {e}")
+        return compute_match_matrix(buddies, esners, weights)
+
+    with pool:
+        futures = [pool.submit(_score_block, start, stop) for start, stop in blocks]
+        for future in futures:
+            start, block = future.result()
+            matrix[start:start + len(block)] = block
+    return matrix
+
+
+def no_overlap_bound(weights=None):
+    """
+    Highest score an Esner can reach with a Buddy it shares no attribute value with.
+
+    Without a common language, nationality, faculty or interest only gender, availability and the
+    neutral defaults of the language (0.3), nationality and faculty (0.5) scores remain.
+
+    :param weights: Optional dictionary specifying weights for attributes
+    :return: The bound as a float in [0, 1]
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+    total_weight = sum(weights.values())
+    if total_weight <= 0:
+        return 0.0
+    bound = (
+        weights.get('gender', 0) +
+        weights.get('languages', 0) * 0.3 +
+        weights.get('nationalities', 0) * 0.5 +
+        weights.get('faculties', 0) * 0.5 +
+        weights.get('availability', 0)
+    )
+    return min(1.0, bound / total_weight)
+
+
+class CandidateIndex:
+    """
+    Inverted index from language, nationality, faculty and interest values to the Esners having them.
+
+    Posting lists are kept as boolean Esner masks, one row per vocabulary value, so the
+    candidates of a Buddy are the OR of the rows of the values it selected. Esners that can
+    score on nationality or faculty without sharing a value ("Not interested" gives 0.5, an
+    empty list 0.3) are candidates of every Buddy, so the pruned Esners stay under
+    `pruned_score_bounds`.
+
+    Attributes:
+        postings (dict): attribute -> (vocabulary x esners) bool matrix.
+        universal (np.ndarray): (esners,) bool mask of the Esners that are always candidates.
+    """
+
+    def __init__(self, encoded_esners):
+        self.size = len(encoded_esners)
+        self.postings = {}
+        for attribute, words in encoded_esners.words.items():
+            bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little').astype(bool)
+            self.postings[attribute] = np.ascontiguousarray(bits.T)
+        self.universal = np.zeros(self.size, dtype=bool)
+        for attribute in ('nationalities', 'faculties'):
+            self.universal |= encoded_esners.not_interested[attribute] | (encoded_esners.sizes[attribute] == 0)
+
+    def candidates(self, encoded_buddies, row):
+        """
+        Return the indices of the Esners sharing at least one value with a Buddy, and the universal ones.
+
+        :param encoded_buddies: EncodedCohort of the Buddies
+        :param row: Index of the Buddy in encoded_buddies
+        :return: Sorted array of Esner indices
+        """
+        mask = self.universal.copy()
+        for attribute, postings in self.postings.items():
+            words = encoded_buddies.words[attribute][row]
+            values = np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little'))
+            values = values[values < len(postings)]
+            if len(values):
+                mask |= postings[values].any(axis=0)
+        return np.flatnonzero(mask)
+
+
+def pruned_score_bounds(encoded_buddies, availability, weights):
+    """
+    Highest score each Buddy can reach with an Esner the CandidateIndex doesn't return.
+
+    Such an Esner shares no value with the Buddy and has a nationality and a faculty without
+    "Not interested", so only gender, availability and the 0.3 of the languages, nationalities
+    and faculties the Buddy left empty remain. Tighter than `no_overlap_bound`, which holds for
+    every pair sharing no value.
+
+    :param encoded_buddies: EncodedCohort of the Buddies
+    :param availability: Availability scores of the Esners
+    :param weights: Dictionary of attribute weights
+    :return: (buddies,) float64 vector
+    """
+    static = np.full(len(encoded_buddies), float(weights.get('gender', 0)))
+    for attribute in ('languages', 'nationalities', 'faculties'):
+        static += weights.get(attribute, 0) * 0.3 * (encoded_buddies.sizes[attribute] == 0)
+    return finalize_scores(static, availability.max() if len(availability) else 0.0, weights)
+
+
+def compute_candidate_matrix(buddies, esners, weights=None, top_k=None, fallback_size=None):
+    """
+    Compute matching scores only for the (Buddy, Esner) pairs sharing at least one value.
+
+    An inverted index over the Esners' languages, nationalities, faculties and interests is
+    built once, and each Buddy is scored only against the Esners found through it. Buddies
+    with fewer than `top_k` candidates are also scored against a fallback sample: the
+    `fallback_size` Esners with the most free capacity.
+
+    Exactness: a pruned Esner scores at most `pruned_score_bounds` for the Buddy. When the K-th
+    best scored candidate of a Buddy is above that bound, no pruned Esner can enter its top-K;
+    otherwise the Buddy is scored against every Esner. The top-K of every Buddy is therefore
+    identical to exhaustive scoring. Such Buddies are counted in `stats['exhaustive_buddies']`.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param weights: Optional dictionary specifying weights for attributes
+    :param top_k: Number of matches wanted per Buddy (default: TOP_AUTOMATIC_MATCH)
+    :param fallback_size: Size of the fallback sample (default: MATCH_CANDIDATE_FALLBACK_SIZE)
+    :return: Tuple (matrix, stats). Pruned pairs hold UNSCORED (-1) in the matrix; stats has
+             the keys 'pairs', 'scored', 'pruned', 'fallback_buddies' and 'exhaustive_buddies'.
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+    if top_k is None:
+        top_k = current_app.config.get("TOP_AUTOMATIC_MATCH", 3)
+    if fallback_size is None:
+        fallback_size = current_app.config.get("MATCH_CANDIDATE_FALLBACK_SIZE", 10)
+
+    encoded_buddies, encoded_esners, availability = encode_cohorts(buddies, esners)
+    index = CandidateIndex(encoded_esners)
+    fallback = np.argsort(-availability, kind='stable')[:max(fallback_size, top_k)]
+
+    pair_buddies, pair_esners = [], []
+    fallback_buddies = 0
+    for i in range(len(buddies)):
+        candidates = index.candidates(encoded_buddies, i)
+        if len(candidates) < top_k:
+            candidates = np.union1d(candidates, fallback)
+            fallback_buddies += 1
+        pair_buddies.append(np.full(len(candidates), i))
+        pair_esners.append(candidates)
+
+    matrix = np.full((len(buddies), len(esners)), UNSCORED, dtype=np.float64)
+    if pair_buddies:
+        pair_buddies = np.concatenate(pair_buddies)
+        pair_esners = np.concatenate(pair_esners)
+        chunk = SCORE_BLOCK_SIZE * max(1, len(esners))
+        for start in range(0, len(pair_buddies), chunk):
+            bi = pair_buddies[start:start + chunk]
+            ej = pair_esners[start:start + chunk]
+            matrix[bi, ej] = _score_pairs(encoded_buddies, bi, encoded_esners, ej, availability, weights)
+        scored = len(pair_buddies)
+    else:
+        scored = 0
+
+    bounds = pruned_score_bounds(encoded_buddies, availability, weights)
+    if 0 < top_k <= len(esners):
+        kth = np.partition(matrix, len(esners) - top_k, axis=1)[:, len(esners) - top_k]
+    else:
+        kth = np.full(len(buddies), -np.inf)
+    exhaustive = np.flatnonzero((kth <= bounds) & (matrix == UNSCORED).any(axis=1))
+    esner_index = np.arange(len(esners))[None, :]
+    for start in range(0, len(exhaustive), SCORE_BLOCK_SIZE):
+        rows = exhaustive[start:start + SCORE_BLOCK_SIZE]
+        scored += int(np.count_nonzero(matrix[rows] == UNSCORED))
+        matrix[rows] = _score_pairs(encoded_buddies, rows[:, None], encoded_esners, esner_index, availability, weights)
+
+    stats = {
+        'pairs': len(buddies) * len(esners),
+        'scored': scored,
+        'pruned': len(buddies) * len(esners) - scored,
+        'fallback_buddies': fallback_buddies,
+        'exhaustive_buddies': len(exhaustive),
+    }
+    return matrix, stats
+
+
+def top_k_indices(values, k):
+    """
+    Return the indices of the `k` largest values, best first, without sorting the whole array.
+
+    The order is the one of a stable descending sort: equal values keep their index order,
+    including at the K-th position, so the result matches `sorted(...)[:k]` exactly.
+
+    :param values: 1-D array of scores
+    :param k: Number of indices wanted
+    :return: Array of at most `k` indices
+    """
+    n = len(values)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        threshold = np.partition(values, n - k)[n - k]
+        above = np.flatnonzero(values > threshold)
+        ties = np.flatnonzero(values == threshold)[:k - len(above)]
+        chosen = np.concatenate((above, ties))
+    else:
+        chosen = np.arange(n)
+    return chosen[np.argsort(-values[chosen], kind='stable')]
+
+
+class _PrunedRows:
+    """
+    Completes the rows of a pruned score matrix that the greedy selection can't decide on.
+
+    The cohorts are encoded on first use only, so matrices without pruned rows pay nothing.
+    """
+
+    def __init__(self, buddies, esners, weights):
+        self.buddies = buddies
+        self.esners = esners
+        self.weights = weights
+        self.encoded = None
+
+    def _encode(self):
+        if self.encoded is None:
+            encoded_buddies, encoded_esners, availability = encode_cohorts(self.buddies, self.esners)
+            bounds = pruned_score_bounds(encoded_buddies, availability, self.weights)
+            self.encoded = (encoded_buddies, encoded_esners, availability, bounds)
+        return self.encoded
+
+    def decided(self, row, adjusted_scores, unscored, top_k):
+        """Whether the top-K adjusted scores of the scored pairs all beat any pruned Esner."""
+        scored = adjusted_scores[~unscored]
+        if len(scored) < top_k:
+            return False
+        kth = np.partition(scored, len(scored) - top_k)[len(scored) - top_k]
+        return kth > self._encode()[3][row]
+
+    def score_row(self, row):
+        """Score a Buddy against every Esner."""
+        encoded_buddies, encoded_esners, availability, _ = self._encode()
+        return _score_pairs(
+            encoded_buddies, np.array([row]), encoded_esners, np.arange(len(self.esners)), availability, self.weights
+        )
+
+
+def greedy_proposals(buddies, esners, match_matrix=None, weights=None):
+    """
+    Select the Esners proposed to each Buddy by the greedy matchmaking.
+
+    Each Buddy gets the TOP_AUTOMATIC_MATCH Esners with the best adjusted score, where the
+    adjusted score is the match score minus 0.05 for every time the Esner was already proposed
+    in this round. The top-K of each row is found with a partial selection instead of sorting
+    all the Esners.
+
+    With a pruned matrix (`compute_candidate_matrix`), the penalties can push the scored
+    candidates of a Buddy under the score a pruned Esner may reach (`pruned_score_bounds`):
+    that Buddy is then scored against every Esner, so the proposals are identical to those of
+    the full matrix.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param match_matrix: Optional precomputed score matrix, possibly with UNSCORED (pruned) pairs
+    :param weights: Weights the matrix was computed with (default: the recommended ones)
+    :return: List of (buddy, esner, score, adjusted_score) tuples, scores in [0, 1]
+    """
+    # Score the whole cohort at once
+    if match_matrix is None:
+        match_matrix = compute_match_matrix(buddies, esners, weights)
+    if weights is None:
+        weights = get_recommended_weights()
+    top_k = current_app.config.get("TOP_AUTOMATIC_MATCH", 3)
+
+    proposals = []
+    pruned_rows = _PrunedRows(buddies, esners, weights)
+
+    # Selection counts are kept per Esner id: every column of the same Esner shares the
+    # counter stored at the first column with that id
+    esner_index = {}
+    for j, esner in enumerate(esners):
+        esner_index.setdefault(esner.id, j)
+    counter_slot = np.array([esner_index[esner.id] for esner in esners], dtype=np.intp)
+    esner_selection_count = np.zeros(len(esners), dtype=np.int64)
+
     for i, buddy in enumerate(buddies):
-        buddy_id = buddy.id
-        
-        # Build candidate list with enhanced scoring
-        fs_candidates = []
-        for j, esner in enumerate(esners):
-            score = match_matrix[i][j]
-            buddy_count = len(esner.buddies)
-            
-            # Apply a small penalty if this Esner was already selected multiple times in this round
-            # This helps distribute buddies more evenly
-            selection_penalty = esner_selection_count[esner.id] * 0.05
-            adjusted_score = max(0, score - selection_penalty)
-            
-            fs_candidates.append((esner.id, adjusted_score, buddy_count, j, score))  # Keep original score too
-        
-        # Sort by adjusted score (descending)
-        # No longer sorting by buddy_count as it's already factored into the score
-        fs_candidates.sort(key=lambda x: -x[1])
-        
-        # Select top matches
-        top_matches = fs_candidates[:current_app.config.get("TOP_AUTOMATIC_MATCH", 3)]
-        
-        # Record matches
-        for fs_id, adjusted_score, buddy_count, index, original_score in top_matches:
-            matches.append({
-                "buddy_id": buddy_id,
-                "foreign_student_id": fs_id,
-                "score": original_score,  # Use original score for recording
-                "adjusted_score": adjusted_score  # Optional: track adjusted score
-            })
-            
+        scores = np.asarray(match_matrix[i], dtype=np.float64)
+
+        # Apply a small penalty if this Esner was already selected multiple times in this round
+        # This helps distribute buddies more evenly
+        selection_penalty = esner_selection_count[counter_slot] * 0.05
+        adjusted_scores = np.maximum(0, scores - selection_penalty)
+
+        unscored = scores == UNSCORED
+        if unscored.any() and not pruned_rows.decided(i, adjusted_scores, unscored, min(top_k, len(scores))):
+            scores = pruned_rows.score_row(i)
+            adjusted_scores = np.maximum(0, scores - selection_penalty)
+            unscored = np.zeros(len(scores), dtype=bool)
+        adjusted_scores[unscored] = -np.inf
+        top_matches = top_k_indices(adjusted_scores, min(top_k, len(scores) - int(unscored.sum())))
+
+        for j in top_matches:
+            fs_id = esners[j].id
+
             # Update selection count
-            esner_selection_count[fs_id] += 1
-            
-            # Get Esner instance
-            corresponding_esner = next((esner for esner in esners if esner.id == fs_id), None)
-            
-            # Convert to percentage (guaranteed to be 0-100)
-            percentage_score = int(original_score * 100)
-            data.append((buddy, corresponding_esner, percentage_score))
-    
-    return data
+            esner_selection_count[esner_index[fs_id]] += 1
+
+            proposals.append((buddy, esners[esner_index[fs_id]], float(scores[j]), float(adjusted_scores[j])))
+
+    return proposals
+
+
+def match_making(buddies, esners, match_matrix=None):
+    """
+    Enhanced matchmaking with better distribution and guaranteed positive scores.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param match_matrix: Optional precomputed score matrix (e.g. from `compute_candidate_matrix`)
+    :return: List of (buddy, esner, percentage_score) tuples
+    """
+    # Convert to percentage (guaranteed to be 0-100)
+    return [
+        (buddy, esner, int(score * 100))
+        for buddy, esner, score, _ in greedy_proposals(buddies, esners, match_matrix)
+    ]
+
+
+def solve_assignment(score_matrix, capacities):
+    """
+    Assign each Buddy to at most one Esner, respecting capacities and maximizing the total score.
+
+    The problem is solved as a min-cost flow (source -> buddy -> esner -> sink) with successive
+    shortest paths, adding one Buddy per augmentation. Dijkstra runs over the Esner nodes only:
+    moving a Buddy from Esner j to Esner k costs cost[i, k] - cost[i, j], so the cheapest move
+    between each pair of Esners is kept in an exchange matrix that is updated incrementally when
+    a Buddy changes Esner. A zero-score "unassigned" column with unlimited capacity keeps the
+    problem feasible when there are fewer slots than Buddies; in that case the Buddies that give
+    the highest total score get the slots.
+
+    :param score_matrix: (buddies x esners) array of scores in [0, 1]
+    :param capacities: Sequence with the number of free slots of each Esner
+    :return: (buddies,) integer array with the assigned Esner index, -1 for unassigned Buddies
+    """
+    score_matrix = np.asarray(score_matrix, dtype=np.float64)
+    n_buddies, n_esners = score_matrix.shape
+    n_columns = n_esners + 1
+    unassigned_column = n_esners
+    assignment = np.full(n_buddies, -1, dtype=np.int64)
+    if n_buddies == 0:
+        return assignment
+
+    # Minimize cost = -score; the extra column is the "unassigned" option
+    cost = np.zeros((n_buddies, n_columns), dtype=np.float64)
+    cost[:, :n_esners] = -score_matrix
+    remaining = np.empty(n_columns, dtype=np.int64)
+    remaining[:n_esners] = np.maximum(np.asarray(capacities, dtype=np.int64), 0)
+    remaining[unassigned_column] = n_buddies
+
+    members = [[] for _ in range(n_columns)]
+    exchange = np.full((n_columns, n_columns), np.inf)
+    exchange_buddy = np.full((n_columns, n_columns), -1, dtype=np.int64)
+
+    def add_member(i, j):
+        members[j].append(i)
+        moves = cost[i] - cost[i, j]
+        better = moves < exchange[j]
+        exchange[j, better] = moves[better]
+        exchange_buddy[j, better] = i
+
+    def remove_member(i, j):
+        members[j].remove(i)
+        stale = exchange_buddy[j] == i
+        if not stale.any():
+            return
+        if not members[j]:
+            exchange[j, stale] = np.inf
+            exchange_buddy[j, stale] = -1
+            return
+        rows = np.array(members[j], dtype=np.int64)
+        moves = cost[np.ix_(rows, np.flatnonzero(stale))] - cost[rows, j][:, None]
+        best = moves.argmin(axis=0)
+        exchange[j, stale] = moves[best, np.arange(len(best))]
+        exchange_buddy[j, stale] = rows[best]
+
+    # Feasible initial potentials: every reduced cost is non-negative. Buddy potentials cancel
+    # out along esner -> buddy -> esner moves; only the shared offset of the Buddies not yet
+    # processed is needed for the source edges.
+    esner_potential = cost.min(axis=0)
+    sink_potential = esner_potential.min()
+    pending_potential = 0.0
+
+    for source in range(n_buddies):
+        esner_distance = cost[source] + pending_potential - esner_potential
+        esner_parent = np.full(n_columns, source, dtype=np.int64)
+        done = np.zeros(n_columns, dtype=bool)
+        sink_distance, sink_parent = np.inf, -1
+
+        while True:
+            candidates = np.where(done, np.inf, esner_distance)
+            j = int(np.argmin(candidates))
+            distance = candidates[j]
+            if distance >= sink_distance:
+                break
+            done[j] = True
+
+            if remaining[j] > 0:
+                through = distance + esner_potential[j] - sink_potential
+                if through < sink_distance:
+                    sink_distance, sink_parent = through, j
+                    if through <= distance:
+                        break
+
+            if members[j]:
+                relaxed = distance + esner_potential[j] - esner_potential + exchange[j]
+                improved = (relaxed < esner_distance) & ~done
+                esner_distance[improved] = relaxed[improved]
+                esner_parent[improved] = exchange_buddy[j, improved]
+
+        # Augment along the path sink <- esner <- buddy <- esner ... <- source
+        j = sink_parent
+        remaining[j] -= 1
+        while True:
+            i = int(esner_parent[j])
+            previous = int(assignment[i])
+            assignment[i] = j
+            add_member(i, j)
+            if i == source:
+                break
+            remove_member(i, previous)
+            j = previous
+
+        # Keep reduced costs non-negative for the next Dijkstra run
+        esner_potential += np.where(done, np.minimum(esner_distance, sink_distance), sink_distance)
+        sink_potential += sink_distance
+        pending_potential += sink_distance
+
+    assignment[assignment == unassigned_column] = -1
+    return assignment
+
+
+def assignment_proposals(buddies, esners, match_matrix=None):
+    """
+    Propose at most one Esner per Buddy with the capacity-aware global assignment.
+
+    Each Esner receives no more Buddies than its remaining slots (max_number_of_buddy minus the
+    Buddies already assigned) and the proposals maximize the total matching score.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param match_matrix: Optional precomputed score matrix; UNSCORED pairs are never proposed
+    :return: List of (buddy, esner, score, adjusted_score) tuples like `greedy_proposals`;
+             the assignment applies no penalty, so both scores are equal
+    """
+    if match_matrix is None:
+        match_matrix = compute_match_matrix(buddies, esners)
+    capacities = [esner.max_number_of_buddy - assigned_buddy_count(esner) for esner in esners]
+    assignment = solve_assignment(match_matrix, capacities)
+
+    proposals = []
+    for i, j in enumerate(assignment):
+        if j < 0 or match_matrix[i, j] == UNSCORED:
+            continue
+        score = float(match_matrix[i, j])
+        proposals.append((buddies[i], esners[j], score, score))
+    return proposals
+
+
+def assignment_match_making(buddies, esners, match_matrix=None):
+    """
+    Matchmaking alternative to `match_making` that proposes at most one Esner per Buddy.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param match_matrix: Optional precomputed score matrix; UNSCORED pairs are never proposed
+    :return: List of (buddy, esner, percentage_score) tuples, like `match_making`
+    """
+    return [
+        (buddy, esner, int(score * 100))
+        for buddy, esner, score, _ in assignment_proposals(buddies, esners, match_matrix)
+    ]
 
 
 # Optional: Configuration helper for weight tuning
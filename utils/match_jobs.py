@@ -0,0 +1,270 @@
+"""
+Background Automatic Matching Jobs for ESN Matchmaking System
+
+This module runs automatic matching as a background job, so a long run doesn't hold a web
+request (and, on serverless hosting, doesn't hit the function timeout). Jobs are stored in
+the MatchJob table, which doubles as the job queue, and their results are stored as a
+MatchProposal run.
+
+Runners (MATCH_JOB_RUNNER):
+- "poll": every status request advances the job for at most MATCH_JOB_POLL_SECONDS. Scored
+  rows are committed to the score store after each block of Buddies, so the next request
+  resumes where the previous one stopped. Works without any worker process.
+- "thread": the job runs to completion in a background thread of the web process.
+- "queue": jobs stay queued until `flask match run-jobs` processes them.
+
+A job is processed by one runner at a time: runners take a lease on the job row with a
+conditional UPDATE before working on it. The first step stores the ids of the cohort and its
+fingerprint on the job, so the following steps neither reload the whole cohort nor compute
+the fingerprint again.
+
+Functions:
+- create_job(mode): Stores a new queued job and starts it according to the runner.
+- advance_job(job_id, time_budget=None): Processes a job, for at most time_budget seconds.
+- run_queued_jobs(): Processes every queued job (used by the CLI worker).
+- job_status(job): Returns the progress of a job as a dictionary.
+"""
+
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import or_
+
+from database.db import db
+from database.tables import MatchJob
+from utils import match_proposals, score_store
+from utils.cohort_snapshot import load_buddy_records, load_esner_records
+
+# Extra lease time covering the commit of the last block after the time budget
+LEASE_GRACE_SECONDS = 30
+
+# Background thread of the "thread" runner, created on first use
+_executor = None
+
+
+def create_job(mode):
+    """
+    Store a new queued job and start it according to MATCH_JOB_RUNNER.
+
+    :param mode: Matching mode ("greedy" or "assignment")
+    :return: The MatchJob instance
+    """
+    job = MatchJob(id=uuid.uuid4().hex, mode=mode, status='queued')
+    db.session.add(job)
+    db.session.commit()
+
+    if current_app.config.get("MATCH_JOB_RUNNER", "poll") == "thread":
+        global _executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='match-job')
+        _executor.submit(_run_in_app_context, current_app._get_current_object(), job.id)
+    return job
+
+
+def _run_in_app_context(app, job_id):
+    """Entry point of the background thread."""
+    with app.app_context():
+        advance_job(job_id)
+
+
+def _lease_end(seconds):
+    """End of a lease of `seconds` taken now."""
+    return datetime.utcnow() + timedelta(seconds=seconds + LEASE_GRACE_SECONDS)
+
+
+def _claim(job_id, seconds):
+    """Take the lease of a queued or running job; return False if another runner holds it."""
+    now = datetime.utcnow()
+    claimed = MatchJob.query.filter(
+        MatchJob.id == job_id,
+        MatchJob.status.in_(('queued', 'running')),
+        or_(MatchJob.lease_until.is_(None), MatchJob.lease_until < now),
+    ).update({'lease_until': _lease_end(seconds)}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def advance_job(job_id, time_budget=None):
+    """
+    Process a job until it finishes or `time_budget` seconds have been spent.
+
+    Progress is committed after every block of MATCH_JOB_BLOCK_SIZE Buddies. Only the score
+    store path can stop early and resume later; without the store the whole matrix is kept
+    in memory and the job always runs to completion. Any error, claiming the job included,
+    marks the job as failed.
+
+    :param job_id: Identifier of the job
+    :param time_budget: Optional number of seconds after which the job is paused
+    """
+    lease = time_budget or current_app.config.get("MATCH_JOB_LEASE_SECONDS", 600)
+
+    # Progress commits must not expire the loaded cohort
+    session = db.session()
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    claimed = False
+    try:
+        claimed = _claim(job_id, lease)
+        if not claimed:
+            return
+        job = db.session.get(MatchJob, job_id)
+        deadline = time.monotonic() + time_budget if time_budget else None
+        _process(job, deadline, lease)
+    except Exception as e:
+        print(f"Match job {job_id} failed: {e}")
+        db.session.rollback()
+        _fail(job_id, str(e), claimed)
+    finally:
+        session.expire_on_commit = expire_on_commit
+
+
+def _fail(job_id, error, claimed):
+    """
+    Mark a job as failed after an error. A job that wasn't claimed is left to the runner
+    holding its lease, if any.
+    """
+    try:
+        query = MatchJob.query.filter(MatchJob.id == job_id, MatchJob.status.in_(('queued', 'running')))
+        if not claimed:
+            now = datetime.utcnow()
+            query = query.filter(or_(MatchJob.lease_until.is_(None), MatchJob.lease_until < now))
+        query.update({
+            'status': 'failed', 'error': error, 'lease_until': None, 'finished_at': datetime.utcnow(),
+        }, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        print(f"Could not mark match job {job_id} as failed: {e}")
+        db.session.rollback()
+
+
+def _start(job):
+    """
+    First step of a job: fix its cohort and fingerprint, or end it right away.
+
+    :return: Tuple (buddies, esners) of the loaded records, or None when the job ended
+    """
+    buddies, esners = match_proposals.load_cohort()
+    if not buddies or not esners:
+        _end(job, 'failed', error="Not enough data for auto-matching")
+        return None
+
+    job.cohort_fingerprint = match_proposals.cohort_fingerprint()
+    job.total_buddies = len(buddies)
+    run = match_proposals.find_run(job.cohort_fingerprint, job.mode)
+    if run is not None:
+        job.scored_buddies = len(buddies)
+        _end(job, 'finished', run_id=run[0])
+        return None
+
+    job.buddy_ids = [buddy.id for buddy in buddies]
+    job.esner_ids = [esner.id for esner in esners]
+    job.scored_buddies = 0
+    db.session.commit()
+    return buddies, esners
+
+
+def _process(job, deadline, lease):
+    """
+    Run the steps of a claimed job: load, score block by block, select and store the run.
+
+    The cohort ids and fingerprint are stored on the job by its first step; the later steps
+    only load the records of the Buddies they score, and the run is stored under the
+    fingerprint of the start (a cohort changed in the meantime gives a new run on the next
+    page view).
+    """
+    if job.started_at is None:
+        job.started_at = datetime.utcnow()
+    job.status = 'running'
+
+    buddies = None
+    if job.buddy_ids is None:
+        cohort = _start(job)
+        if cohort is None:
+            return
+        buddies, esners = cohort
+    else:
+        esners = load_esner_records(job.esner_ids)
+
+    block_size = max(1, current_app.config.get("MATCH_JOB_BLOCK_SIZE", 500))
+    if current_app.config.get("MATCH_SCORE_STORE", False):
+        while job.scored_buddies < len(job.buddy_ids):
+            block_ids = job.buddy_ids[job.scored_buddies:job.scored_buddies + block_size]
+            score_store.load_match_matrix(load_buddy_records(block_ids), esners, write_back=True)
+            job.scored_buddies += len(block_ids)
+            job.lease_until = _lease_end(lease)
+            db.session.commit()
+            if deadline is not None and time.monotonic() > deadline and job.scored_buddies < len(job.buddy_ids):
+                job.lease_until = None
+                db.session.commit()
+                return
+        if buddies is None:
+            buddies = load_buddy_records(job.buddy_ids)
+        # Every entry is stored now, this only reads them back
+        match_matrix, _ = match_proposals.score_cohort(buddies, esners)
+    else:
+        if buddies is None:
+            buddies = load_buddy_records(job.buddy_ids)
+        job.scored_buddies = 0
+        blocks = []
+        for start in range(0, len(buddies), block_size):
+            block = buddies[start:start + block_size]
+            blocks.append(match_proposals.score_cohort(block, esners)[0])
+            job.scored_buddies += len(block)
+            job.lease_until = _lease_end(lease)
+            db.session.commit()
+        match_matrix = np.vstack(blocks)
+
+    proposals = match_proposals.select_proposals(buddies, esners, job.mode, match_matrix)
+    run_id = match_proposals.save_run(proposals, job.cohort_fingerprint, job.mode)
+    _end(job, 'finished', run_id=run_id)
+
+
+def _end(job, status, run_id=None, error=None):
+    """Mark a job as finished or failed and release its lease."""
+    job.status = status
+    job.run_id = run_id
+    job.error = error
+    job.lease_until = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def run_queued_jobs():
+    """
+    Process every queued or paused job, oldest first.
+
+    :return: Number of jobs processed
+    """
+    job_ids = [
+        job_id for job_id, in
+        MatchJob.query.with_entities(MatchJob.id)
+        .filter(MatchJob.status.in_(('queued', 'running')))
+        .order_by(MatchJob.created_at)
+    ]
+    for job_id in job_ids:
+        advance_job(job_id)
+    return len(job_ids)
+
+
+def job_status(job):
+    """
+    Return the progress of a job.
+
+    :param job: The MatchJob instance
+    :return: Dictionary with the job id, mode, status, number of scored and total Buddies,
+             seconds elapsed since the request and the error message of a failed job
+    """
+    end = job.finished_at or datetime.utcnow()
+    return {
+        'job_id': job.id,
+        'mode': job.mode,
+        'status': job.status,
+        'scored_buddies': job.scored_buddies,
+        'total_buddies': job.total_buddies,
+        'elapsed': round((end - job.created_at).total_seconds(), 1),
+        'error': job.error,
+    }
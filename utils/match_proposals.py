@@ -0,0 +1,261 @@
+"""
+Persisted Match Proposals for ESN Matchmaking System
+
+This module stores the output of an automatic matching run in the MatchProposal table, so
+that refreshing the automatic match page (or opening it as another manager) reads the
+proposals instead of scoring and selecting again.
+
+Reuse rules:
+- Every run records the fingerprint of the data it was computed from: the matching settings
+  and the cohort version, a counter incremented by every write to the profiles and
+  assignments of the Buddies or the profiles and capacities of the Esners. A run is reused
+  while the fingerprint is unchanged.
+- Confirming a match is the one change handled without a new run: the confirmed proposal is
+  marked "confirmed", the other open proposals of the Buddy and of the Esner are
+  invalidated, and the run is re-stamped with the new fingerprint.
+- Any other change (registration, profile edit, unmatch, deletion) gives a new fingerprint,
+  and the next page view computes a new run, which replaces the previous runs.
+
+Functions:
+- load_cohort(): Returns the unmatched Buddies and the Esners with free slots as snapshot records.
+- proposal_profiles(proposals): Loads the Buddy and Esner instances of proposals for display.
+- score_cohort(buddies, esners): Computes the score matrix with the configured strategy.
+- select_proposals(buddies, esners, mode, match_matrix): Runs the greedy or assignment selection.
+- cohort_fingerprint(): Returns the fingerprint of the current data.
+- find_run(fingerprint, mode): Returns the id and date of the current run, or None.
+- load_run(fingerprint, mode): Returns the open proposals of the current run, or None.
+- load_run_proposals(run_id): Returns the open proposals of a run.
+- save_run(proposals, fingerprint, mode): Stores a run and removes the previous ones.
+- confirm_proposal(buddy, esner, fingerprint): Updates the proposals after a confirmed match.
+- clear(): Removes every stored proposal.
+
+The load, score and select phases are timed in the match_phase_duration_seconds metric, and
+the pairs of every scoring are counted in match_score_pairs_total.
+"""
+
+import hashlib
+import json
+import uuid
+
+from flask import current_app
+
+from database.db import db
+from database.tables import COHORT_VERSION_COUNTER, Buddy, Esner, MatchProposal
+from utils import counters, metrics, score_store
+from utils.cohort_snapshot import load_cohort_snapshot
+from utils.match import (
+    assignment_proposals, compute_candidate_matrix, compute_match_matrix, compute_match_matrix_parallel,
+    get_recommended_weights, greedy_proposals
+)
+
+# Settings changing the output of a run
+FINGERPRINT_SETTINGS = ("TOP_AUTOMATIC_MATCH", "MATCH_CANDIDATE_PRUNING", "MATCH_CANDIDATE_FALLBACK_SIZE")
+
+
+@metrics.timed(metrics.MATCH_PHASE_DURATION, 'load')
+def load_cohort():
+    """
+    Load the cohorts of an automatic matching run.
+
+    The cohorts are read-only snapshot records (see utils/cohort_snapshot.py) fetched in two
+    queries, with the buddy count of each Esner read from its counter.
+
+    :return: Tuple (buddies, esners): the Buddies without an Esner and the Esners with
+             fewer Buddies than their max_number_of_buddy
+    """
+    return load_cohort_snapshot()
+
+
+def proposal_profiles(proposals):
+    """
+    Load the Buddy and Esner instances of proposals computed on snapshot records.
+
+    Only the profiles appearing in the proposals are loaded, one query per model.
+
+    :param proposals: List of (buddy, esner, score, adjusted_score) tuples
+    :return: List of (buddy, esner, percentage_score) tuples like `match_making`
+    """
+    buddy_ids = {buddy.id for buddy, _, _, _ in proposals}
+    esner_ids = {esner.id for _, esner, _, _ in proposals}
+    buddies = {buddy.id: buddy for buddy in Buddy.query.filter(Buddy.id.in_(buddy_ids))} if buddy_ids else {}
+    esners = {esner.id: esner for esner in Esner.query.filter(Esner.id.in_(esner_ids))} if esner_ids else {}
+    return [
+        (buddies[buddy.id], esners[esner.id], int(score * 100))
+        for buddy, esner, score, _ in proposals
+    ]
+
+
+@metrics.timed(metrics.MATCH_PHASE_DURATION, 'score')
+def score_cohort(buddies, esners):
+    """
+    Compute the score matrix of a run with the configured strategy.
+
+    - MATCH_SCORE_STORE: reads the persisted score store, computing only the entries of new
+      or edited profiles (in memory: nothing is written back).
+    - Otherwise MATCH_CANDIDATE_PRUNING: scores only the pairs found through the inverted
+      attribute index.
+    - Otherwise MATCH_PARALLEL_WORKERS > 1: scores blocks of Buddies in a process pool.
+    - Otherwise: scores the whole cohort serially.
+
+    :param buddies: List of Buddy instances or records
+    :param esners: List of Esner instances or records
+    :return: Tuple (matrix, stats); stats is the pruning report, or None
+    """
+    if current_app.config.get("MATCH_SCORE_STORE", False):
+        matrix, store_stats = score_store.load_match_matrix(buddies, esners)
+        metrics.MATCH_SCORE_PAIRS.inc('stored', amount=store_stats['stored'])
+        metrics.MATCH_SCORE_PAIRS.inc('computed', amount=store_stats['computed'])
+        return matrix, None
+    if current_app.config.get("MATCH_CANDIDATE_PRUNING", False):
+        matrix, stats = compute_candidate_matrix(buddies, esners)
+        metrics.MATCH_SCORE_PAIRS.inc('computed', amount=stats['scored'])
+        metrics.MATCH_SCORE_PAIRS.inc('pruned', amount=stats['pruned'])
+        return matrix, stats
+    metrics.MATCH_SCORE_PAIRS.inc('computed', amount=len(buddies) * len(esners))
+    if current_app.config.get("MATCH_PARALLEL_WORKERS", 0) > 1:
+        return compute_match_matrix_parallel(buddies, esners), None
+    return compute_match_matrix(buddies, esners), None
+
+
+@metrics.timed(metrics.MATCH_PHASE_DURATION, 'select')
+def select_proposals(buddies, esners, mode, match_matrix):
+    """
+    Run the selection of the given mode on a score matrix.
+
+    :param mode: "assignment" for the capacity-aware assignment, anything else for the greedy matching
+    :return: List of (buddy, esner, score, adjusted_score) tuples
+    """
+    if mode == "assignment":
+        return assignment_proposals(buddies, esners, match_matrix)
+    return greedy_proposals(buddies, esners, match_matrix)
+
+
+def cohort_fingerprint():
+    """
+    Fingerprint of everything an automatic matching run depends on.
+
+    Instead of hashing the cohorts, it combines the matching settings with the cohort version
+    counter, which every write to a Buddy or Esner column of a run increments (see
+    `database.tables._track_cohort_changes`): one primary key lookup per call. Pending
+    changes of the session are flushed first, so they are counted.
+
+    :return: A 40 character hexadecimal string
+    """
+    settings = {name: current_app.config.get(name) for name in FINGERPRINT_SETTINGS}
+    version = counters.get_value(COHORT_VERSION_COUNTER)
+    key = json.dumps([settings, sorted(get_recommended_weights().items()), version])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def find_run(fingerprint, mode):
+    """
+    Return the latest run computed for this fingerprint and mode.
+
+    :param fingerprint: Current cohort fingerprint
+    :param mode: Matching mode ("greedy" or "assignment")
+    :return: Tuple (run_id, created_at), or None
+    """
+    run = (
+        MatchProposal.query
+        .with_entities(MatchProposal.run_id, MatchProposal.created_at)
+        .filter_by(cohort_fingerprint=fingerprint, mode=mode)
+        .order_by(MatchProposal.created_at.desc())
+        .first()
+    )
+    return None if run is None else (run.run_id, run.created_at)
+
+
+def load_run_proposals(run_id):
+    """
+    Return the open proposals of a run, in the order of the run's output.
+
+    :param run_id: Identifier of the run
+    :return: List of (buddy, esner, percentage_score) tuples like `match_making`
+    """
+    rows = (
+        db.session.query(MatchProposal, Buddy, Esner)
+        .join(Buddy, Buddy.id == MatchProposal.buddy_id)
+        .join(Esner, Esner.id == MatchProposal.esner_id)
+        .filter(MatchProposal.run_id == run_id, MatchProposal.status == 'open')
+        .order_by(MatchProposal.rank)
+        .all()
+    )
+    return [(buddy, esner, int(proposal.score * 100)) for proposal, buddy, esner in rows]
+
+
+def load_run(fingerprint, mode):
+    """
+    Return the open proposals of the latest run computed for this fingerprint and mode.
+
+    :param fingerprint: Current cohort fingerprint
+    :param mode: Matching mode ("greedy" or "assignment")
+    :return: Tuple (run_id, created_at, data) where data is a list of
+             (buddy, esner, percentage_score) tuples like `match_making`, or None
+    """
+    run = find_run(fingerprint, mode)
+    if run is None:
+        return None
+    run_id, created_at = run
+    return run_id, created_at, load_run_proposals(run_id)
+
+
+def save_run(proposals, fingerprint, mode):
+    """
+    Store the proposals of a new run and remove the previous runs of the same mode.
+
+    The caller commits the session.
+
+    :param proposals: List of (buddy, esner, score, adjusted_score) tuples, as returned by
+                      `greedy_proposals` or `assignment_proposals`
+    :param fingerprint: Cohort fingerprint the proposals were computed from
+    :param mode: Matching mode ("greedy" or "assignment")
+    :return: The new run id
+    """
+    MatchProposal.query.filter_by(mode=mode).delete()
+    run_id = uuid.uuid4().hex
+    db.session.bulk_insert_mappings(MatchProposal, [
+        {
+            'run_id': run_id,
+            'cohort_fingerprint': fingerprint,
+            'mode': mode,
+            'rank': rank,
+            'buddy_id': buddy.id,
+            'esner_id': esner.id,
+            'score': score,
+            'adjusted_score': adjusted_score,
+            'status': 'open',
+        }
+        for rank, (buddy, esner, score, adjusted_score) in enumerate(proposals)
+    ])
+    return run_id
+
+
+def confirm_proposal(buddy, esner, fingerprint):
+    """
+    Update the stored proposals after `buddy` has been matched with `esner`.
+
+    The matching proposal is marked "confirmed", and the other open proposals of the Buddy and
+    of the Esner are invalidated: the Esner has one free slot less, so the scores of its
+    remaining proposals (availability included) are outdated. Runs that were up to date before
+    the match (`fingerprint`) are re-stamped with the new fingerprint so the page keeps
+    reusing their other proposals. The caller commits the session.
+
+    :param buddy: The matched Buddy, with esn_member_id already set
+    :param esner: The Esner the Buddy was matched with
+    :param fingerprint: Cohort fingerprint computed before the match
+    """
+    open_proposals = MatchProposal.query.filter_by(buddy_id=buddy.id, status='open')
+    open_proposals.filter_by(esner_id=esner.id).update({'status': 'confirmed'}, synchronize_session=False)
+    open_proposals.update({'status': 'invalidated'}, synchronize_session=False)
+    MatchProposal.query.filter_by(esner_id=esner.id, status='open').update(
+        {'status': 'invalidated'}, synchronize_session=False
+    )
+
+    MatchProposal.query.filter_by(cohort_fingerprint=fingerprint).update(
+        {'cohort_fingerprint': cohort_fingerprint()}, synchronize_session=False
+    )
+
+
+def clear():
+    """Remove every stored proposal."""
+    MatchProposal.query.delete()
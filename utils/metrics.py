@@ -0,0 +1,296 @@
+"""
+In-Process Metrics for ESN Matchmaking System
+
+This module keeps counters and latency histograms in memory and renders them in the
+Prometheus text exposition format, served to admins at `/admin/metrics`.
+
+Metrics:
+- http_request_duration_seconds{endpoint, status}: latency of every request (histogram).
+- match_phase_duration_seconds{phase}: automatic matching phases, "load", "score",
+  "select" and "render" (histogram).
+- match_score_pairs_total{source}: Buddy-Esner pairs of the automatic matching runs, "stored"
+  (read from the score store), "computed" or "pruned" (by the candidate index) (counter).
+- email_send_duration_seconds{outcome}: SMTP sends, "sent" or "failed" (histogram).
+- email_send_failures_total{error}: failed SMTP sends by exception type (counter).
+- email_smtp_handshakes_total: SMTP connections opened (counter). Compared with the count of
+  email_send_duration_seconds, it shows how many emails each connection carried.
+- email_backpressure_total{reason}: emails refused or deferred by the rate limits, "rate" or
+  "queue" (counter).
+- email_outbox_depth{priority}, email_send_rate_per_minute: gauges of utils.email_dispatcher.
+
+Values are per process: with several worker processes, each one reports its own.
+
+Threaded servers update the metrics from many threads. Each metric spreads its values over
+a few stripes, each with its own lock, chosen from the thread id; an update only holds the
+lock of its stripe for a couple of additions, and the stripes are summed when the metrics
+are rendered.
+
+Classes:
+- Counter: Monotonic counter with labels.
+- Histogram: Cumulative bucket histogram with labels.
+- Gauge: Value read from a function when the metrics are rendered.
+
+Functions:
+- render(): Returns every registered metric in the Prometheus text format.
+- timed(histogram, *labels): Decorator observing the duration of a function.
+- init_app(app): Records the latency of every request of the application.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Request latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STRIPES = 8
+
+REGISTRY = []
+
+
+class _Metric:
+    """Base class of the metrics: a name, a help text, label names and striped values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._stripes = [(threading.Lock(), {}) for _ in range(STRIPES)]
+        REGISTRY.append(self)
+
+    def _stripe(self):
+        return self._stripes[hash((threading.get_ident(),)) % STRIPES]
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonic counter, e.g. `EMAIL_FAILURES.inc('SMTPAuthenticationError')`."""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """
+        Increment the counter of a label combination.
+
+        :param labels: Label values, in the order of the label names
+        :param amount: Increment
+        """
+        lock, values = self._stripe()
+        with lock:
+            values[labels] = values.get(labels, 0) + amount
+
+    def collect(self):
+        """Return {labels: value}, summed over the stripes."""
+        totals = {}
+        for lock, values in self._stripes:
+            with lock:
+                items = list(values.items())
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        lines = self._header()
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{self._labels(labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histogram with cumulative buckets, e.g. `REQUEST_LATENCY.observe(0.12, 'auth.login', '200')`."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        """
+        Record one observation.
+
+        :param value: Observed value (seconds for the durations)
+        :param labels: Label values, in the order of the label names
+        """
+        bucket = bisect_left(self.buckets, value)
+        lock, values = self._stripe()
+        with lock:
+            state = values.get(labels)
+            if state is None:
+                # Counts of each bucket (the last one is +Inf), then the sum
+                state = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bucket] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Context manager observing the duration of its block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def collect(self):
+        """Return {labels: [bucket counts..., +Inf count, sum]}, summed over the stripes."""
+        totals = {}
+        for lock, values in self._stripes:
+            with lock:
+                items = [(labels, list(state)) for labels, state in values.items()]
+            for labels, state in items:
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = state
+                else:
+                    totals[labels] = [a + b for a, b in zip(total, state)]
+        return totals
+
+    def render(self):
+        lines = self._header()
+        for labels, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f"{self.name}_bucket{self._labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge computed when the metrics are rendered, e.g. the depth of the email outbox."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """
+        :param callback: Function returning the value, or {label values tuple: value} with labels
+        """
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def collect(self):
+        """Return {labels: value} from the callback."""
+        value = self.callback()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self):
+        lines = self._header()
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Could not compute the {self.name} gauge: {e}")
+            return lines
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{self._labels(labels)} {_number(value)}")
+        return lines
+
+
+def _escape(value):
+    """Escape a label value for the text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    """Format a sample value without a useless ".0"."""
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', "Latency of the HTTP requests.", ('endpoint', 'status'),
+)
+MATCH_PHASE_DURATION = Histogram(
+    'match_phase_duration_seconds', "Duration of the automatic matching phases.", ('phase',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+MATCH_SCORE_PAIRS = Counter(
+    'match_score_pairs_total', "Buddy-Esner pairs of the automatic matching runs by source.", ('source',),
+)
+EMAIL_SEND_DURATION = Histogram(
+    'email_send_duration_seconds', "Duration of the SMTP sends.", ('outcome',),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+EMAIL_SEND_FAILURES = Counter(
+    'email_send_failures_total', "Failed SMTP sends by exception type.", ('error',),
+)
+EMAIL_SMTP_HANDSHAKES = Counter(
+    'email_smtp_handshakes_total', "SMTP connections opened (connect, STARTTLS and login).",
+)
+EMAIL_BACKPRESSURE = Counter(
+    'email_backpressure_total', "Emails refused or deferred by the sending rate limits.", ('reason',),
+)
+
+
+def render():
+    """
+    Render every registered metric in the Prometheus text exposition format (version 0.0.4).
+
+    :return: The metrics as a string
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def timed(histogram, *labels):
+    """
+    Decorator observing the duration of each call of a function in a histogram.
+
+    :param histogram: The Histogram
+    :param labels: Label values of the observations
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(*labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_request_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _observe_response(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, request.endpoint or 'none', str(response.status_code))
+    return response
+
+
+def _observe_failure(exception):
+    # Requests failing with an unhandled exception never reach after_request
+    started = g.pop('metrics_started', None)
+    if started is not None and exception is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, request.endpoint or 'none', '500')
+
+
+def init_app(app):
+    """
+    Record the latency of every request of `app` in REQUEST_LATENCY (when METRICS_ENABLED).
+
+    Requests without an endpoint (404s) are labeled "none", so unknown URLs don't create labels.
+
+    :param app: The Flask application
+    """
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_response)
+    app.teardown_request(_observe_failure)
@@ -0,0 +1,175 @@
+"""
+Normalized Attribute Queries for ESN Matchmaking System
+
+Languages, nationalities, faculties and interests are stored as JSON columns on Buddy and
+Esner, and mirrored in the normalized ProfileLanguage, ProfileNationality, ProfileFaculty and
+ProfileInterest tables (one row per selected value, keyed by the options.json vocabulary id).
+This module runs the filters and overlap counts on those tables in SQL.
+
+The rows of a profile are only valid while its encoding_version is the current vocabulary
+version and its bitmask could be encoded; other profiles are reported as not normalized and
+have to be handled in Python from their JSON columns.
+
+Functions:
+- value_id(column, value): Returns the vocabulary id of a value.
+- profile_ids_with_value(column, value, profile_type): Returns the ids of the profiles having a value.
+- has_value(column, value, profile_type): Returns a filter condition selecting the profiles having a value.
+- overlap_counts(buddy_id, column): Counts the values each Esner shares with a Buddy.
+- candidate_esner_ids(buddy_id): Returns the Esners sharing at least one value with a Buddy.
+- prune(): Removes the rows of deleted profiles.
+"""
+
+import json
+
+from sqlalchemy import and_, func, or_, select, union
+from sqlalchemy.orm import aliased
+
+from database.db import db
+from database.tables import ATTRIBUTE_TABLES, Buddy, Esner
+from utils.match import NOT_INTERESTED
+from utils.profile_encoding import ENCODED_COLUMNS, get_vocabulary_index, get_vocabulary_version
+
+PROFILE_MODELS = {'buddy': Buddy, 'esner': Esner}
+
+
+def value_id(column, value):
+    """
+    Return the vocabulary id of a value.
+
+    :param column: JSON column of the attribute (e.g. 'languages_spoken')
+    :param value: The value, as selected in the forms
+    :return: The id, or None when the value is not in options.json
+    """
+    return get_vocabulary_index()[ENCODED_COLUMNS[column]].get(value)
+
+
+def _normalized(model, column):
+    """Condition selecting the profiles whose rows of `column` are up to date."""
+    return and_(model.encoding_version == get_vocabulary_version(), getattr(model, column + '_bits').isnot(None))
+
+
+def _not_normalized(model, column):
+    """Condition selecting the profiles whose rows of `column` can't be used (NULL-safe)."""
+    return or_(
+        model.encoding_version.is_(None),
+        model.encoding_version != get_vocabulary_version(),
+        getattr(model, column + '_bits').is_(None),
+    )
+
+
+def profile_ids_with_value(column, value, profile_type='buddy'):
+    """
+    Return the ids of the profiles that selected a value, e.g. the Buddies speaking Italian.
+
+    :param column: JSON column of the attribute (e.g. 'languages_spoken')
+    :param value: The value to look for
+    :param profile_type: "buddy" or "esner"
+    :return: Sorted list of ids
+    """
+    value = value_id(column, value)
+    if value is None:
+        return []
+    table = ATTRIBUTE_TABLES[column]
+    model = PROFILE_MODELS[profile_type]
+    rows = (
+        db.session.query(table.profile_id)
+        .join(model, model.id == table.profile_id)
+        .filter(table.profile_type == profile_type, table.value_id == value, _normalized(model, column))
+        .order_by(table.profile_id)
+    )
+    return [profile_id for profile_id, in rows]
+
+
+def has_value(column, value, profile_type='buddy'):
+    """
+    Return a condition selecting the profiles that selected a value, to filter a query.
+
+    Normalized profiles are looked up in the attribute table; the others are matched on
+    their JSON column.
+
+    :param column: JSON column of the attribute (e.g. 'languages_spoken')
+    :param value: The value to look for
+    :param profile_type: "buddy" or "esner"
+    :return: SQL expression usable in `query.filter()`
+    """
+    model = PROFILE_MODELS[profile_type]
+    in_json = getattr(model, column).contains(json.dumps(value), autoescape=True)
+    value = value_id(column, value)
+    if value is None:
+        return in_json
+    table = ATTRIBUTE_TABLES[column]
+    in_table = model.id.in_(
+        select(table.profile_id).where(table.profile_type == profile_type, table.value_id == value)
+    )
+    return or_(and_(_normalized(model, column), in_table), and_(_not_normalized(model, column), in_json))
+
+
+def overlap_counts(buddy_id, column):
+    """
+    Count the values of an attribute each Esner shares with a Buddy.
+
+    Only normalized Esners are counted; Esners sharing nothing are left out.
+
+    :param buddy_id: Id of the Buddy
+    :param column: JSON column of the attribute (e.g. 'languages_spoken')
+    :return: Dictionary {esner_id: shared values}
+    """
+    table = ATTRIBUTE_TABLES[column]
+    buddy_rows = aliased(table)
+    rows = (
+        db.session.query(table.profile_id, func.count())
+        .join(buddy_rows, buddy_rows.value_id == table.value_id)
+        .join(Esner, Esner.id == table.profile_id)
+        .filter(
+            buddy_rows.profile_type == 'buddy', buddy_rows.profile_id == buddy_id,
+            table.profile_type == 'esner', _normalized(Esner, column),
+        )
+        .group_by(table.profile_id)
+    )
+    return dict(rows.all())
+
+
+def candidate_esner_ids(buddy_id):
+    """
+    Return the Esners sharing at least one language, nationality, faculty or interest with a Buddy.
+
+    Like `CandidateIndex`, "Not interested" never makes two profiles overlap. Esners that are
+    not fully normalized can't be filtered in SQL and are always returned.
+
+    :param buddy_id: Id of the Buddy
+    :return: Set of Esner ids, or None when the Buddy itself is not normalized
+    """
+    buddy_normalized = db.session.query(
+        db.session.query(Buddy.id)
+        .filter(Buddy.id == buddy_id, *(_normalized(Buddy, column) for column in ATTRIBUTE_TABLES))
+        .exists()
+    ).scalar()
+    if not buddy_normalized:
+        return None
+
+    shared = []
+    for column, table in ATTRIBUTE_TABLES.items():
+        buddy_rows = aliased(table)
+        query = (
+            select(table.profile_id)
+            .join(buddy_rows, buddy_rows.value_id == table.value_id)
+            .where(buddy_rows.profile_type == 'buddy', buddy_rows.profile_id == buddy_id, table.profile_type == 'esner')
+        )
+        not_interested = value_id(column, NOT_INTERESTED)
+        if not_interested is not None:
+            query = query.where(table.value_id != not_interested)
+        shared.append(query)
+    shared.append(
+        select(Esner.id).where(or_(*(_not_normalized(Esner, column) for column in ATTRIBUTE_TABLES)))
+    )
+    return set(db.session.execute(union(*shared)).scalars())
+
+
+def prune():
+    """Remove the rows of profiles deleted with bulk queries (e.g. `Buddy.query.delete()`)."""
+    for table in ATTRIBUTE_TABLES.values():
+        for profile_type, model in PROFILE_MODELS.items():
+            table.query.filter(
+                table.profile_type == profile_type,
+                ~table.profile_id.in_(select(model.id)),
+            ).delete(synchronize_session=False)
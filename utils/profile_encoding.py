@@ -0,0 +1,157 @@
+"""
+Profile Bit Encoding for ESN Matchmaking System
+
+This module encodes the JSON attribute columns of Buddies and Esners (languages, nationalities,
+faculties and interests) as compact bitmasks indexed by the vocabulary in `options.json`.
+The bitmasks are stored next to the JSON columns so the matcher can compute intersections
+and unions with popcounts instead of decoding JSON and building sets.
+
+Encoding:
+- Bit `k` of an attribute mask is set when the profile selected the k-th option of that
+  attribute in options.json (duplicates removed, original order kept).
+- Masks are stored as little-endian packed 64-bit words, so a stored value can be viewed
+  directly as an array of uint64.
+- Every encoded row records the vocabulary version it was encoded with. When options.json
+  changes, older rows no longer match the current version and are decoded from JSON again.
+- Values that are not in the vocabulary cannot be encoded: the mask is left empty (None) and
+  the JSON column remains the source of truth for that profile.
+
+Functions:
+- get_vocabulary(): Returns the ordered vocabulary of each attribute.
+- get_vocabulary_version(): Returns a short fingerprint of the vocabulary.
+- encode_values(attribute, values): Encodes a list of values as packed bytes, or None.
+- decode_bits(attribute, bits): Decodes packed bytes back into the list of values.
+- decode_ids(bits): Decodes packed bytes into the vocabulary ids (bit positions) of the values.
+- get_stored_bits(profile): Returns the stored masks of a profile when they are up to date.
+"""
+
+import functools
+import hashlib
+import json
+import os
+
+OPTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'options.json')
+
+# JSON column of the Buddy/Esner models -> vocabulary key in options.json
+ENCODED_COLUMNS = {
+    'languages_spoken': 'languages',
+    'nationality': 'nationalities',
+    'faculty': 'faculties',
+    'interests': 'interests',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_vocabulary():
+    """
+    Loads the attribute vocabularies from options.json once per process.
+
+    :return: Dictionary mapping each vocabulary key to a tuple of unique values.
+    """
+    with open(OPTIONS_FILE, 'r') as file:
+        options = json.load(file)
+    return {
+        attribute: tuple(dict.fromkeys(options.get(attribute, [])))
+        for attribute in ENCODED_COLUMNS.values()
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_vocabulary_index():
+    """
+    Returns the bit position of every value of every attribute.
+
+    :return: Dictionary mapping each vocabulary key to a {value: bit} dictionary.
+    """
+    return {
+        attribute: {value: bit for bit, value in enumerate(values)}
+        for attribute, values in get_vocabulary().items()
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_vocabulary_version():
+    """
+    Returns a short fingerprint of the vocabulary, stored with every encoded row.
+
+    :return: A 16 character hexadecimal string.
+    """
+    canonical = json.dumps(get_vocabulary(), sort_keys=True).encode('utf-8')
+    return hashlib.sha1(canonical).hexdigest()[:16]
+
+
+def word_count(size):
+    """Number of 64-bit words needed to hold `size` bits (at least one)."""
+    return max(1, (size + 63) // 64)
+
+
+def mask_to_bytes(mask, size):
+    """Packs an integer bitmask of `size` bits into little-endian 64-bit words."""
+    return mask.to_bytes(word_count(size) * 8, 'little')
+
+
+def encode_values(attribute, values):
+    """
+    Encodes the values of an attribute as a packed bitmask.
+
+    :param attribute: Vocabulary key (e.g. 'languages')
+    :param values: List of selected values, as stored in the JSON column
+    :return: Packed bytes, or None when the values can't be represented by the vocabulary.
+    """
+    if not isinstance(values, list):
+        return None
+    index = get_vocabulary_index()[attribute]
+    mask = 0
+    for value in values:
+        if not isinstance(value, str) or value not in index:
+            return None
+        mask |= 1 << index[value]
+    return mask_to_bytes(mask, len(index))
+
+
+def decode_bits(attribute, bits):
+    """
+    Decodes a packed bitmask back into the list of values, in vocabulary order.
+
+    :param attribute: Vocabulary key (e.g. 'languages')
+    :param bits: Packed bytes produced by `encode_values`
+    :return: List of values.
+    """
+    mask = int.from_bytes(bits, 'little')
+    vocabulary = get_vocabulary()[attribute]
+    return [value for bit, value in enumerate(vocabulary) if mask >> bit & 1]
+
+
+def decode_ids(bits):
+    """
+    Decodes a packed bitmask into the vocabulary ids of its values.
+
+    :param bits: Packed bytes produced by `encode_values`
+    :return: Sorted list of bit positions.
+    """
+    mask = int.from_bytes(bits, 'little')
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return ids
+
+
+def get_stored_bits(profile):
+    """
+    Returns the stored bitmasks of a Buddy or Esner when all of them are up to date.
+
+    :param profile: A Buddy or Esner instance
+    :return: Dictionary mapping each vocabulary key to packed bytes, or None when the profile
+             has to be decoded from its JSON columns.
+    """
+    if getattr(profile, 'encoding_version', None) != get_vocabulary_version():
+        return None
+    stored = {}
+    for column, attribute in ENCODED_COLUMNS.items():
+        bits = getattr(profile, column + '_bits', None)
+        if bits is None:
+            return None
+        stored[attribute] = bytes(bits)
+    return stored
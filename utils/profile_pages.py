@@ -0,0 +1,213 @@
+"""
+Keyset-Paginated Profile Lists for ESN Matchmaking System
+
+The manual match page lists every Buddy and Esner. Rendering all of them in one response
+makes the page weight and the server time grow with the tables, so the page loads them in
+pages from JSON endpoints instead, using keyset pagination: each page is fetched with
+`WHERE (sort key) > (last sort key of the previous page) ORDER BY sort key LIMIT n`, which
+costs the same for the first and the last page (unlike OFFSET, which rescans the skipped rows).
+
+Sort keys:
+- Buddies: unmatched first, then by id (the registration order).
+- Esners: by the indexed buddy_count counter, then by id.
+
+The cursor returned with a page is the sort key of its last row, encoded as an opaque
+URL-safe string. Since the Esner sort key contains buddy_count, an Esner matched while the
+list is being scrolled can appear twice or be skipped until the list is reloaded.
+
+Functions:
+- encode_cursor(key): Encodes a sort key as a cursor.
+- decode_cursor(cursor): Decodes a cursor back into a sort key.
+- buddy_page(filters, after, limit): Returns a page of Buddies as JSON-ready dictionaries.
+- esner_page(filters, after, limit): Returns a page of Esners as JSON-ready dictionaries.
+"""
+
+import base64
+import binascii
+import json
+
+from sqlalchemy import case, or_, tuple_
+
+from database.db import db
+from database.tables import Buddy, Esner
+from utils import profile_attributes
+
+# Upper bound of the `limit` parameter, whatever the client asks for
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(key):
+    """
+    Encode the sort key of a row as a cursor.
+
+    :param key: Sequence of JSON-serializable values
+    :return: URL-safe string
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor returned by `encode_cursor`.
+
+    :param cursor: The cursor string
+    :return: The sort key as a list
+    :raises ValueError: When the cursor is malformed
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or not all(isinstance(value, int) for value in key):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def _json_list(value):
+    """Decode a JSON list column, returning an empty list for missing or invalid values."""
+    try:
+        decoded = json.loads(value) if value else []
+    except ValueError:
+        return []
+    return decoded if isinstance(decoded, list) else []
+
+
+def _search(model, text):
+    """Condition matching `text` in the id, name, surname or email of a profile."""
+    pattern = f"%{text}%"
+    conditions = [model.name.ilike(pattern), model.surname.ilike(pattern), model.email.ilike(pattern)]
+    if text.isdigit():
+        conditions.append(model.id == int(text))
+    return or_(*conditions)
+
+
+def _page(query, sort_key, after, limit):
+    """
+    Fetch one page of `query` ordered by `sort_key`, after the row whose key is `after`.
+
+    :return: Tuple (rows, has_more)
+    """
+    if after is not None:
+        query = query.filter(tuple_(*sort_key) > tuple_(*after))
+    rows = query.order_by(*sort_key).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _common_filters(query, model, profile_type, filters):
+    """Apply the gender, language and search filters shared by Buddies and Esners."""
+    if filters.get('gender'):
+        query = query.filter(model.gender == filters['gender'])
+    if filters.get('language'):
+        query = query.filter(profile_attributes.has_value('languages_spoken', filters['language'], profile_type))
+    if filters.get('q'):
+        query = query.filter(_search(model, filters['q']))
+    return query
+
+
+def buddy_page(filters, after=None, limit=50):
+    """
+    Return a page of Buddies, unmatched first.
+
+    :param filters: Dictionary with the optional filters `matched` (True or False), `semester`,
+                    `gender`, `language` (a languages_spoken value) and `q` (search text)
+    :param after: Sort key of the last Buddy of the previous page (see `decode_cursor`)
+    :param limit: Number of Buddies per page, at most MAX_PAGE_SIZE
+    :return: Dictionary with the `items`, the `next_cursor` (None on the last page) and, on
+             the first page, the `total` number of Buddies matching the filters
+    """
+    matched = case((Buddy.esn_member_id.isnot(None), 1), else_=0)
+    query = Buddy.query
+    if filters.get('matched') is not None:
+        query = query.filter(Buddy.esn_member_id.isnot(None) if filters['matched'] else Buddy.esn_member_id.is_(None))
+    if filters.get('semester'):
+        query = query.filter(Buddy.semester == filters['semester'])
+    query = _common_filters(query, Buddy, 'buddy', filters)
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    buddies, has_more = _page(query, (matched, Buddy.id), after, limit)
+    items = [{
+        'id': buddy.id,
+        'name': buddy.name,
+        'surname': buddy.surname,
+        'gender': buddy.gender,
+        'nationality': _json_list(buddy.nationality),
+        'languages_spoken': _json_list(buddy.languages_spoken),
+        'faculty': _json_list(buddy.faculty),
+        'interests': _json_list(buddy.interests),
+        'description': buddy.description,
+        'semester': buddy.semester,
+        'year': buddy.year,
+        'phone_number': buddy.phone_number,
+        'email': buddy.email,
+        'instagram': buddy.instagram,
+        'telegram': buddy.telegram,
+        'esn_member_id': buddy.esn_member_id,
+    } for buddy in buddies]
+
+    page = {'items': items, 'next_cursor': None}
+    if has_more:
+        last = buddies[-1]
+        page['next_cursor'] = encode_cursor((int(last.esn_member_id is not None), last.id))
+    if after is None:
+        page['total'] = query.order_by(None).count()
+    return page
+
+
+def esner_page(filters, after=None, limit=50):
+    """
+    Return a page of Esners, the ones with the fewest Buddies first.
+
+    :param filters: Dictionary with the optional filters `available` (True for the Esners
+                    below their max_number_of_buddy, False for the full ones), `gender`,
+                    `language` (a languages_spoken value) and `q` (search text)
+    :param after: Sort key of the last Esner of the previous page (see `decode_cursor`)
+    :param limit: Number of Esners per page, at most MAX_PAGE_SIZE
+    :return: Dictionary with the `items` (including the ids of their Buddies), the
+             `next_cursor` (None on the last page) and, on the first page, the `total`
+             number of Esners matching the filters
+    """
+    query = Esner.query
+    if filters.get('available') is not None:
+        available = Esner.buddy_count < Esner.max_number_of_buddy
+        query = query.filter(available if filters['available'] else ~available)
+    query = _common_filters(query, Esner, 'esner', filters)
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    esners, has_more = _page(query, (Esner.buddy_count, Esner.id), after, limit)
+
+    # One query for the Buddies of the whole page instead of one `esner.buddies` load per Esner
+    buddy_ids = {esner.id: [] for esner in esners}
+    if esners:
+        rows = (
+            db.session.query(Buddy.esn_member_id, Buddy.id)
+            .filter(Buddy.esn_member_id.in_(list(buddy_ids)))
+            .order_by(Buddy.id)
+        )
+        for esner_id, buddy_id in rows:
+            buddy_ids[esner_id].append(buddy_id)
+
+    items = [{
+        'id': esner.id,
+        'name': esner.name,
+        'surname': esner.surname,
+        'type': esner.type,
+        'gender': esner.gender,
+        'nationality': _json_list(esner.nationality),
+        'languages_spoken': _json_list(esner.languages_spoken),
+        'faculty': _json_list(esner.faculty),
+        'interests': _json_list(esner.interests),
+        'description': esner.description,
+        'max_number_of_buddy': esner.max_number_of_buddy,
+        'buddy_count': esner.buddy_count,
+        'buddy_ids': buddy_ids[esner.id],
+        'email': esner.email,
+        'phone_number': esner.phone_number,
+    } for esner in esners]
+
+    page = {'items': items, 'next_cursor': None}
+    if has_more:
+        last = esners[-1]
+        page['next_cursor'] = encode_cursor((last.buddy_count, last.id))
+    if after is None:
+        page['total'] = query.order_by(None).count()
+    return page
@@ -0,0 +1,203 @@
+"""
+On-Demand Request Profiler for ESN Matchmaking System
+
+An admin can profile any request by adding `?profile=1` to its URL or by sending the
+`X-Profile: 1` header. The request then runs under cProfile and its report is stored on disk:
+the top functions by cumulative time, the total time and the SQL statements and time of the
+request (from the instrumentation of database.db). Reports are listed and downloaded from the
+admin profiles page.
+
+Storage:
+- Reports are written to PROFILER_DIR (default: `profiles` in the instance folder), one JSON
+  summary and one raw `.prof` file (readable with pstats or snakeviz) per request.
+- The directory is a ring buffer: once PROFILER_MAX_REPORTS reports are stored, the oldest
+  ones are deleted.
+
+Requests without the switch only pay for a check of one query parameter and one header. The
+switch is ignored for anyone who is not an admin.
+
+Functions:
+- init_app(app): Registers the profiling hooks (after the blueprints, which load `g.esner`).
+- list_reports(): Returns the summaries of the stored reports, newest first.
+- load_report(report_id): Returns the summary of a report.
+- report_path(report_id, extension): Returns the path of a stored file of a report.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app, g, request
+
+from database.db import get_query_stats
+
+REPORT_ID = re.compile(r'^[0-9]{20}-[0-9a-f]{8}$')
+TOP_FUNCTIONS = 40  # Functions kept in the summary, by cumulative time
+
+
+def _directory():
+    """Directory of the reports, created when needed."""
+    directory = current_app.config.get("PROFILER_DIR") or os.path.join(current_app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def report_path(report_id, extension):
+    """
+    Return the path of a stored file of a report.
+
+    :param report_id: Identifier of the report
+    :param extension: "json" (summary) or "prof" (raw cProfile data)
+    :return: The path, or None for a malformed identifier
+    """
+    if not REPORT_ID.match(report_id) or extension not in ('json', 'prof'):
+        return None
+    return os.path.join(_directory(), f"{report_id}.{extension}")
+
+
+def _requested():
+    """Whether the request asks to be profiled, by an admin."""
+    if request.args.get('profile') != '1' and request.headers.get('X-Profile') != '1':
+        return False
+    esner = g.get('esner')
+    return esner is not None and esner.admin
+
+
+def _start_profile():
+    if not _requested():
+        return
+    stats = get_query_stats()
+    g.profile = {
+        'profiler': cProfile.Profile(),
+        'started': time.perf_counter(),
+        'sql': (stats.count, stats.seconds) if stats else None,
+    }
+    g.profile['profiler'].enable()
+
+
+def _stop_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profile['profiler'].disable()
+    elapsed = time.perf_counter() - profile['started']
+    try:
+        _save_report(profile, elapsed, response.status_code)
+    except OSError as e:
+        print(f"Could not store the profile of {request.path}: {e}")
+    return response
+
+
+def _discard_profile(exception):
+    # A request failing with an unhandled exception never reaches after_request
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile['profiler'].disable()
+
+
+def _save_report(profile, elapsed, status):
+    """Write the summary and raw data of a profiled request and trim the ring buffer."""
+    sql_count = sql_seconds = None
+    stats = get_query_stats()
+    if profile['sql'] is not None and stats is not None:
+        sql_count = stats.count - profile['sql'][0]
+        sql_seconds = stats.seconds - profile['sql'][1]
+
+    text = io.StringIO()
+    function_stats = pstats.Stats(profile['profiler'], stream=text)
+    function_stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    top = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in sorted(
+            function_stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]:
+        top.append({
+            'function': f"{filename}:{line}({name})",
+            'calls': calls,
+            'own_seconds': own,
+            'cumulative_seconds': cumulative,
+        })
+
+    now = datetime.utcnow()
+    report_id = f"{now:%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    summary = {
+        'id': report_id,
+        'created_at': now.isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': status,
+        'esner_id': g.esner.id,
+        'seconds': elapsed,
+        'sql_count': sql_count,
+        'sql_seconds': sql_seconds,
+        'top': top,
+        'text': text.getvalue(),
+    }
+    directory = _directory()
+    function_stats.dump_stats(os.path.join(directory, f"{report_id}.prof"))
+    with open(os.path.join(directory, f"{report_id}.json"), 'w') as file:
+        json.dump(summary, file)
+
+    # Identifiers start with the date, so sorting them sorts the reports by age
+    reports = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for old in reports[:-current_app.config.get("PROFILER_MAX_REPORTS", 20)]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(directory, f"{old}.{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def list_reports():
+    """
+    Return the summaries of the stored reports, newest first, without their text and top functions.
+
+    :return: List of dictionaries
+    """
+    directory = _directory()
+    reports = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        summary = load_report(name[:-5])
+        if summary is not None:
+            summary.pop('text', None)
+            summary.pop('top', None)
+            reports.append(summary)
+    return reports
+
+
+def load_report(report_id):
+    """
+    Return the summary of a report.
+
+    :param report_id: Identifier of the report
+    :return: Dictionary, or None when the report doesn't exist (or was rotated out)
+    """
+    path = report_path(report_id, 'json')
+    if path is None:
+        return None
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def init_app(app):
+    """
+    Register the profiling hooks on `app`.
+
+    Must be called after the blueprints are registered, so that the hook loading `g.esner`
+    runs before the one checking that the user is an admin.
+
+    :param app: The Flask application
+    """
+    app.before_request(_start_profile)
+    app.after_request(_stop_profile)
+    app.teardown_request(_discard_profile)
@@ -0,0 +1,311 @@
+"""
+Persisted Match Score Store for ESN Matchmaking System
+
+This module keeps the Buddy x Esner score matrix in the database so the automatic match page
+doesn't recompute it from scratch on every visit. Only the static part of each score (gender,
+languages, nationalities, faculties and interests) is stored; the availability part depends on
+the current number of Buddies of each Esner and is added when the matrix is read.
+
+Maintenance (all in write requests or background jobs; reading the matrix writes nothing):
+- A new Buddy adds one MatchScoreRow, scored against every existing Esner column.
+- A new or edited Esner gets a new stamp, which marks its column stale in every stored row:
+  reads compute it in memory until the next match job or `flask match fill-score-store`
+  stores it again, outside the request.
+- A capacity change (max_number_of_buddy or assigned Buddies) touches nothing: the
+  availability term is always computed at read time.
+- A deleted Esner frees its position, reused by the next new column. Stamps come from a
+  shared counter and are never reused, so the entries left behind are never read, and rows
+  are truncated past the highest position in use when they are rewritten.
+- Profiles changed outside the hooked routes are detected through their attributes hash:
+  their entries are computed at read time, and stored again by the next match job or
+  `flask match fill-score-store`, so the stored matrix never serves stale scores.
+
+Functions:
+- load_match_matrix(buddies, esners, weights=None, write_back=False): Returns the score matrix, computing only missing or stale entries.
+- store_buddy(buddy, weights=None): Adds the row of a new Buddy.
+- refresh_esner(esner, weights=None): Marks the column of a new or edited Esner stale.
+- forget_buddy(buddy_id), forget_esner(esner_id), clear(): Remove stored rows and columns.
+"""
+
+import hashlib
+import itertools
+import json
+
+import numpy as np
+from sqlalchemy import func
+
+from database.db import db
+from database.tables import Esner, MatchScoreColumn, MatchScoreRow
+from utils import counters
+from utils.match import (
+    availability_scores, encode_cohorts, finalize_scores, get_recommended_weights, static_scores
+)
+
+# Maximum number of ids matched with IN (...), larger lists are read by id range
+QUERY_CHUNK_SIZE = 500
+
+# Counter the column stamps are drawn from
+GENERATION_COUNTER = 'match_score_generation'
+
+
+def profile_hash(profile, weights):
+    """
+    Fingerprint of everything the static score of a profile depends on.
+
+    :param profile: A Buddy or Esner instance
+    :param weights: Dictionary of attribute weights
+    :return: A 40 character hexadecimal string
+    """
+    key = json.dumps([
+        profile.gender, profile.languages_spoken, profile.nationality, profile.faculty,
+        profile.interests, sorted(weights.items())
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _query_by_ids(model, key, ids):
+    """
+    Return the instances of a model whose key is in ids, in a single query.
+
+    Up to QUERY_CHUNK_SIZE ids are matched with IN (...). Larger lists (a whole cohort) read
+    the range between the lowest and highest id and drop the other instances, so the
+    automatic match page runs the same number of statements whatever the size of the cohorts.
+
+    :param model: MatchScoreColumn or MatchScoreRow
+    :param key: Its primary key column
+    :param ids: List of ids
+    :return: List of instances
+    """
+    if not ids:
+        return []
+    if len(ids) <= QUERY_CHUNK_SIZE:
+        return model.query.filter(key.in_(ids)).all()
+    wanted = set(ids)
+    return [
+        instance for instance in model.query.filter(key.between(min(ids), max(ids)))
+        if getattr(instance, key.key) in wanted
+    ]
+
+
+def _allocate_columns(esners, hashes, existing):
+    """
+    Give new stamps to the given Esners, and positions to those without a column.
+
+    Stamps come from the 'match_score_generation' counter, whose row stays locked until the
+    caller commits: concurrent allocations are serialized, so the free positions read here
+    can't be taken by another transaction in the meantime. New columns take the lowest free
+    positions, reusing those of deleted Esners; their stored entries carry older stamps and
+    are never read.
+
+    :param esners: List of Esner instances needing a stamp
+    :param hashes: Dictionary {esner id: attributes hash}
+    :param existing: Dictionary {esner id: MatchScoreColumn}, updated with the new columns
+    """
+    last_stamp = counters.increment(GENERATION_COUNTER, len(esners))
+    stamps = iter(range(last_stamp - len(esners) + 1, last_stamp + 1))
+
+    used = {position for position, in db.session.query(MatchScoreColumn.position)}
+    free = (position for position in itertools.count() if position not in used)
+    for esner in esners:
+        column = existing.get(esner.id)
+        if column is None:
+            column = existing[esner.id] = MatchScoreColumn(esner_id=esner.id, position=next(free))
+            db.session.add(column)
+        column.generation = next(stamps)
+        column.attributes_hash = hashes[esner.id]
+
+
+def _sync_columns(esners, weights, update):
+    """
+    Return the store column of each Esner.
+
+    :param esners: List of Esner instances
+    :param weights: Dictionary of attribute weights
+    :param update: Whether to create the columns of Esners that have none and give a new stamp
+                   to those whose profile changed. Otherwise nothing is written.
+    :return: List aligned with esners; without update, None for Esners whose column is
+             missing or stale
+    """
+    existing = {
+        column.esner_id: column
+        for column in _query_by_ids(MatchScoreColumn, MatchScoreColumn.esner_id, [esner.id for esner in esners])
+    }
+
+    hashes = {esner.id: profile_hash(esner, weights) for esner in esners}
+    outdated = [
+        esner for esner in esners
+        if esner.id not in existing or existing[esner.id].attributes_hash != hashes[esner.id]
+    ]
+    if not update:
+        outdated_ids = {esner.id for esner in outdated}
+        return [None if esner.id in outdated_ids else existing[esner.id] for esner in esners]
+    if outdated:
+        _allocate_columns(outdated, hashes, existing)
+    return [existing[esner.id] for esner in esners]
+
+
+def _stored_width():
+    """Length of the row arrays: one past the highest position in use."""
+    return (db.session.query(func.max(MatchScoreColumn.position)).scalar() or -1) + 1
+
+
+def _load_rows(buddies):
+    """Load the stored rows of the given Buddies, keyed by Buddy id."""
+    return {
+        row.buddy_id: row
+        for row in _query_by_ids(MatchScoreRow, MatchScoreRow.buddy_id, [buddy.id for buddy in buddies])
+    }
+
+
+def _write_row(row, buddy_id, row_hash, positions, generations, values, width):
+    """
+    Write the given entries into a stored row.
+
+    The arrays are resized to `width`, dropping the entries past the highest position in use
+    (positions freed by deleted Esners).
+
+    :return: The MatchScoreRow (new or updated)
+    """
+    width = max(width, int(positions.max()) + 1 if len(positions) else 0)
+    new_scores = np.full(width, np.nan, dtype='<f8')
+    new_stamps = np.full(width, -1, dtype='<i8')
+    if row is not None and row.attributes_hash == row_hash:
+        scores = np.frombuffer(row.scores, dtype='<f8')[:width]
+        stamps = np.frombuffer(row.generations, dtype='<i8')[:width]
+        new_scores[:len(scores)] = scores
+        new_stamps[:len(stamps)] = stamps
+    new_scores[positions] = values
+    new_stamps[positions] = generations
+
+    if row is None:
+        row = MatchScoreRow(buddy_id=buddy_id)
+        db.session.add(row)
+    row.attributes_hash = row_hash
+    row.scores = new_scores.tobytes()
+    row.generations = new_stamps.tobytes()
+    return row
+
+
+def load_match_matrix(buddies, esners, weights=None, write_back=False):
+    """
+    Read the score matrix of the given cohorts from the store.
+
+    Entries that are missing (new Buddies or Esners) or stale (edited profiles) are computed
+    with the batch scorer; everything else is read from the stored rows. By default nothing
+    is written, so page views stay read-only: only the background match jobs and
+    `flask match fill-score-store` pass write_back, which also creates the missing columns,
+    and the caller then commits the session.
+
+    :param buddies: List of Buddy instances
+    :param esners: List of Esner instances
+    :param weights: Optional dictionary specifying weights for attributes
+    :param write_back: Whether to store the computed entries
+    :return: Tuple (matrix, stats): the (buddies x esners) score matrix, identical to
+             `compute_match_matrix`, and a dict with the numbers of 'stored' and 'computed' entries
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+
+    columns = _sync_columns(esners, weights, update=write_back)
+    # Missing or stale columns (read-only mode) get position -1: never read from the rows
+    positions = np.array([-1 if column is None else column.position for column in columns], dtype=np.int64)
+    generations = np.array([-1 if column is None else column.generation for column in columns], dtype=np.int64)
+    known = np.flatnonzero(positions >= 0)
+    rows = _load_rows(buddies)
+
+    static = np.full((len(buddies), len(esners)), np.nan)
+    row_hashes = []
+    for i, buddy in enumerate(buddies):
+        row_hash = profile_hash(buddy, weights)
+        row_hashes.append(row_hash)
+        row = rows.get(buddy.id)
+        if row is None or row.attributes_hash != row_hash:
+            continue
+        scores = np.frombuffer(row.scores, dtype='<f8')
+        stamps = np.frombuffer(row.generations, dtype='<i8')
+        present = known[positions[known] < len(scores)]
+        fresh = present[stamps[positions[present]] == generations[present]]
+        static[i, fresh] = scores[positions[fresh]]
+
+    missing_buddies, missing_esners = np.nonzero(np.isnan(static))
+    if len(missing_buddies):
+        encoded_buddies, encoded_esners, _ = encode_cohorts(buddies, esners)
+        static[missing_buddies, missing_esners] = static_scores(
+            encoded_buddies, missing_buddies, encoded_esners, missing_esners, weights
+        )
+        if write_back:
+            width = _stored_width()
+            for i in np.unique(missing_buddies):
+                buddy = buddies[i]
+                _write_row(rows.get(buddy.id), buddy.id, row_hashes[i], positions, generations, static[i], width)
+
+    matrix = finalize_scores(static, availability_scores(esners)[None, :], weights)
+    stats = {'stored': int(static.size - len(missing_buddies)), 'computed': int(len(missing_buddies))}
+    return matrix, stats
+
+
+def store_buddy(buddy, weights=None):
+    """
+    Add the row of a newly registered Buddy, scored against every Esner that has a column.
+
+    The Buddy must have been flushed (it needs an id). The caller commits the session.
+
+    :param buddy: The new Buddy instance
+    :param weights: Optional dictionary specifying weights for attributes
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+
+    esners = Esner.query.join(MatchScoreColumn, MatchScoreColumn.esner_id == Esner.id).all()
+    columns = _sync_columns(esners, weights, update=True)
+    positions = np.array([column.position for column in columns], dtype=np.int64)
+    generations = np.array([column.generation for column in columns], dtype=np.int64)
+
+    values = np.empty(0)
+    if esners:
+        encoded_buddies, encoded_esners, _ = encode_cohorts([buddy], esners)
+        values = static_scores(
+            encoded_buddies, np.zeros(len(esners), dtype=np.int64), encoded_esners, np.arange(len(esners)), weights
+        )
+    row = db.session.get(MatchScoreRow, buddy.id)
+    _write_row(row, buddy.id, profile_hash(buddy, weights), positions, generations, values, _stored_width())
+
+
+def refresh_esner(esner, weights=None):
+    """
+    Register a new or edited Esner in the store.
+
+    A new Esner gets a column, an edited Esner whose scoring attributes changed a new stamp.
+    No row is touched: the entries carrying an older stamp are stale, computed in memory by
+    the reads and stored again for the unmatched Buddies by the next match job or
+    `flask match fill-score-store`. Capacity changes don't touch the store. The Esner must
+    have been flushed, and the caller commits the session.
+
+    :param esner: The Esner instance
+    :param weights: Optional dictionary specifying weights for attributes
+    """
+    if weights is None:
+        weights = get_recommended_weights()
+
+    _sync_columns([esner], weights, update=True)
+
+
+def forget_buddy(buddy_id):
+    """Remove the stored row of a Buddy."""
+    MatchScoreRow.query.filter_by(buddy_id=buddy_id).delete()
+
+
+def forget_esner(esner_id):
+    """
+    Remove the stored column of an Esner.
+
+    Its position is reused by the next new column; the entries left in the rows carry an
+    older stamp and are never read.
+    """
+    MatchScoreColumn.query.filter_by(esner_id=esner_id).delete()
+
+
+def clear():
+    """Remove every stored row and column."""
+    MatchScoreRow.query.delete()
+    MatchScoreColumn.query.delete()